@@ -26,6 +26,20 @@ parser.add_argument("--input", "-i",
                     type=str,
                     help="Path to the input file, without the end '_LT.nc' or '_ST.nc'.")
 
+parser.add_argument("--month-dir",
+                    type=str,
+                    default=None,
+                    help="Clip every init time of a year/month directory instead of a single input.")
+
+parser.add_argument("--workers",
+                    type=int,
+                    default=None,
+                    help="Number of processes clipping the init times of --month-dir.")
+
+parser.add_argument("--keep-inputs",
+                    action="store_true",
+                    help="Keep the input files once the clipped output is verified.")
+
 parser.add_argument("--output", "-o",
                     type=str,
                     help="Path to the output file.")
@@ -52,9 +66,15 @@ parser.add_argument("--lonmax",
 
 args = parser.parse_args()
 
+if args.month_dir:
+    LOG.info(f"Clipping directory {args.month_dir} to Switzerland...")
+    statuses = utils.clip_month(args.month_dir, args.latmin, args.latmax, args.lonmin, args.lonmax, workers=args.workers, keep_inputs=args.keep_inputs)
+    LOG.info(f"Clipped {statuses['clipped']} init times, {statuses['done']} already done, {statuses['failed']} failed.")
+    raise SystemExit(1 if statuses["failed"] else 0)
+
 LOG.info(f"Clipping file {args.input} to Switzerland...")
 
-utils.clip_file(args.input, args.latmin, args.latmax, args.lonmin, args.lonmax, output_path=args.output if not args.in_place else None)
+utils.clip_file(args.input, args.latmin, args.latmax, args.lonmin, args.lonmax, output_path=args.output if not args.in_place else None, keep_inputs=args.keep_inputs)
 
 if args.in_place:
     LOG.info(f"Clipped file saved to {args.input}.")
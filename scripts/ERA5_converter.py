@@ -0,0 +1,94 @@
+def main():
+    import os, sys
+    dev_path = os.path.dirname(__file__)
+    src_path = os.path.join(dev_path, "..", 'src')
+    sys.path.append(src_path)
+
+    import era5Download.EDtoolbox as edtb
+
+    import argparse
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description='Convert the monthly ERA5 GRIB files to netCDF or Zarr over the Swiss domain.')
+
+    parser.add_argument("--input", "-i",
+                        type=str,
+                        default="/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/AI-models-input",
+                        help="Path to the folder of the downloads.")
+
+    parser.add_argument("--output", "-o",
+                        type=str,
+                        required=True,
+                        help="Path to the output folder.")
+
+    parser.add_argument("--months",
+                        type=str,
+                        nargs='+',
+                        required=True,
+                        help="Months to convert, format YYYY-MM, or ranges YYYY-MM:YYYY-MM.")
+
+    parser.add_argument("--kinds",
+                        type=str,
+                        nargs='+',
+                        default=["surface", "upper"],
+                        choices=list(edtb.DATASETS),
+                        help="Kinds of files to convert.")
+
+    parser.add_argument("--variables",
+                        type=str,
+                        nargs='+',
+                        default=None,
+                        help="Variables (GRIB shortName) to keep. By default, all of them.")
+
+    parser.add_argument("--levels",
+                        type=int,
+                        nargs='+',
+                        default=None,
+                        help="Pressure levels to keep, in hPa. By default, all of them.")
+
+    parser.add_argument("--domain",
+                        type=float,
+                        nargs=4,
+                        default=[edtb.SWISS_DOMAIN[key] for key in ("latmin", "latmax", "lonmin", "lonmax")],
+                        metavar=("LATMIN", "LATMAX", "LONMIN", "LONMAX"),
+                        help="Domain to keep.")
+
+    parser.add_argument("--format",
+                        type=str,
+                        default="netcdf",
+                        choices=["netcdf", "zarr"],
+                        help="Format of the outputs.")
+
+    parser.add_argument("--profile",
+                        type=str,
+                        default="archive",
+                        help="Storage profile of the netCDF outputs.")
+
+    parser.add_argument("--workers", "-w",
+                        type=int,
+                        default=None,
+                        help="Number of processes.")
+
+    parser.add_argument("--overwrite",
+                        action="store_true",
+                        help="Convert again the files already converted.")
+
+    args = parser.parse_args()
+
+    months = []
+    for months_range in args.months:
+        start, _, end = months_range.partition(":")
+        months.extend(pd.period_range(start, end or start, freq="M"))
+
+    status = edtb.convertMonths(months, args.input, args.output, kinds=args.kinds, workers=args.workers,
+                                overwrite=args.overwrite, variables=args.variables, levels=args.levels,
+                                domain=dict(zip(("latmin", "latmax", "lonmin", "lonmax"), args.domain)),
+                                format=args.format, profile=args.profile)
+    for toFile, row in status[status["status"] == "failed"].iterrows():
+        print(f"Failed to convert {toFile}: {row['error']}")
+    print(status["status"].value_counts().to_string())
+    if (status["status"] == "failed").any():
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,16 @@
 ERA5 files downloader for PanguWeather.
 """
 
-import pickle
-import cdsapi
 import argparse
 import pandas as pd
-import subprocess
-import numpy as np
 import os
-    
+import sys
+
+dev_path = os.path.dirname(__file__)
+sys.path.append(os.path.join(dev_path, "..", 'src'))
+
+import era5Download.EDtoolbox as edtb
+
 parser = argparse.ArgumentParser(description="Download ERA5 data")
 
 parser.add_argument("--output", "-o",
@@ -36,63 +38,66 @@ parser.add_argument("--month",
                     type=str,
                     help = "Month to download, format MM")
 
+parser.add_argument("--months",
+                    type=str,
+                    nargs="+",
+                    default=[],
+                    help = "Months to download, format YYYY-MM, or ranges YYYY-MM:YYYY-MM.")
+
+parser.add_argument("--storms",
+                    type=str,
+                    default=None,
+                    help = "Storm catalogue (csv or pkl): download the months of the init times needed for its storms.")
+
+parser.add_argument("--lead-times",
+                    type=int,
+                    nargs="+",
+                    default=list(range(6, 168 + 1, 6)),
+                    help = "Lead times of the forecasts of the storms, in hours.")
+
+parser.add_argument("--workers", "-w",
+                    type=int,
+                    default=4,
+                    help = "Number of concurrent retrievals.")
+
+parser.add_argument("--retries",
+                    type=int,
+                    default=5,
+                    help = "Number of retries of a failed retrieval.")
+
+parser.add_argument("--failed-file",
+                    type=str,
+                    default=None,
+                    help = "File to which the failed downloads are appended.")
+
 parser.add_argument("--test",
                     action="store_true",
                     help="Test the downloader.")
 
 args = parser.parse_args()
 
-folder_path =  args.output
-
-
-datas = [('reanalysis-era5-single-levels',
-          "surface",
-          ['mean_sea_level_pressure', '10m_u_component_of_wind', '10m_v_component_of_wind', '2m_temperature'])]*(args.surface or not(args.surface or args.pressure)) +\
-    [('reanalysis-era5-pressure-levels',
-      "upper",
-      ['geopotential', 'specific_humidity', 'temperature', 'u_component_of_wind', 'v_component_of_wind'])]*(args.pressure or not(args.surface or args.pressure))
-
-
-
-c = cdsapi.Client()
-
-
-
-year, month = args.year, args.month
-print(f"Downloading {year}-{month}...")
-
-# Get the days of the month as two-digit int
-days = [f"{num:02}" for num in range(1, pd.to_datetime(f"{year}-{month}").days_in_month + 1)]
-hours = [f"{i:02}" for i in range(24)]
-
-
-for data_origin, variable, variables in datas:
-    if not(args.test):
-        try:
-            os.makedirs(os.path.join(folder_path, year, month), exist_ok=True)
-            
-            variables_to_download = {
-                'product_type': 'reanalysis',
-                'format': 'grib',
-                'variable': variables,
-                'year': year,
-                'month': month,
-                'day': days,
-                'time': hours,
-            }
-            variables_to_download.update(({'pressure_level': ['1000', '925', '850', '700', '600', '500', '400', '300', '250', '200', '150', '100', '50']} if variable == "upper" else {}))
-            
-            c.retrieve(
-            data_origin,
-            variables_to_download,
-            target=os.path.join(folder_path, year, month, f"{year}-{month}_ERA5_{variable}.grib")
-            )
-        except:
-            print(f"Error downloading {year}-{month} for {variable} variables.")
-            with open("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/repos/Scripts/Outputs/failed.txt", 'a') as file:
-                file.write(f"{year}-{month}_{variable}\n")
-    else:
-        print(f"Test: would have downloaded {year}-{month} for {variable} variables.")
-        print(os.path.join(folder_path, year, month, f"{year}-{month}_ERA5_{variable}_ERA5.grib"))
-
-      
\ No newline at end of file
+kinds = ["surface"]*(args.surface or not(args.surface or args.pressure)) + ["upper"]*(args.pressure or not(args.surface or args.pressure))
+
+months = []
+if args.year and args.month:
+    months.append(f"{args.year}-{args.month}")
+for months_range in args.months:
+    start, _, end = months_range.partition(":")
+    months.extend(pd.period_range(start, end or start, freq="M"))
+if args.storms:
+    import stormTracks.STtoolbox as sttb
+    needed = sttb.neededTimes(args.storms, [pd.Timedelta(hours=lead_time) for lead_time in args.lead_times])
+    months.extend(edtb.monthsOf(needed.index))
+
+retrievals = edtb.jobs(months, args.output, kinds)
+missing = [retrieval for retrieval in retrievals if not os.path.exists(retrieval["target"])]
+print(f"{len(retrievals)} files, {len(retrievals) - len(missing)} already downloaded.")
+
+if args.test:
+    for retrieval in missing:
+        print(f"Test: would have downloaded {retrieval['target']}.")
+else:
+    status = edtb.download(missing, workers=args.workers, retries=args.retries, failedFile=args.failed_file)
+    print(status["status"].value_counts().to_string())
+    if (status["status"] == "failed").any():
+        sys.exit(1)
@@ -53,7 +53,12 @@ def main():
     parser.add_argument("--storm-date-id-file",
                         type=str,
                         default=None,
-                        help="The file to load storm date IDs from.")
+                        help="The directory of the date index of the storm file. Built on the fly if not provided.")
+
+    parser.add_argument("--weights-file",
+                        type=str,
+                        default=None,
+                        help="The file of the bilinear weights of the stations on the PW grid. Computed and saved if missing.")
 
     parser.add_argument("--coord",
                         type=str,
@@ -80,8 +85,54 @@ def main():
                         default=None,
                         help="The directory to save data to.")
 
+    parser.add_argument("--profile",
+                        type=str,
+                        default=None,
+                        choices=["archive", "analysis", "training"],
+                        help="The storage profile of the saved data (dtype, chunks and compression).")
+
+    parser.add_argument("--no-cache",
+                        action="store_true",
+                        help="Do not reuse nor store the loaded data in the cache of lrstat.loadData.")
+
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        default=None,
+                        help="The directory of the cache. By default, the pw_smn_cache dataset of the registry.")
+
+    parser.add_argument("--partition-dir",
+                        type=str,
+                        default=None,
+                        help="The directory of the monthly partitions. If provided, only the stale months are rebuilt.")
+
+    parser.add_argument("--workers",
+                        type=int,
+                        default=None,
+                        help="The number of months built in parallel with --partition-dir.")
+
     args = parser.parse_args()
 
+    if args.partition_dir:
+        print("Building partitions with lrstat.buildPartitions...", flush=True)
+        lrstat.buildPartitions(args.partition_dir,
+                               dataVars=args.data_vars,
+                               dirnameStations=args.dirname_stations,
+                               dirnamePW=args.dirname_pangu_weather,
+                               minyear=args.minyear,
+                               maxyear=args.maxyear,
+                               minmonth=args.minmonth,
+                               maxmonth=args.maxmonth,
+                               stormFile=args.storm_file,
+                               stormDateIDFile=args.storm_date_id_file,
+                               weightsFile=args.weights_file,
+                               coord=args.coord,
+                               coords=args.coords,
+                               workers=args.workers)
+        if args.to_file:
+            print("Saving data with lrstat.saveData...", flush=True)
+            lrstat.saveData(lrstat.openPartitions(args.partition_dir), args.to_file, dirpath = args.dirpath, profile = args.profile)
+        return
+
     print("Loading data with lrstat.loadData...", flush=True)
     data = lrstat.loadData(dataVars=args.data_vars,
                     dirnameStations=args.dirname_stations,
@@ -92,12 +143,15 @@ def main():
                     maxmonth=args.maxmonth,
                     stormFile=args.storm_file,
                     stormDateIDFile=args.storm_date_id_file,
+                    weightsFile=args.weights_file,
                     coord=args.coord,
                     coords=args.coords,
-                    fromFile=args.from_file)
+                    fromFile=args.from_file,
+                    cache=not args.no_cache,
+                    cacheDir=args.cache_dir)
 
     print("Saving data with lrstat.saveData...", flush=True)
-    lrstat.saveData(data, args.to_file, dirpath = args.dirpath)
+    lrstat.saveData(data, args.to_file, dirpath = args.dirpath, profile = args.profile)
     
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,53 @@
+def main():
+    import os, sys
+    dev_path = os.path.dirname(__file__)
+    src_path = os.path.join(dev_path, "..", 'src')
+    sys.path.append(src_path)
+
+    import linReg.Statistics as lrstat
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='List and prune the cache of the interpolated PW outputs over SMN stations.')
+
+    parser.add_argument("command",
+                        choices=["list", "prune"],
+                        help="list the entries of the cache, or prune it.")
+
+    parser.add_argument("--cache-dir",
+                        type=str,
+                        default=None,
+                        help="The directory of the cache. By default, the pw_smn_cache dataset of the registry.")
+
+    parser.add_argument("--max-size",
+                        type=float,
+                        default=None,
+                        help="Prune the least recently used entries until the cache is under this size, in GB.")
+
+    parser.add_argument("--older-than",
+                        type=str,
+                        default=None,
+                        help="Prune the entries not used for longer than this duration (e.g. '30D').")
+
+    parser.add_argument("--keys",
+                        type=str,
+                        nargs='+',
+                        default=[],
+                        help="Prune these entries.")
+
+    args = parser.parse_args()
+
+    if args.command == "list":
+        entries = lrstat.cacheEntries(args.cache_dir)
+        for _, entry in entries.iterrows():
+            arguments = entry["arguments"]
+            period = f"{arguments.get('minyear', '?')}-{arguments.get('minmonth', '?')} to {arguments.get('maxyear', '?')}-{arguments.get('maxmonth', '?')}"
+            print(f"{entry['key'][:16]}  {entry['size']/1e9:8.3f} GB  {entry['last_used']:%Y-%m-%d %H:%M}  {period}")
+        print(f"{len(entries)} entries, {entries['size'].sum()/1e9:.3f} GB")
+    else:
+        keys = [key for key in lrstat.cacheEntries(args.cache_dir)["key"] if any(key.startswith(prefix) for prefix in args.keys)]
+        removed = lrstat.pruneCache(args.cache_dir, maxSize = args.max_size, olderThan = args.older_than, keys = keys)
+        print(f"Removed {len(removed)} entries.")
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
-import xarray as xr
 import argparse
+import glob
 import os
 import sys
 
+import utils
+
 def main():
-    parser = argparse.ArgumentParser(description='Test for corrupted netcdf files in given directory')
+    parser = argparse.ArgumentParser(description='Test for corrupted netcdf or grib files in given directory, incrementally.')
     
     parser.add_argument("--dirpath", "-d",
                         type = str,
@@ -12,11 +14,13 @@ def main():
     
     parser.add_argument("--year", "-y",
                         type = str,
-                        help = "Year to verify for files, format YYYY.")
+                        default = None,
+                        help = "Year to verify for files, format YYYY. By default, every year.")
     
     parser.add_argument("--month", "-m",
                         type = str,
-                        help = "Month to verify for files, format mm.")
+                        default = None,
+                        help = "Month to verify for files, format mm. By default, every month.")
     
     parser.add_argument("--remove", "-r",
                         action = "store_true",
@@ -27,40 +31,64 @@ def main():
                         help = "Remove index of corrupted files.")
     
     parser.add_argument("--file-type", "-f",
-                        type=str,
-                        help="Type of file to verify.")
+                        type = str,
+                        default = ".nc",
+                        help = "Type of file to verify.")
+    
+    parser.add_argument("--variables",
+                        type = str,
+                        nargs = "+",
+                        default = [],
+                        help = "Variables the netcdf files must hold.")
+    
+    parser.add_argument("--dims",
+                        type = str,
+                        nargs = "+",
+                        default = [],
+                        help = "Dimensions the netcdf files must hold.")
+    
+    parser.add_argument("--checksum", "-c",
+                        action = "store_true",
+                        help = "Also compute the sha256 checksum of the files (with --recheck, compare it with the manifest).")
+    
+    parser.add_argument("--recheck",
+                        action = "store_true",
+                        help = "Check again the files unchanged since the last run.")
+    
+    parser.add_argument("--manifest",
+                        type = str,
+                        default = None,
+                        help = "Path to the manifest of the checks. By default, integrity.json in dirpath.")
+    
+    parser.add_argument("--workers", "-w",
+                        type = int,
+                        default = None,
+                        help = "Number of processes checking the files.")
     
     args = parser.parse_args()
-    year = args.year
-    month = args.month
-    dirpath = args.dirpath
-    remove = args.remove
-    remove_index = args.remove_index
-    file_type = args.file_type
-    
-    folderpath = os.path.join(dirpath, year, month)
-    files = [file for file in os.listdir(folderpath) if file.endswith(file_type)]
-    files.sort()
-    
-    nothing = True
-    for file in files:
-        try:
-            xr.open_dataset(os.path.join(folderpath, file))
-            print(f"File {file} is not corrupted.")
-        except:
-            print(f"\t/!\\ Corrupted file: {file}")
-            if remove:
-                print(f"\t\tRemoving {file}...")
-                os.remove(os.path.join(folderpath, file))
-            if remove_index:
-                print(f"\t\tRemoving index of {file}...")
-                os.remove(os.path.join(folderpath, file + "*.idx"))
-            nothing = False
-    
-    if nothing:
-        print("No corrupted files found.")
     
+    pattern = os.path.join(args.dirpath, args.year or "*", args.month or "*", "*" + args.file_type)
+    files = sorted(glob.glob(pattern))
+    manifest = args.manifest or os.path.join(args.dirpath, "integrity.json")
+    
+    results = utils.check_files(files, manifest, variables = args.variables, dims = args.dims, checksum = args.checksum,
+                                workers = args.workers, recheck = args.recheck)
+    
+    corrupted = [file for file in files if results[file]["status"] != "ok"]
+    for file in corrupted:
+        print(f"\t/!\\ Corrupted file: {file} ({results[file]['error']})")
+        if args.remove:
+            print(f"\t\tRemoving {file}...")
+            os.remove(file)
+        if args.remove_index:
+            for index in glob.glob(glob.escape(file) + "*.idx"):
+                print(f"\t\tRemoving index {index}...")
+                os.remove(index)
     
+    checked = sum(result["checked"] for result in results.values())
+    print(f"{len(files)} files, {checked} checked, {len(files) - checked} unchanged since the last run, {len(corrupted)} corrupted.")
+    if corrupted and not args.remove:
+        sys.exit(1)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
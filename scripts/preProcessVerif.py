@@ -5,121 +5,72 @@ import argparse
 
 import pandas as pd
 
+import utils
+
 def main():
-    parser = argparse.ArgumentParser(description='Preprocess verification data.')
+    parser = argparse.ArgumentParser(description='Summarise the status of the pipeline (download, postprocessing, clip) over the whole archive.')
+
+    parser.add_argument("--download-dir",
+                        type=str,
+                        default=None,
+                        help="Path to the directory of the ERA5 downloads.")
+
+    parser.add_argument("--postprocessing-dir",
+                        type=str,
+                        default=None,
+                        help="Path to the directory of the postprocessed data.")
 
-    parser.add_argument("--year", "-y",
+    parser.add_argument("--clip-dir",
                         type=str,
-                        required=True,
-                        help="Year to verify for files, format YYYY.")
+                        default=None,
+                        help="Path to the directory of the clipped data.")
 
-    parser.add_argument("--month", "-m",
+    parser.add_argument("--start",
                         type=str,
-                        required=True,
-                        help="Month to verify for files, format mm.")
+                        default=None,
+                        help="First init time to verify, e.g. 2020-06. By default, the first month with files.")
 
-    parser.add_argument("--step", "-s",
+    parser.add_argument("--end",
                         type=str,
-                        required=True,
-                        help="Step to verify for files.")
+                        default=None,
+                        help="Last init time to verify, e.g. 2020-08-31T23. By default, the last month with files.")
 
-    parser.add_argument("--dirpath", "-d",
+    parser.add_argument("--output", "-o",
                         type=str,
-                        nargs="+",
-                        required=True,
-                        help="Path to the directory to verify. If step is 'all', dirpath should be provided in the order postprocessing, clipping."
-                        )
+                        default=None,
+                        help="Path to write the status table of every init time to (csv).")
+
+    parser.add_argument("--max-ranges",
+                        type=int,
+                        default=20,
+                        help="Number of missing ranges printed per stage.")
 
     args = parser.parse_args()
 
-    year = args.year
-    month = args.month
-    step = args.step
-    dirpath = args.dirpath
-
-    if not (step in ["download", "postprocessing", "clipexport", "all"]):
-        raise ValueError("Invalid step, must be in 'download', 'postprocessing' or 'clipexport'.")
-
-    if step == "download":
-        folderpath = os.path.join(dirpath, year, month)
-        if not os.path.exists(os.path.join(folderpath, f"{year}-{month}_ERA5_surface.grib")):
-            print(f"Missing ERA5 surface data for {year}-{month}.")
-        if not os.path.exists(os.path.join(folderpath, f"{year}-{month}_ERA5_upper.grib")):
-            print(f"Missing ERA5 upper data for {year}-{month}.")
-        else:
-            print(f"ERA5 data for {year}-{month} is complete.")
-
-    if step == "postprocessing":
-        finished = True
-        folderpath = os.path.join(dirpath, year, month)
-        for day in range(1, pd.to_datetime(f"{year}-{month}").days_in_month + 1):
-            day = f"{day:02}"
-            for hour in range(24):
-                hour = f"{hour:02}"
-                if not os.path.exists(os.path.join(folderpath, f"pangu_weather_{year}-{month}-{day}T{hour}_LT.nc")):
-                    print(f"Missing postprocessed data for {year}-{month}-{day}T{hour}_LT.")
-                    finished = False
-                else:
-                    wholemonth = False
-                if not os.path.exists(os.path.join(folderpath, f"pangu_weather_{year}-{month}-{day}T{hour}_ST.nc")):
-                    print(f"Missing postprocessed data for {year}-{month}-{day}T{hour}_ST.")
-                    finished = False
-                else:
-                    wholemonth = False
-        if finished:
-            print(f"Postprocessing for {year}-{month} is complete.")
-        if wholemonth:
-            print(f"\n\tWhole month of {year}-{month} is missing.")
-
-    if step == "clipexport":
-        finished = True
-        wholemonth = True
-        folderpath = os.path.join(dirpath, year, month)
-        for day in range(1, pd.to_datetime(f"{year}-{month}").days_in_month + 1):
-            day = f"{day:02}"
-            for hour in range(24):
-                hour = f"{hour:02}"
-                if not os.path.exists(os.path.join(folderpath, f"pangu_weather_{year}-{month}-{day}T{hour}_clipped.nc")):
-                    print(f"Missing clipped data for {year}-{month}-{day}T{hour} clipped.")
-                    finished = False
-                else:
-                    print(f"\t Clipped data for {year}-{month}-{day}T{hour}.")
-                    wholemonth = False
-        if finished:
-            print(f"Clipping and exporting for {year}-{month} is complete.")
-            
-        if wholemonth:
-            print(f"\n\tWhole month of {year}-{month} is missing.")
-    
-    if step == "all":
-        finished = True
-        folderpath = [None]*2
-        for i in range(2):
-            folderpath[i] = os.path.join(dirpath[i], year, month)
-            
-        # Postprocessing
-        for day in range(1, pd.to_datetime(f"{year}-{month}").days_in_month + 1):
-            day = f"{day:02}"
-            for hour in range(24):
-                hour = f"{hour:02}"
-                if not os.path.exists(os.path.join(folderpath[1], f"pangu_weather_{year}-{month}-{day}T{hour}_clipped.nc")):
-                    if not os.path.exists(os.path.join(folderpath[0], f"pangu_weather_{year}-{month}-{day}T{hour}_LT.nc")):
-                        print(f"\tMissing postprocessed data for {year}-{month}-{day}T{hour}_LT.")
-                        finished = False
-                        if not os.path.exists(os.path.join(folderpath[0], f"pangu_weather_{year}-{month}-{day}T{hour}_ST.nc")):
-                            print(f"\tMissing postprocessed data for {year}-{month}-{day}T{hour}_ST.")
-                            finished = False
-                    else:
-                        if not os.path.exists(os.path.join(folderpath[0], f"pangu_weather_{year}-{month}-{day}T{hour}_ST.nc")):
-                            print(f"\tMissing postprocessed data for {year}-{month}-{day}T{hour}_ST.")
-                            finished = False
-                        else:
-                            #Clip export
-                            print(f"\t\tMissing clipped data for {year}-{month}-{day}T{hour} clipped.")
-                            finished = False
-        
-        if finished:
-            print(f"Postprocessing, clipping and exporting for {year}-{month} is complete.")
+    dirpaths = {stage: dirpath for stage, dirpath in [("download", args.download_dir),
+                                                      ("postprocessing", args.postprocessing_dir),
+                                                      ("clip", args.clip_dir)] if dirpath is not None}
+    if not dirpaths:
+        raise ValueError("At least one of --download-dir, --postprocessing-dir and --clip-dir must be provided.")
+
+    status = utils.pipeline_status(dirpaths, start=args.start, end=args.end)
+    if args.output is not None:
+        status.astype(int).to_csv(args.output)
+
+    if len(status) == 0:
+        print("No files found.")
+        return
+    print(f"Init times from {status.index[0]:%Y-%m-%dT%H} to {status.index[-1]:%Y-%m-%dT%H}: {len(status)}.")
+    for stage in status.columns:
+        ranges = utils.missing_ranges(status, stage)
+        if len(ranges) == 0:
+            print(f"{stage}: complete.")
+            continue
+        print(f"{stage}: {ranges['count'].sum()} missing init times in {len(ranges)} ranges.")
+        for _, missing in ranges.head(args.max_ranges).iterrows():
+            print(f"\t{missing['start']:%Y-%m-%dT%H} to {missing['end']:%Y-%m-%dT%H} ({missing['count']})")
+        if len(ranges) > args.max_ranges:
+            print(f"\t... and {len(ranges) - args.max_ranges} more ranges.")
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,81 @@
+def main():
+    import os, sys, time, shutil, tempfile
+    dev_path = os.path.dirname(__file__)
+    src_path = os.path.join(dev_path, "..", 'src')
+    sys.path.append(src_path)
+
+    import numpy as np
+    import xarray as xr
+    import storageProfiles.SPtoolbox as sptb
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the storage profiles on a sample of a dataset.')
+
+    parser.add_argument("--from-file",
+                        type=str,
+                        help="The dataset to sample, e.g. an output of PW_SMN.py.")
+
+    parser.add_argument("--profiles",
+                        type=str,
+                        nargs='+',
+                        default=["none"] + list(sptb.PROFILES),
+                        help="The profiles to benchmark, 'none' being the defaults of to_netcdf.")
+
+    parser.add_argument("--time-steps",
+                        type=int,
+                        default=2000,
+                        help="The number of time steps of the sample.")
+
+    parser.add_argument("--repeat",
+                        type=int,
+                        default=3,
+                        help="The number of repetitions of each measure (the best one is kept).")
+
+    parser.add_argument("--tmp-dir",
+                        type=str,
+                        default=None,
+                        help="The directory of the benchmark files.")
+
+    args = parser.parse_args()
+
+    sample = xr.open_dataset(args.from_file)
+    if "time" in sample.dims:
+        sample = sample.isel(time = slice(0, args.time_steps))
+    sample = sample.load()
+    nbytes = sample.nbytes
+    tmpDir = tempfile.mkdtemp(dir = args.tmp_dir)
+
+    def best(function):
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    print(f"Sample of {nbytes/1e6:.1f} MB in memory ({dict(sample.sizes)})")
+    print(f"{'profile':>10} {'size (MB)':>10} {'write (MB/s)':>13} {'read (MB/s)':>12} {'series (ms)':>12} {'time slice (ms)':>16}")
+    try:
+        for name in args.profiles:
+            path = os.path.join(tmpDir, f"{name}.nc")
+            profile = None if name == "none" else name
+            write = best(lambda: sptb.save(sample, path, profile = profile))
+
+            def read():
+                with xr.open_dataset(path) as ds:
+                    ds.load()
+            def series():
+                with xr.open_dataset(path) as ds:
+                    ds.isel({dim: 0 for dim in ("station", "lead_time") if dim in ds.dims}).load()
+            def timeSlice():
+                with xr.open_dataset(path) as ds:
+                    ds.isel(time = slice(0, 24) if "time" in ds.dims else slice(None)).load()
+
+            print(f"{name:>10} {os.path.getsize(path)/1e6:10.1f} {nbytes/1e6/write:13.1f} {nbytes/1e6/best(read):12.1f}"
+                  f" {1e3*best(series):12.1f} {1e3*best(timeSlice):16.1f}", flush = True)
+    finally:
+        shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import argparse
+import os
 import sys
 
-sys.path.append("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/repos/src/SLF_dataset")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "src", "slfDataset"))
 
 import Statistics as stt
 
@@ -5,6 +5,10 @@ import numpy as np
 import pandas as pd
 import os
 import pickle
+import json
+import hashlib
+import netCDF4
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import logging
 
@@ -35,14 +39,72 @@ def clip_data(ds, latmin, latmax, lonmin, lonmax):
     ds = ds.sel(lat=slice(latmin, latmax), lon=slice(lonmin, lonmax))
     return ds
 
-def clip_file(path, latmin, latmax, lonmin, lonmax, output_path=None):
+def clip_indices(coords, vmin, vmax):
+    """
+    Get the slice of indices of a monotonic coordinate within [vmin, vmax].
+    
+    Parameters
+    ----------
+    coords : numpy.ndarray
+        The coordinate, in increasing or decreasing order.
+    vmin : float
+        Minimum value.
+    vmax : float
+        Maximum value.
+    
+    Returns
+    -------
+    slice
+        The slice of indices.
+    """
+    inside = np.flatnonzero((coords >= vmin) & (coords <= vmax))
+    if len(inside) == 0:
+        return slice(0, 0)
+    return slice(inside[0], inside[-1] + 1)
+
+def clip_hyperslab(path, latmin, latmax, lonmin, lonmax):
+    """
+    Read only the lat/lon hyperslab of a region from a file.
+    
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    latmin : float
+        Minimum latitude.
+    latmax : float
+        Maximum latitude.
+    lonmin : float
+        Minimum longitude.
+    lonmax : float
+        Maximum longitude.
+    
+    Returns
+    -------
+    xarray.Dataset
+        Clipped dataset, loaded in memory.
+    """
+    with xr.open_dataset(path, engine="netcdf4") as ds:
+        return ds.isel(lat=clip_indices(ds.lat.values, latmin, latmax),
+                       lon=clip_indices(ds.lon.values, lonmin, lonmax)).load()
+
+def clipped_path(path):
+    """
+    Get the default path of the clipped output of an input prefix.
+    """
+    return path + "_clipped.nc"
+
+def clip_file(path, latmin, latmax, lonmin, lonmax, output_path=None, keep_inputs=False):
     """
     Clip a file to a specific region.
     
+    Only the hyperslab of the region is read. The output is written to a temporary file and renamed, and the
+    inputs are deleted only once the output has been verified.
+    
     Parameters
     ----------
     path : str
-        Path to the file to clip.
+        Path to the file to clip, without the end '_ST.nc' or '_LT.nc'.
     latmin : float
         Minimum latitude.
     latmax : float
@@ -52,23 +114,405 @@ def clip_file(path, latmin, latmax, lonmin, lonmax, output_path=None):
     lonmax : float
         Maximum longitude.
     output_path : str, optional
-        Path to the output file. If None, the input file is overwritten.
+        Path to the output file. If None, path + "_clipped.nc".
+    keep_inputs : bool, optional
+        Whether to keep the input files.
+    
+    Returns
+    -------
+    str
+        "clipped", or "done" if the output was already there and valid.
     """
-    ds_ST = xr.open_dataset(path + "_ST.nc", engine="netcdf4")
-    ds_ST_clipped = clip_data(ds_ST, latmin, latmax, lonmin, lonmax)
-    del ds_ST
+    if output_path is None:
+        output_path = clipped_path(path)
+    inputs = [path + "_ST.nc", path + "_LT.nc"]
     
-    ds_LT = xr.open_dataset(path + "_LT.nc", engine="netcdf4")
-    ds_LT_clipped = clip_data(ds_LT, latmin, latmax, lonmin, lonmax)
-    del ds_LT
+    if os.path.exists(output_path) and (not all(os.path.exists(f) for f in inputs) or verify_clipped(output_path, inputs, latmin, latmax, lonmin, lonmax)):
+        status = "done"
+    else:
+        ds_clipped = xr.concat([clip_hyperslab(f, latmin, latmax, lonmin, lonmax) for f in inputs], dim="time")
+        
+        LOG.info(f"Saving to {output_path}")
+        tmp_path = os.path.join(os.path.dirname(output_path) or ".", f".{os.path.basename(output_path)}.{os.getpid()}.tmp")
+        try:
+            ds_clipped.to_netcdf(tmp_path, engine="netcdf4")
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if not verify_clipped(output_path, inputs, latmin, latmax, lonmin, lonmax):
+            raise IOError(f"The clipped output {output_path} does not match its inputs, which are kept.")
+        status = "clipped"
     
-    ds_clipped = xr.concat([ds_ST_clipped, ds_LT_clipped], dim="time")
+    if not keep_inputs:
+        for f in inputs:
+            if os.path.exists(f):
+                os.remove(f)
+    return status
+
+def verify_clipped(output_path, inputs, latmin, latmax, lonmin, lonmax):
+    """
+    Check that a clipped output can be read and has the times, variables and grid of its inputs.
     
-    os.remove(path + "_ST.nc")
-    os.remove(path + "_LT.nc")
-    if output_path is None:
-        output_path = path[:-3] + "_clipped.nc"
+    Parameters
+    ----------
+    output_path : str
+        Path to the clipped file.
+    inputs : list
+        Paths to the input files.
+    latmin, latmax, lonmin, lonmax : float
+        The region.
+    
+    Returns
+    -------
+    bool
+        Whether the output is valid.
+    """
+    try:
+        with xr.open_dataset(output_path, engine="netcdf4") as out:
+            times, variables = [], set()
+            for f in inputs:
+                with xr.open_dataset(f, engine="netcdf4") as ds:
+                    times.append(ds.time.values)
+                    variables |= set(ds.data_vars)
+                    nlat = len(ds.lat.values[clip_indices(ds.lat.values, latmin, latmax)])
+                    nlon = len(ds.lon.values[clip_indices(ds.lon.values, lonmin, lonmax)])
+            return (np.array_equal(out.time.values, np.concatenate(times)) and set(out.data_vars) == variables
+                    and out.sizes["lat"] == nlat and out.sizes["lon"] == nlon
+                    and all(np.isfinite(out[v].isel(time=-1).values).any() for v in out.data_vars))
+    except (OSError, ValueError, KeyError):
+        return False
+
+def clip_month(directory, latmin, latmax, lonmin, lonmax, workers=None, keep_inputs=False):
+    """
+    Clip every init time of a year/month directory with a pool of workers.
+    
+    Parameters
+    ----------
+    directory : str
+        The directory, holding pairs of '<prefix>_ST.nc' and '<prefix>_LT.nc' files.
+    latmin, latmax, lonmin, lonmax : float
+        The region.
+    workers : int, optional
+        The number of processes, by default the number of CPUs.
+    keep_inputs : bool, optional
+        Whether to keep the input files.
+    
+    Returns
+    -------
+    dict
+        The number of init times per status ("clipped", "done" or "failed").
+    """
+    prefixes = sorted(os.path.join(directory, f[:-len("_ST.nc")]) for f in os.listdir(directory) if f.endswith("_ST.nc"))
+    prefixes = [p for p in prefixes if os.path.exists(p + "_LT.nc")]
+    outputs = {p: clipped_path(p) for p in prefixes}
+    if len(set(outputs.values())) != len(outputs):
+        # Several init times would overwrite the same output, and delete their inputs
+        raise ValueError(f"The clipped outputs of {directory} are not unique per init time.")
+    statuses = {"clipped": 0, "done": 0, "failed": 0}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(clip_file, p, latmin, latmax, lonmin, lonmax, output_path=outputs[p], keep_inputs=keep_inputs): p for p in prefixes}
+        for future in as_completed(futures):
+            try:
+                statuses[future.result()] += 1
+            except Exception as error:
+                LOG.error(f"Failed to clip {futures[future]}: {error}")
+                statuses["failed"] += 1
+    LOG.info(f"{directory}: {statuses}")
+    return statuses
 
-    LOG.info(f"Saving to {output_path}")
-    ds_clipped.to_netcdf(output_path, engine="netcdf4")
-    return
\ No newline at end of file
+HDF5_SIGNATURE = b"\x89HDF\r\n\x1a\n"
+
+def file_signature(path):
+    """
+    Get the format of a file from its first bytes.
+    
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    
+    Returns
+    -------
+    str or None
+        "hdf5" (netCDF4), "netcdf3", "grib", or None if the signature is unknown.
+    """
+    with open(path, "rb") as f:
+        head = f.read(8)
+    if head == HDF5_SIGNATURE:
+        return "hdf5"
+    if head[:3] == b"CDF" and head[3:4] in (b"\x01", b"\x02", b"\x05"):
+        return "netcdf3"
+    if head[:4] == b"GRIB":
+        return "grib"
+    return None
+
+def hdf5_end_of_file(path):
+    """
+    Read the end of file address recorded in the superblock of an HDF5 file.
+    
+    A file shorter than this address has been truncated (e.g. by an interrupted write or transfer).
+    
+    Parameters
+    ----------
+    path : str
+        Path to the file, with the superblock at the beginning.
+    
+    Returns
+    -------
+    int or None
+        The end of file address, or None if the superblock version is unknown.
+    """
+    with open(path, "rb") as f:
+        superblock = f.read(128)
+    version = superblock[8]
+    if version in (0, 1):
+        offsets = superblock[13]
+        start = 24 + (4 if version == 1 else 0)
+        base = int.from_bytes(superblock[start:start + offsets], "little")
+        eof = int.from_bytes(superblock[start + 2*offsets:start + 3*offsets], "little")
+    elif version in (2, 3):
+        offsets = superblock[9]
+        base = int.from_bytes(superblock[12:12 + offsets], "little")
+        eof = int.from_bytes(superblock[12 + 2*offsets:12 + 3*offsets], "little")
+    else:
+        return None
+    return base + eof
+
+def file_checksum(path, blocksize=1 << 24):
+    """
+    Compute the sha256 checksum of a file, reading it by blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def check_file(path, variables=(), dims=(), checksum=False):
+    """
+    Check the integrity of a file with cheap checks.
+    
+    The signature of the file is checked, then, for HDF5 files, that the file is not shorter than recorded in
+    its superblock, and for netCDF files, that the metadata can be read and holds the expected variables and
+    dimensions. GRIB files must end with the end marker '7777'.
+    
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+    variables : list, optional
+        Variables the file must hold (netCDF only).
+    dims : list, optional
+        Dimensions the file must hold (netCDF only).
+    checksum : bool, optional
+        Whether to also compute the sha256 checksum of the whole file.
+    
+    Returns
+    -------
+    dict
+        The size, mtime, required variables and dimensions, status ("ok" or "corrupted"), error and checksum
+        of the file.
+    """
+    stat = os.stat(path)
+    result = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "variables": sorted(variables), "dims": sorted(dims),
+              "status": "ok", "error": None, "checksum": None}
+    try:
+        kind = file_signature(path)
+        if kind is None:
+            raise ValueError("unknown signature")
+        if kind == "hdf5":
+            eof = hdf5_end_of_file(path)
+            if eof is not None and stat.st_size < eof:
+                raise ValueError(f"truncated: {stat.st_size} bytes instead of {eof}")
+        if kind == "grib":
+            with open(path, "rb") as f:
+                f.seek(-4, os.SEEK_END)
+                if f.read(4) != b"7777":
+                    raise ValueError("truncated: no GRIB end marker")
+        else:
+            with netCDF4.Dataset(path) as ds:
+                missing = [v for v in variables if v not in ds.variables] + [d for d in dims if d not in ds.dimensions]
+            if missing:
+                raise ValueError(f"missing variables or dimensions: {', '.join(missing)}")
+        if checksum:
+            result["checksum"] = file_checksum(path)
+    except (OSError, ValueError, RuntimeError) as error:
+        result.update(status="corrupted", error=str(error) or type(error).__name__)
+    return result
+
+def _check_file(args):
+    """
+    Check a file in a worker, as check_file(*args).
+    """
+    return args[0], check_file(*args)
+
+def check_files(paths, manifest_path=None, variables=(), dims=(), checksum=False, workers=None, recheck=False):
+    """
+    Check the integrity of files in parallel, incrementally.
+    
+    The results are recorded in a manifest keyed by path. A file whose size and mtime are those of the manifest
+    and which was checked against the same variables and dimensions is not checked again, unless recheck (or
+    checksum, and no checksum was recorded).
+    
+    Parameters
+    ----------
+    paths : list
+        Paths to the files.
+    manifest_path : str, optional
+        Path to the JSON manifest. If None, nothing is recorded.
+    variables : list, optional
+        Variables the files must hold, see check_file().
+    dims : list, optional
+        Dimensions the files must hold, see check_file().
+    checksum : bool, optional
+        Whether to also compute the sha256 checksum of the files. With recheck, the checksum of an unchanged file
+        is compared with the recorded one.
+    workers : int, optional
+        The number of processes, by default the number of CPUs.
+    recheck : bool, optional
+        Whether to check unchanged files again.
+    
+    Returns
+    -------
+    dict
+        The result of each file of paths, see check_file(), with "checked" set if it was checked in this run.
+    """
+    manifest = {}
+    if manifest_path is not None and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    
+    results, todo = {}, []
+    for path in paths:
+        stat = os.stat(path)
+        known = manifest.get(path)
+        if (known is not None and not recheck and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime_ns
+                and known.get("variables") == sorted(variables) and known.get("dims") == sorted(dims)
+                and (not checksum or known["checksum"] is not None or known["status"] != "ok")):
+            results[path] = dict(known, checked=False)
+        else:
+            todo.append((path, tuple(variables), tuple(dims), checksum))
+    
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for path, result in executor.map(_check_file, todo, chunksize=max(1, len(todo)//(4*(workers or os.cpu_count() or 1)))):
+                known = manifest.get(path)
+                if (checksum and result["status"] == "ok" and known is not None and known.get("checksum") is not None
+                        and known["size"] == result["size"] and known["mtime"] == result["mtime"] and known["checksum"] != result["checksum"]):
+                    result.update(status="corrupted", error="checksum differs from the manifest")
+                results[path] = dict(result, checked=True)
+                manifest[path] = result
+    
+    if manifest_path is not None and (todo or any(not os.path.exists(path) for path in manifest)):
+        manifest = {path: result for path, result in manifest.items() if path in results or os.path.exists(path)}
+        tmp_path = manifest_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+    return results
+
+# Stages of the pipeline, in order: the pattern of the file names in <dirpath>/<YYYY>/<mm>, the parts expected
+# for each time, and the frequency of the times (monthly downloads, hourly init times afterwards)
+STAGES = {
+    "download": {"pattern": r"^(?P<time>\d{4}-\d{2})_ERA5_(?P<part>surface|upper)\.grib$",
+                 "parts": ["surface", "upper"], "freq": "MS"},
+    "postprocessing": {"pattern": r"^pangu_weather_(?P<time>\d{4}-\d{2}-\d{2}T\d{2})_(?P<part>ST|LT)\.nc$",
+                       "parts": ["ST", "LT"], "freq": "h"},
+    "clip": {"pattern": r"^pangu_weather_(?P<time>\d{4}-\d{2}-\d{2}T\d{2})_(?P<part>clipped)\.nc$",
+             "parts": ["clipped"], "freq": "h"},
+}
+
+def scan_stage(dirpath, stage):
+    """
+    List the times of a stage present in its directory, in a single scan.
+    
+    Parameters
+    ----------
+    dirpath : str
+        The directory of the stage, holding <YYYY>/<mm> subdirectories.
+    stage : str
+        The stage, in STAGES.
+    
+    Returns
+    -------
+    complete : pandas.DatetimeIndex
+        The times for which every part of the stage is present.
+    found : pandas.DatetimeIndex
+        The times for which any part of the stage is present.
+    """
+    names = []
+    for year in os.scandir(dirpath):
+        if year.is_dir() and year.name.isdigit():
+            for month in os.scandir(year.path):
+                if month.is_dir():
+                    names.extend(entry.name for entry in os.scandir(month.path))
+    found = pd.Series(names, dtype=object).str.extract(STAGES[stage]["pattern"]).dropna()
+    counts = found.drop_duplicates().groupby("time").size()
+    complete = counts.index[counts.values == len(STAGES[stage]["parts"])]
+    return (pd.DatetimeIndex(pd.to_datetime(complete, format="ISO8601")).sort_values(),
+            pd.DatetimeIndex(pd.to_datetime(counts.index, format="ISO8601")).sort_values())
+
+def pipeline_status(dirpaths, start=None, end=None):
+    """
+    Compute the status of every hourly init time for each stage of the pipeline.
+    
+    A stage is done for an init time if its files, or those of a later stage, are present (e.g. the
+    postprocessed files are deleted once clipped). Downloads are monthly, an init time is downloaded if its month is.
+    
+    Parameters
+    ----------
+    dirpaths : dict
+        The directory of each stage to check, e.g. {"download": ..., "postprocessing": ..., "clip": ...}.
+    start : str or pandas.Timestamp, optional
+        The first init time, by default the first month with files (complete or not) in any stage.
+    end : str or pandas.Timestamp, optional
+        The last init time, by default the end of the last month with files (complete or not) in any stage.
+    
+    Returns
+    -------
+    pandas.DataFrame
+        The status (bool) of each stage of dirpaths, indexed by init time.
+    """
+    scans = {stage: scan_stage(dirpath, stage) for stage, dirpath in dirpaths.items()}
+    present = {stage: complete for stage, (complete, _) in scans.items()}
+    found = pd.DatetimeIndex(np.concatenate([found.values for _, found in scans.values()]))
+    if start is None or end is None:
+        if len(found) == 0:
+            return pd.DataFrame(columns=list(dirpaths), index=pd.DatetimeIndex([], name="init_time"), dtype=bool)
+        start = found.min().to_period("M").start_time if start is None else start
+        end = found.max().to_period("M").end_time.floor("h") if end is None else end
+    grid = pd.date_range(start, end, freq="h", name="init_time")
+    
+    status = pd.DataFrame(index=grid)
+    done = np.zeros(len(grid), dtype=bool)
+    for stage in reversed(list(STAGES)):
+        if stage not in dirpaths:
+            continue
+        if STAGES[stage]["freq"] == "MS":
+            done = done | grid.to_period("M").isin(present[stage].to_period("M"))
+        else:
+            done = done | grid.isin(present[stage])
+        status[stage] = done
+    return status[[stage for stage in STAGES if stage in dirpaths]]
+
+def missing_ranges(status, stage):
+    """
+    Group the init times for which a stage is not done into ranges of consecutive hours.
+    
+    Parameters
+    ----------
+    status : pandas.DataFrame
+        The status, from pipeline_status().
+    stage : str
+        The stage.
+    
+    Returns
+    -------
+    pandas.DataFrame
+        The start, end and number of init times of each range.
+    """
+    missing = ~status[stage].to_numpy(dtype=bool)
+    edges = np.diff(np.concatenate([[False], missing, [False]]).astype(int))
+    starts, ends = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+    return pd.DataFrame({"start": status.index[starts], "end": status.index[ends - 1], "count": ends - starts})
@@ -6,7 +6,11 @@ import xarray as xr
 import os
 import cartopy.crs as ccrs
 import cartopy.feature as cfeature
-from pyproj import Transformer
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import projections.PROJtoolbox as projtb
 
     
 
@@ -111,9 +115,8 @@ def to_WGS(ds):
     ds : xarray.Dataset
         Dataset containing the data to convert, with in its coordinates the variables 'x' and 'y' in LV95 coordinates.
     """
-    transformer = Transformer.from_proj(2056, 4326, always_xy=True)
     xx, yy = np.meshgrid(ds.x.values, ds.y.values)
-    lon, lat = transformer.transform(xx, yy)
+    lon, lat = projtb.transform(xx, yy, 2056, 4326)
     if ds.REFERENCE_TS.size > 1:
         res = xr.Dataset(
             {
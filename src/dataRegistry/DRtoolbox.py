@@ -0,0 +1,131 @@
+import os
+import threading
+
+# Roots of the data, configurable with environment variables or DRtoolbox.setRoot()
+ROOTS = {
+    "raw": os.environ.get("ALPINE_RAW_DATA", "/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data"),
+    "treated": os.environ.get("ALPINE_TREATED_DATA", "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/treated_data"),
+    "plots": os.environ.get("ALPINE_PLOTS", "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots"),
+}
+
+_DATASETS = {}
+_CACHE = {}
+_LOCK = threading.RLock()
+
+def register(name, path, root = "treated", loader = None):
+    """
+    Register a dataset. Registering does not read anything: the dataset is loaded on its first DRtoolbox.get().
+    
+    Parameters
+    ----------
+    name : str
+        The name of the dataset.
+    path : str
+        The path of the dataset, relative to its root (or absolute).
+    root : str
+        The root of the dataset, a key of DRtoolbox.ROOTS.
+    loader : callable
+        The function loading the dataset from its path. If None, the dataset is only a path.
+    
+    Returns
+    -------
+    None
+    """
+    with _LOCK:
+        _DATASETS[name] = (root, path, loader)
+        _CACHE.pop(name, None)
+    return
+
+def setRoot(root, path):
+    """
+    Set the directory of a root, and forget the datasets loaded from it.
+    
+    Parameters
+    ----------
+    root : str
+        The root, e.g. "raw", "treated" or "plots".
+    path : str
+        The directory of the root.
+    
+    Returns
+    -------
+    None
+    """
+    with _LOCK:
+        ROOTS[root] = path
+        for name, (dataset_root, _, _) in _DATASETS.items():
+            if dataset_root == root:
+                _CACHE.pop(name, None)
+    return
+
+def getPath(name):
+    """
+    Get the path of a registered dataset.
+    
+    Parameters
+    ----------
+    name : str
+        The name of the dataset.
+    
+    Returns
+    -------
+    str
+        The path of the dataset.
+    """
+    if name not in _DATASETS:
+        raise ValueError(f"Unknown dataset {name}.")
+    root, path, _ = _DATASETS[name]
+    return os.path.join(ROOTS[root], path)
+
+def get(name):
+    """
+    Get a registered dataset, loading it on first use and keeping it in memory afterwards.
+    
+    Parameters
+    ----------
+    name : str
+        The name of the dataset.
+    
+    Returns
+    -------
+    object
+        The dataset, as returned by its loader.
+    """
+    with _LOCK:
+        if name not in _CACHE:
+            loader = _DATASETS[name][2] if name in _DATASETS else None
+            if loader is None:
+                raise ValueError(f"Dataset {name} has no loader.")
+            _CACHE[name] = loader(getPath(name))
+        return _CACHE[name]
+
+def clear(name = None):
+    """
+    Forget a loaded dataset, or all of them.
+    
+    Parameters
+    ----------
+    name : str
+        The name of the dataset, by default all datasets.
+    
+    Returns
+    -------
+    None
+    """
+    with _LOCK:
+        if name is None:
+            _CACHE.clear()
+        else:
+            _CACHE.pop(name, None)
+    return
+
+def datasets():
+    """
+    List the registered datasets.
+    
+    Returns
+    -------
+    dict
+        The path of each registered dataset, by name.
+    """
+    return {name: getPath(name) for name in _DATASETS}
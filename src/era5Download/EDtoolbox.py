@@ -0,0 +1,531 @@
+import pandas as pd
+import numpy as np
+import xarray as xr
+import os
+import sys
+import shutil
+import json
+import hashlib
+import time
+import random
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import storageProfiles.SPtoolbox as sptb
+
+# ERA5 datasets of the inputs of PanguWeather, by kind of file
+DATASETS = {
+    "surface": ("reanalysis-era5-single-levels",
+                ['mean_sea_level_pressure', '10m_u_component_of_wind', '10m_v_component_of_wind', '2m_temperature'],
+                {}),
+    "upper": ("reanalysis-era5-pressure-levels",
+              ['geopotential', 'specific_humidity', 'temperature', 'u_component_of_wind', 'v_component_of_wind'],
+              {'pressure_level': ['1000', '925', '850', '700', '600', '500', '400', '300', '250', '200', '150', '100', '50']}),
+}
+
+# Domain of the analyses, around Switzerland
+SWISS_DOMAIN = {"latmin": 45.5, "latmax": 48., "lonmin": 5.5, "lonmax": 11.}
+
+# Keys of the regular lat/lon grid of the GRIB messages
+_GRID_KEYS = ("Ni", "Nj", "latitudeOfFirstGridPointInDegrees", "longitudeOfFirstGridPointInDegrees",
+              "iDirectionIncrementInDegrees", "jDirectionIncrementInDegrees", "jScansPositively", "iScansNegatively")
+
+def monthsOf(initTimes):
+    """
+    Get the months to download for a set of init times.
+
+    Parameters
+    ----------
+    initTimes : array-like
+        The init times, e.g. the index of stormTracks.STtoolbox.neededTimes().
+
+    Returns
+    -------
+    list
+        The sorted months, as pandas.Period.
+    """
+    return sorted(set(pd.DatetimeIndex(initTimes).to_period("M")))
+
+def jobs(months, toDir, kinds = ("surface", "upper")):
+    """
+    Build the retrievals of a set of months, one monthly file per kind.
+
+    Parameters
+    ----------
+    months : list
+        The months, as pandas.Period or strings (YYYY-MM).
+    toDir : str
+        The directory of the downloads, in which the files are written to <YYYY>/<mm>/<YYYY>-<mm>_ERA5_<kind>.grib.
+    kinds : tuple
+        The kinds of files, keys of DATASETS.
+
+    Returns
+    -------
+    list
+        The retrievals, as dicts with the dataset, request and target of each, without duplicates.
+    """
+    res = {}
+    for month in sorted(set(pd.Period(month, freq = "M") for month in months)):
+        year, mm = f"{month.year}", f"{month.month:02}"
+        for kind in kinds:
+            dataset, variables, extra = DATASETS[kind]
+            request = {
+                'product_type': 'reanalysis',
+                'format': 'grib',
+                'variable': variables,
+                'year': year,
+                'month': mm,
+                'day': [f"{day:02}" for day in range(1, month.days_in_month + 1)],
+                'time': [f"{hour:02}:00" for hour in range(24)],
+            }
+            request.update(extra)
+            target = os.path.join(toDir, year, mm, f"{year}-{mm}_ERA5_{kind}.grib")
+            res[target] = {"dataset": dataset, "request": request, "target": target}
+    return list(res.values())
+
+class Client:
+    """
+    Interface of the clients of the scheduler.
+
+    submit() places a request and returns the location and size of its result, once ready. open() opens the
+    result from an offset, to resume a partial download.
+    """
+    def submit(self, dataset, request):
+        raise NotImplementedError
+
+    def open(self, location, offset = 0, timeout = 60):
+        headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+        return urllib.request.urlopen(urllib.request.Request(location, headers = headers), timeout = timeout)
+
+class CDSClient(Client):
+    """
+    Client of the Copernicus Climate Data Store, through cdsapi (configured by ~/.cdsapirc).
+    """
+    def __init__(self, **kwargs):
+        import cdsapi
+        self.client = cdsapi.Client(**kwargs)
+
+    def submit(self, dataset, request):
+        result = self.client.retrieve(dataset, request)
+        return result.location, result.content_length
+
+class FakeCDSClient(Client):
+    """
+    Client of a FakeCDSServer.
+    """
+    def __init__(self, url):
+        self.url = url
+
+    def submit(self, dataset, request):
+        data = json.dumps({"dataset": dataset, "request": request}).encode()
+        with urllib.request.urlopen(urllib.request.Request(self.url + "/retrieve", data = data, method = "POST"), timeout = 60) as response:
+            result = json.load(response)
+        return result["location"], result["content_length"]
+
+class FakeCDSServer:
+    """
+    Local stand-in of the Climate Data Store, to test the scheduler.
+
+    The result of a request is a deterministic random payload of size bytes. Requests fail with probability
+    failRate, and downloads are cut after half of the remaining bytes with probability cutRate. Range requests are
+    supported, to resume partial downloads.
+
+    Parameters
+    ----------
+    size : int
+        The size of the results, in bytes.
+    failRate : float
+        The probability of a request or download to fail with an HTTP 503 error.
+    cutRate : float
+        The probability of a download to be cut.
+    seed : int
+        The seed of the random failures.
+    """
+    def __init__(self, size = 1 << 20, failRate = 0., cutRate = 0., seed = None):
+        self.size, self.failRate, self.cutRate = size, failRate, cutRate
+        self.rng, self.lock = random.Random(seed), threading.Lock()
+        self.results, self.submitted = {}, []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                return
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if server._draw(server.failRate):
+                    return self.send_error(503)
+                with server.lock:
+                    key = f"{len(server.results)}.grib"
+                    server.submitted.append(body)
+                    server.results[key] = server.payload(body)
+                reply = json.dumps({"location": f"{server.url}/files/{key}", "content_length": len(server.results[key])}).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def do_GET(self):
+                payload = server.results.get(self.path.rsplit("/", 1)[-1])
+                if payload is None:
+                    return self.send_error(404)
+                if server._draw(server.failRate):
+                    return self.send_error(503)
+                offset = int(self.headers["Range"][6:].split("-")[0]) if self.headers.get("Range") else 0
+                self.send_response(206 if offset else 200)
+                self.send_header("Content-Length", str(len(payload) - offset))
+                self.end_headers()
+                end = offset + (len(payload) - offset)//2 if server._draw(server.cutRate) else len(payload)
+                self.wfile.write(payload[offset:end])
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def payload(self, body):
+        """
+        Get the deterministic payload of a request.
+        """
+        seed = int.from_bytes(hashlib.sha256(json.dumps(body, sort_keys = True).encode()).digest()[:8], "little")
+        return np.random.default_rng(seed).integers(0, 256, self.size, dtype = np.uint8).tobytes()
+
+    def _draw(self, rate):
+        with self.lock:
+            return self.rng.random() < rate
+
+    def __enter__(self):
+        threading.Thread(target = self.httpd.serve_forever, daemon = True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def download(retrievals, client = None, **kwargs):
+    """
+    Run retrievals concurrently, with retries and resumption of partial files.
+
+    Retrievals whose target already exists are skipped. A result is downloaded to <target>.part, resumed from
+    its size after a failure, and renamed to the target once complete.
+
+    Parameters
+    ----------
+    retrievals : list
+        The retrievals, from jobs().
+    client : Client
+        The client, by default a CDSClient.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            workers : int
+                The number of concurrent retrievals, by default 4.
+            retries : int
+                The number of retries of a retrieval, by default 5.
+            backoff : float
+                The delay before the first retry, in seconds, by default 30. It is doubled at each retry, with
+                jitter.
+            maxBackoff : float
+                The maximum delay between retries, in seconds, by default 900.
+            failedFile : str
+                A file to which the targets of the failed retrievals are appended.
+            verbose : bool
+                Whether to print the progress, by default True.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The status ("downloaded", "skipped" or "failed"), number of attempts and last error of each target.
+    """
+    verbose = kwargs.get("verbose", True)
+    unique = list({retrieval["target"]: retrieval for retrieval in retrievals}.values())
+    todo = [retrieval for retrieval in unique if not os.path.exists(retrieval["target"])]
+    res = {retrieval["target"]: {"status": "skipped", "attempts": 0, "error": None} for retrieval in unique}
+    if todo and client is None:
+        client = CDSClient()
+
+    with ThreadPoolExecutor(max_workers = kwargs.get("workers", 4)) as executor:
+        futures = {executor.submit(_retrieve, client, retrieval, kwargs.get("retries", 5), kwargs.get("backoff", 30.),
+                                   kwargs.get("maxBackoff", 900.), verbose): retrieval["target"] for retrieval in todo}
+        for future in as_completed(futures):
+            res[futures[future]] = future.result()
+
+    failed = [target for target, status in res.items() if status["status"] == "failed"]
+    if failed and kwargs.get("failedFile") is not None:
+        with open(kwargs["failedFile"], "a") as f:
+            f.writelines(f"{target}\n" for target in failed)
+    return pd.DataFrame.from_dict(res, orient = "index")
+
+def _retrieve(client, retrieval, retries, backoff, maxBackoff, verbose):
+    """
+    Run a retrieval, retrying with exponential backoff.
+    """
+    target = retrieval["target"]
+    part = target + ".part"
+    os.makedirs(os.path.dirname(target) or ".", exist_ok = True)
+    location, error = None, None
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            delay = min(maxBackoff, backoff*2**(attempt - 1))
+            time.sleep(delay*random.uniform(0.5, 1.))
+        try:
+            if location is None:
+                location, size = client.submit(retrieval["dataset"], retrieval["request"])
+            _fetch(client, location, size, part)
+            os.replace(part, target)
+            if verbose:
+                print(f"Downloaded {target}.")
+            return {"status": "downloaded", "attempts": attempt + 1, "error": None}
+        except urllib.error.HTTPError as e:
+            error = e
+            if e.code in (404, 410):
+                # The result expired, it must be requested again
+                location = None
+        except Exception as e:
+            error = e
+        if verbose:
+            print(f"Error downloading {target} (attempt {attempt + 1}): {error}")
+    return {"status": "failed", "attempts": retries + 1, "error": repr(error)}
+
+def _fetch(client, location, size, part, blockSize = 1 << 20):
+    """
+    Download a result to a partial file, resuming from its size.
+    """
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset > size:
+        offset = 0
+    if offset < size:
+        with client.open(location, offset) as response:
+            if offset > 0 and response.status != 206:
+                # Range not supported: start again
+                offset = 0
+            with open(part, "r+b" if offset > 0 else "wb") as f:
+                f.seek(offset)
+                f.truncate()
+                for block in iter(lambda: response.read(blockSize), b""):
+                    f.write(block)
+    elif not os.path.exists(part):
+        open(part, "wb").close()
+    if os.path.getsize(part) != size:
+        raise IOError(f"Incomplete download: {os.path.getsize(part)} bytes out of {size}.")
+
+def gribIndex(gribFile, **kwargs):
+    """
+    Index the messages of a GRIB file, reading only their headers.
+
+    The index is cached in <gribFile>.index.json, and built again if the size or mtime of the file changed.
+
+    Parameters
+    ----------
+    gribFile : str
+        The GRIB file.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            indexFile : str
+                The file of the cached index, by default <gribFile>.index.json.
+            overwrite : bool
+                Whether to build the index again, by default False.
+
+    Returns
+    -------
+    grid : dict
+        The regular lat/lon grid of the messages (Ni, Nj, first latitude and longitude, increments).
+    messages : pandas.DataFrame
+        The offset, length, variable (shortName), type of level, level and valid time of each message.
+    """
+    indexFile = kwargs.get("indexFile", gribFile + ".index.json")
+    stat = os.stat(gribFile)
+    if os.path.exists(indexFile) and not kwargs.get("overwrite", False):
+        with open(indexFile) as f:
+            index = json.load(f)
+        if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns:
+            return index["grid"], _messages(index["messages"])
+
+    import eccodes
+    grid, messages = None, []
+    with open(gribFile, "rb") as f:
+        while True:
+            gid = eccodes.codes_grib_new_from_file(f)
+            if gid is None:
+                break
+            try:
+                if grid is None:
+                    if eccodes.codes_get(gid, "gridType") != "regular_ll":
+                        raise ValueError(f"Only regular lat/lon grids are supported, not {eccodes.codes_get(gid, 'gridType')}.")
+                    grid = {key: eccodes.codes_get(gid, key) for key in _GRID_KEYS}
+                messages.append([eccodes.codes_get(gid, "offset"), eccodes.codes_get(gid, "totalLength"),
+                                 eccodes.codes_get(gid, "shortName"), eccodes.codes_get(gid, "typeOfLevel"),
+                                 eccodes.codes_get(gid, "level"),
+                                 f"{eccodes.codes_get(gid, 'validityDate'):08}{eccodes.codes_get(gid, 'validityTime'):04}"])
+            finally:
+                eccodes.codes_release(gid)
+
+    tmp = indexFile + f".{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"size": stat.st_size, "mtime": stat.st_mtime_ns, "grid": grid, "messages": messages}, f)
+    os.replace(tmp, indexFile)
+    return grid, _messages(messages)
+
+def _messages(rows):
+    """
+    Build the DataFrame of the messages of an index.
+    """
+    messages = pd.DataFrame(rows, columns = ["offset", "length", "variable", "typeOfLevel", "level", "time"])
+    messages["time"] = pd.to_datetime(messages["time"], format = "%Y%m%d%H%M")
+    return messages
+
+def _domainIndex(grid, domain):
+    """
+    Get the latitudes, longitudes and flat indices in the GRIB values of the points of a domain.
+    """
+    sign = 1 if grid["jScansPositively"] else -1
+    lat = grid["latitudeOfFirstGridPointInDegrees"] + sign*grid["jDirectionIncrementInDegrees"]*np.arange(grid["Nj"])
+    sign = -1 if grid["iScansNegatively"] else 1
+    lon = grid["longitudeOfFirstGridPointInDegrees"] + sign*grid["iDirectionIncrementInDegrees"]*np.arange(grid["Ni"])
+    lon = (lon + 180.) % 360. - 180.
+    rows = np.flatnonzero((lat >= domain["latmin"]) & (lat <= domain["latmax"]))
+    cols = np.flatnonzero((lon >= domain["lonmin"]) & (lon <= domain["lonmax"]))
+    rows, cols = rows[np.argsort(lat[rows], kind = "stable")], cols[np.argsort(lon[cols], kind = "stable")]
+    return lat[rows], lon[cols], (rows[:, None]*grid["Ni"] + cols[None, :]).ravel()
+
+def convert(gribFile, toFile, **kwargs):
+    """
+    Convert the messages of a GRIB file to a netCDF or Zarr file over a domain.
+
+    Only the messages of the selected variables, levels and times are read, and only the points of the domain are
+    decoded (eccodes unpacks single elements of simple packing without decoding the whole field).
+
+    Parameters
+    ----------
+    gribFile : str
+        The GRIB file.
+    toFile : str
+        The output file, written to a temporary file and renamed once complete.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            variables : list
+                The variables (GRIB shortName) to keep, by default all of them.
+            levels : list
+                The pressure levels to keep, by default all of them.
+            times : tuple or list
+                The (start, end) of the valid times to keep, or a list of times, by default all of them.
+            domain : dict
+                The latmin, latmax, lonmin and lonmax of the domain, by default SWISS_DOMAIN.
+            format : str
+                "netcdf" (by default) or "zarr".
+            profile : str or dict
+                The storage profile of the netCDF file (see storageProfiles.SPtoolbox), by default "archive".
+            chunks : dict
+                The chunk size along each dimension of the Zarr store, by default {"time": 744}.
+
+    Returns
+    -------
+    xarray.Dataset
+        The converted data.
+    """
+    import eccodes
+    grid, messages = gribIndex(gribFile)
+    if kwargs.get("variables") is not None:
+        messages = messages[messages["variable"].isin(kwargs["variables"])]
+    if kwargs.get("levels") is not None:
+        messages = messages[(messages["typeOfLevel"] != "isobaricInhPa") | messages["level"].isin(kwargs["levels"])]
+    times = kwargs.get("times")
+    if isinstance(times, tuple):
+        messages = messages[(messages["time"] >= pd.Timestamp(times[0])) & (messages["time"] <= pd.Timestamp(times[1]))]
+    elif times is not None:
+        messages = messages[messages["time"].isin(pd.DatetimeIndex(times))]
+    if len(messages) == 0:
+        raise ValueError(f"No messages of {gribFile} match the selection.")
+
+    lat, lon, index = _domainIndex(grid, kwargs.get("domain", SWISS_DOMAIN))
+    timeIndex = pd.DatetimeIndex(np.unique(messages["time"]))
+    values = {}
+    with open(gribFile, "rb") as f:
+        for message in messages.sort_values("offset").itertuples():
+            f.seek(message.offset)
+            gid = eccodes.codes_new_from_message(f.read(message.length))
+            try:
+                field = np.asarray(eccodes.codes_get_double_elements(gid, "values", index.tolist()), dtype = np.float32)
+                if eccodes.codes_get(gid, "bitmapPresent"):
+                    field[field == eccodes.codes_get(gid, "missingValue")] = np.nan
+            finally:
+                eccodes.codes_release(gid)
+            values.setdefault(message.variable, {}).setdefault(message.level, {})[message.time] = field.reshape(len(lat), len(lon))
+
+    isobaric = (messages["typeOfLevel"] == "isobaricInhPa").any()
+    data = xr.Dataset(coords = {"time": timeIndex, "lat": lat, "lon": lon})
+    nan = np.full((len(lat), len(lon)), np.nan, dtype = np.float32)
+    for variable, byLevel in values.items():
+        levels = sorted(byLevel, reverse = True)
+        array = np.stack([np.stack([byLevel[level].get(time, nan) for time in timeIndex]) for level in levels], axis = 1)
+        if isobaric:
+            data.coords["level"] = levels
+            data[variable] = (("time", "level", "lat", "lon"), array)
+        else:
+            data[variable] = (("time", "lat", "lon"), array[:, 0])
+
+    os.makedirs(os.path.dirname(toFile) or ".", exist_ok = True)
+    tmp = os.path.join(os.path.dirname(toFile) or ".", f".{os.path.basename(toFile)}.{os.getpid()}.tmp")
+    if kwargs.get("format", "netcdf") == "zarr":
+        chunks = kwargs.get("chunks", {"time": 744})
+        encoding = {name: {"chunks": tuple(min(chunks.get(dim, size), size) for dim, size in data[name].sizes.items())} for name in data.data_vars}
+        data.to_zarr(tmp, mode = "w", encoding = encoding)
+        if os.path.exists(toFile):
+            shutil.rmtree(toFile)
+    else:
+        sptb.save(data, tmp, profile = kwargs.get("profile", "archive"))
+    os.replace(tmp, toFile)
+    return data
+
+def convertMonths(months, fromDir, toDir, kinds = ("surface", "upper"), **kwargs):
+    """
+    Convert the monthly GRIB files of a set of months, in parallel.
+
+    Parameters
+    ----------
+    months : list
+        The months, as pandas.Period or strings (YYYY-MM).
+    fromDir : str
+        The directory of the downloads, see jobs().
+    toDir : str
+        The directory of the outputs, written to <YYYY>/<mm>/<YYYY>-<mm>_ERA5_<kind>.nc (or .zarr).
+    kinds : tuple
+        The kinds of files, keys of DATASETS.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            workers : int
+                The number of processes, by default the number of CPUs.
+            overwrite : bool
+                Whether to convert again the files already converted, by default False.
+            The other keyword arguments are passed to convert().
+
+    Returns
+    -------
+    pandas.DataFrame
+        The status ("converted", "skipped", "missing" or "failed") and error of each output.
+    """
+    workers, overwrite = kwargs.pop("workers", None), kwargs.pop("overwrite", False)
+    extension = ".zarr" if kwargs.get("format", "netcdf") == "zarr" else ".nc"
+    res, todo = {}, {}
+    for retrieval in jobs(months, fromDir, kinds):
+        relative = os.path.relpath(retrieval["target"], fromDir)
+        toFile = os.path.join(toDir, relative[:-len(".grib")] + extension)
+        if not os.path.exists(retrieval["target"]):
+            res[toFile] = {"status": "missing", "error": None}
+        elif os.path.exists(toFile) and not overwrite:
+            res[toFile] = {"status": "skipped", "error": None}
+        else:
+            todo[toFile] = retrieval["target"]
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(convert, gribFile, toFile, **kwargs): toFile for toFile, gribFile in todo.items()}
+        for future in as_completed(futures):
+            error = future.exception()
+            res[futures[future]] = {"status": "failed" if error else "converted", "error": repr(error) if error else None}
+    return pd.DataFrame.from_dict(res, orient = "index")
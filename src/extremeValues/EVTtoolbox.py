@@ -0,0 +1,513 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import minimize
+
+# Below this absolute value, the shape parameter is treated as 0 (Gumbel / exponential limit)
+_GUMBEL = 1e-4
+# Negative log-likelihood of an observation outside of the support of the distribution
+_PENALTY = 1e6
+# Bound of the exponents, to avoid overflows far in the tails
+_MAXEXP = 700.
+
+def blockMaxima(data, **kwargs):
+    """
+    Extract the block maxima of data, in a single streaming pass.
+
+    Parameters
+    ----------
+    data : xarray.DataArray or iterable of xarray.DataArray
+        The data, e.g. SMNtoolbox.loadData()["wind_speed_of_gust"] or linReg.Statistics.loadData() variables,
+        or successive chunks of it (e.g. one per monthly file), sharing all dimensions but dim.
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - freq : str
+            The pandas period frequency of the blocks, by default "Y". Seasons are "Q-NOV".
+        - dim : str
+            The time dimension, by default "time".
+        - minCount : int
+            The minimal number of valid observations of a block, by default 1. Blocks with less are NaN.
+
+    Returns
+    -------
+    xarray.DataArray
+        The block maxima, with dimension "block" (start of the block) in place of dim.
+    """
+    freq = kwargs.get("freq", "Y")
+    dim = kwargs.get("dim", "time")
+    minCount = kwargs.get("minCount", 1)
+
+    chunks = [data] if isinstance(data, xr.DataArray) else data
+    maxima, counts, template = {}, {}, None
+    for chunk in chunks:
+        chunk = chunk.sortby(dim)
+        values, template = _stack(chunk, dim)
+        periods = pd.DatetimeIndex(chunk[dim].values).to_period(freq)
+        starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+        chunkMaxima = np.fmax.reduceat(values, starts, axis = 0)
+        chunkCounts = np.add.reduceat(~np.isnan(values), starts, axis = 0)
+        for period, blockMax, blockCount in zip(periods[starts], chunkMaxima, chunkCounts):
+            if period in maxima:
+                maxima[period] = np.fmax(maxima[period], blockMax)
+                counts[period] = counts[period] + blockCount
+            else:
+                maxima[period], counts[period] = blockMax, blockCount
+
+    periods = sorted(maxima)
+    values = np.array([maxima[period] for period in periods])
+    values[np.array([counts[period] for period in periods]) < minCount] = np.nan
+    result = _unstack(values, template, "block")
+    result.coords["block"] = pd.PeriodIndex(periods).to_timestamp()
+    return result
+
+def peaksOverThreshold(data, threshold = None, **kwargs):
+    """
+    Extract the exceedances of a threshold, in a single streaming pass.
+
+    Parameters
+    ----------
+    data : xarray.DataArray or iterable of xarray.DataArray
+        The data, or successive chunks of it in time order, sharing all dimensions but dim.
+    threshold : float or xarray.DataArray
+        The threshold, a scalar or an array broadcastable to the series (e.g. per station and lead time).
+        If not provided, the quantile q of each series is used (data must then be a DataArray).
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - q : float
+            The quantile used as threshold if threshold is not provided, by default 0.95.
+        - dim : str
+            The time dimension, by default "time".
+        - run : str or pandas.Timedelta
+            Exceedances closer than run belong to the same cluster, of which only the peak is kept.
+            By default all the exceedances are kept.
+
+    Returns
+    -------
+    xarray.Dataset
+        The excesses over the threshold of each series, along dimension "peak" (padded with NaN),
+        with the threshold, the number of valid observations (nobs) and of peaks (count) of each series.
+    """
+    dim = kwargs.get("dim", "time")
+    run = kwargs.get("run", None)
+    if threshold is None:
+        threshold = data.quantile(kwargs.get("q", 0.95), dim = dim).drop_vars("quantile")
+
+    chunks = [data] if isinstance(data, xr.DataArray) else data
+    times, series, excess, nobs, template = [], [], [], 0, None
+    for chunk in chunks:
+        values, template = _stack(chunk, dim)
+        thresholds = _flatten(threshold, template)
+        t, s = np.nonzero(values > thresholds)
+        times.append(chunk[dim].values.astype("datetime64[ns]").astype(np.int64)[t])
+        series.append(s)
+        excess.append(values[t, s] - thresholds[s])
+        nobs = nobs + (~np.isnan(values)).sum(axis = 0)
+    times, series, excess = np.concatenate(times), np.concatenate(series), np.concatenate(excess)
+
+    order = np.lexsort((times, series))
+    times, series, excess = times[order], series[order], excess[order]
+    if run is not None and len(excess):
+        # Runs declustering: a new cluster starts with each series or after a gap longer than run
+        gap = pd.Timedelta(run).value
+        starts = np.flatnonzero(np.r_[True, (series[1:] != series[:-1]) | (np.diff(times) > gap)])
+        excess, series = np.maximum.reduceat(excess, starts), series[starts]
+
+    count = np.bincount(series, minlength = template.size)
+    offsets = np.r_[0, np.cumsum(count)[:-1]]
+    padded = np.full((count.max(initial = 0), template.size), np.nan)
+    padded[np.arange(len(series)) - offsets[series], series] = excess
+
+    return xr.Dataset({
+        "excess": _unstack(padded, template, "peak"),
+        "threshold": _unstack(_flatten(threshold, template)[None], template, "peak").isel(peak = 0, drop = True),
+        "nobs": _unstack(np.asarray(nobs)[None]*np.ones((1, template.size), dtype = int), template, "peak").isel(peak = 0, drop = True),
+        "count": _unstack(count[None], template, "peak").isel(peak = 0, drop = True),
+    })
+
+def fitGEV(maxima, **kwargs):
+    """
+    Fit a GEV distribution to every series of maxima at once, by maximum likelihood.
+
+    All the series are standardised and fitted jointly: the sum of their negative log-likelihoods, with analytic
+    gradients, is minimised by a single L-BFGS-B run. For |shape| < 1e-4, the Gumbel limit is used.
+
+    Parameters
+    ----------
+    maxima : xarray.DataArray
+        The maxima, e.g. from blockMaxima(). NaN values are ignored.
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - dim : str
+            The dimension of the observations, by default "block".
+        - shapeBounds : tuple
+            The bounds of the shape parameter, by default (-1, 1).
+        - minCount : int
+            The minimal number of valid observations to fit a series, by default 3.
+        - maxiter : int
+            The maximum number of iterations, by default 1000.
+
+    Returns
+    -------
+    xarray.Dataset
+        The location, scale and shape of each series, with the negative log-likelihood (nll), the number of
+        observations (n) and whether the fit converged.
+    """
+    values, template = _stack(maxima, kwargs.get("dim", "block"))
+    params, nll, converged = _fitGEV(values, kwargs.get("shapeBounds", (-1., 1.)), kwargs.get("minCount", 3), kwargs.get("maxiter", 1000))
+
+    result = _dataset(template, location = params[0], scale = params[1], shape = params[2], nll = nll,
+                      n = (~np.isnan(values)).sum(axis = 0), converged = converged)
+    result.attrs["distribution"] = "GEV"
+    return result
+
+def fitGPD(excess, **kwargs):
+    """
+    Fit a GPD distribution to every series of excesses at once, by maximum likelihood.
+
+    All the series are rescaled and fitted jointly: the sum of their negative log-likelihoods, with analytic
+    gradients, is minimised by a single L-BFGS-B run. For |shape| < 1e-4, the exponential limit is used.
+
+    Parameters
+    ----------
+    excess : xarray.Dataset or xarray.DataArray
+        The output of peaksOverThreshold() (the threshold, nobs and count are kept for the return levels),
+        or the excesses only. NaN values are ignored.
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - dim : str
+            The dimension of the observations, by default "peak".
+        - shapeBounds : tuple
+            The bounds of the shape parameter, by default (-1, 1).
+        - minCount : int
+            The minimal number of valid observations to fit a series, by default 3.
+        - maxiter : int
+            The maximum number of iterations, by default 1000.
+
+    Returns
+    -------
+    xarray.Dataset
+        The scale and shape of each series, with the negative log-likelihood (nll), the number of
+        observations (n) and whether the fit converged.
+    """
+    data = excess["excess"] if isinstance(excess, xr.Dataset) else excess
+    values, template = _stack(data, kwargs.get("dim", "peak"))
+    params, nll, converged = _fitGPD(values, kwargs.get("shapeBounds", (-1., 1.)), kwargs.get("minCount", 3), kwargs.get("maxiter", 1000))
+
+    result = _dataset(template, scale = params[0], shape = params[1], nll = nll,
+                      n = (~np.isnan(values)).sum(axis = 0), converged = converged)
+    if isinstance(excess, xr.Dataset):
+        result = result.assign(threshold = excess["threshold"], nobs = excess["nobs"], count = excess["count"])
+    result.attrs["distribution"] = "GPD"
+    return result
+
+def returnLevels(params, periods, **kwargs):
+    """
+    Compute the return levels of fitted distributions.
+
+    Parameters
+    ----------
+    params : xarray.Dataset
+        The output of fitGEV() or fitGPD() (fitted on the output of peaksOverThreshold()).
+    periods : list
+        The return periods, in blocks for a GEV and in units of obsPerPeriod observations for a GPD.
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - obsPerPeriod : float
+            For a GPD, the number of observations per period unit, by default 1.
+
+    Returns
+    -------
+    xarray.DataArray
+        The return levels, with a dimension "period".
+    """
+    periods = np.asarray(periods, dtype = float)
+    template = params[_PARAMETERS[params.attrs["distribution"]][0]]
+    levels = _returnLevels(params.attrs["distribution"], _parameters(params), periods, _levelArguments(params, **kwargs))
+    result = _unstack(levels, template, "period")
+    result.coords["period"] = periods
+    return result
+
+def bootstrapReturnLevels(params, periods, **kwargs):
+    """
+    Compute parametric bootstrap confidence intervals of the return levels of fitted distributions.
+
+    Samples of the size of each series are drawn from its fitted distribution, refitted (all series and replicates
+    of a chunk at once) and their return levels computed, chunks of replicates being spread across a process pool.
+    For a GPD, the threshold and the exceedance rate are kept fixed.
+
+    Parameters
+    ----------
+    params : xarray.Dataset
+        The output of fitGEV() or fitGPD().
+    periods : list
+        The return periods, as in returnLevels().
+    **kwargs : dict
+        Additional keyword arguments.
+        The valid keyword arguments are:
+        - nboot : int
+            The number of bootstrap replicates, by default 200.
+        - alpha : float
+            The level of the confidence intervals, by default 0.05.
+        - chunksize : int
+            The number of replicates fitted together in a worker, by default 25.
+        - workers : int
+            The number of processes, by default the number of CPUs.
+        - seed : int
+            The seed of the random generator, by default 0.
+        - obsPerPeriod, shapeBounds, minCount, maxiter
+            As in returnLevels() and fitGEV() / fitGPD().
+
+    Returns
+    -------
+    xarray.Dataset
+        The return levels, and the lower and upper bounds of their confidence intervals.
+    """
+    nboot = kwargs.get("nboot", 200)
+    alpha = kwargs.get("alpha", 0.05)
+    chunksize = kwargs.get("chunksize", 25)
+    periods = np.asarray(periods, dtype = float)
+
+    distribution = params.attrs["distribution"]
+    template = params[_PARAMETERS[distribution][0]]
+    theta = _parameters(params)
+    n = _flatten(params["n"], template).astype(int)
+    task = (distribution, theta, n, periods, _levelArguments(params, **kwargs),
+            kwargs.get("shapeBounds", (-1., 1.)), kwargs.get("minCount", 3), kwargs.get("maxiter", 1000))
+
+    sizes = [min(chunksize, nboot - start) for start in range(0, nboot, chunksize)]
+    seeds = np.random.SeedSequence(kwargs.get("seed", 0)).spawn(len(sizes))
+    with ProcessPoolExecutor(max_workers = kwargs.get("workers", None)) as executor:
+        replicates = np.concatenate(list(executor.map(_bootstrapChunk, [task]*len(sizes), sizes, seeds)))
+
+    lower, upper = np.nanquantile(replicates, [alpha/2, 1 - alpha/2], axis = 0)
+    result = xr.Dataset({
+        "return_level": _unstack(_returnLevels(distribution, theta, periods, task[4]), template, "period"),
+        "lower": _unstack(lower, template, "period"),
+        "upper": _unstack(upper, template, "period"),
+    })
+    result.coords["period"] = periods
+    result.attrs.update(distribution = distribution, nboot = nboot, alpha = alpha)
+    return result
+
+# Parameters of each distribution, in the order of the fitting functions
+_PARAMETERS = {"GEV": ("location", "scale", "shape"), "GPD": ("scale", "shape")}
+
+def _stack(data, dim):
+    """
+    Get the values of data as a (dim, series) float array, and a template of the series (data without dim).
+    """
+    template = data.isel({dim: 0}, drop = True)
+    values = data.transpose(dim, *template.dims).values.reshape(data.sizes[dim], -1).astype(float)
+    return values, template
+
+def _unstack(values, template, dim):
+    """
+    Rebuild a DataArray from (dim, series) values and a template of the series.
+    """
+    return xr.DataArray(values.reshape((values.shape[0],) + template.shape), dims = (dim,) + template.dims, coords = template.coords)
+
+def _flatten(value, template):
+    """
+    Broadcast a scalar or DataArray to the series of a template, as a flat array.
+    """
+    if isinstance(value, xr.DataArray):
+        return value.broadcast_like(template).transpose(*template.dims).values.ravel().astype(float)
+    return np.broadcast_to(np.asarray(value, dtype = float), template.shape).ravel().copy()
+
+def _dataset(template, **variables):
+    """
+    Rebuild a Dataset from flat arrays over the series of a template.
+    """
+    return xr.Dataset({name: _unstack(np.asarray(value)[None], template, "_").isel(_ = 0, drop = True) for name, value in variables.items()})
+
+def _parameters(params):
+    """
+    Get the fitted parameters of a Dataset as a (parameter, series) array.
+    """
+    names = _PARAMETERS[params.attrs["distribution"]]
+    return np.array([_flatten(params[name], params[names[0]]) for name in names])
+
+def _levelArguments(params, **kwargs):
+    """
+    Get the additional arguments of the return levels of a GPD: threshold and number of exceedances per period.
+    """
+    if params.attrs["distribution"] != "GPD" or "threshold" not in params:
+        return None
+    template = params["scale"]
+    rate = _flatten(params["count"], template)/_flatten(params["nobs"], template)
+    return _flatten(params["threshold"], template), rate*kwargs.get("obsPerPeriod", 1.)
+
+def _returnLevels(distribution, theta, periods, arguments):
+    """
+    Compute the (period, series) return levels of (parameter, series) parameters.
+    """
+    if distribution == "GEV":
+        location, scale, shape = theta[:, None]
+        logy = np.log(-np.log1p(-1/periods))[:, None]
+        base = location
+    else:
+        scale, shape = theta[:, None]
+        if arguments is None:
+            raise ValueError("The return levels of a GPD need the threshold and rate: fit it on the output of peaksOverThreshold().")
+        base, rate = arguments
+        rate = periods[:, None]*rate
+        logy = np.where(rate >= 1, -np.log(np.where(rate > 0, rate, 1.)), np.nan)
+    gumbel = np.abs(shape) < _GUMBEL
+    safe = np.where(gumbel, 1., shape)
+    return base + scale*np.where(gumbel, -logy, np.expm1(-safe*logy)/safe)
+
+def _fit(objective, values, theta0, bounds, maxiter):
+    """
+    Minimise the sum of the negative log-likelihoods of all the series at once.
+
+    Returns the (parameter, series) parameters, the negative log-likelihood of each series and whether it converged.
+    """
+    mask = ~np.isnan(values)
+    x = np.where(mask, values, 0.)
+    k = theta0.shape[0]
+
+    def fun(theta):
+        nll, grad = objective(theta.reshape(k, -1), x, mask)
+        return nll.sum(), grad.ravel()
+
+    result = minimize(fun, theta0.ravel(), jac = True, method = "L-BFGS-B", bounds = _bounds(bounds, theta0.shape[1]),
+                      options = {"maxiter": maxiter, "maxfun": 2*maxiter, "ftol": 1e-12, "gtol": 1e-6})
+    theta = result.x.reshape(k, -1)
+    nll, grad = objective(theta, x, mask)
+
+    # Projected gradient of each series: components pointing out of the bounds do not count
+    lower, upper = np.array(_bounds(bounds, theta.shape[1]), dtype = float).T.reshape(2, k, -1)
+    grad = np.where((theta <= lower) & (grad > 0), 0., grad)
+    grad = np.where((theta >= upper) & (grad < 0), 0., grad)
+    converged = (np.abs(grad).max(axis = 0) < 1e-3*np.maximum(mask.sum(axis = 0), 1)) & (nll < _PENALTY)
+    return theta, nll, converged
+
+def _bounds(bounds, nseries):
+    """
+    Expand per-parameter bounds to the (parameter, series) layout of the fitting vector.
+    """
+    return [bound for bound in bounds for _ in range(nseries)]
+
+def _fitGEV(values, shapeBounds, minCount, maxiter):
+    """
+    Fit a GEV to each column of values. Returns (location, scale, shape), the negative log-likelihood and convergence.
+    """
+    valid = (~np.isnan(values)).sum(axis = 0) >= minCount
+    theta = np.full((3, values.shape[1]), np.nan)
+    nll, converged = np.full(values.shape[1], np.nan), np.zeros(values.shape[1], dtype = bool)
+    if not valid.any():
+        return theta, nll, converged
+
+    # Standardising the series, so that one starting point and tolerance fit them all
+    x = values[:, valid]
+    mean, std = np.nanmean(x, axis = 0), np.nanstd(x, axis = 0)
+    std = np.where(std > 0, std, 1.)
+    theta0 = np.tile(np.array([[-0.45], [np.log(0.78)], [0.1]]), (1, x.shape[1]))
+    fitted, nll[valid], converged[valid] = _fit(_gevNLL, (x - mean)/std, theta0, [(None, None), (None, None), shapeBounds], maxiter)
+
+    theta[:, valid] = mean + std*fitted[0], std*np.exp(fitted[1]), fitted[2]
+    nll[valid] += (~np.isnan(x)).sum(axis = 0)*np.log(std)
+    return theta, nll, converged
+
+def _fitGPD(values, shapeBounds, minCount, maxiter):
+    """
+    Fit a GPD to each column of values. Returns (scale, shape), the negative log-likelihood and convergence.
+    """
+    valid = (~np.isnan(values)).sum(axis = 0) >= minCount
+    theta = np.full((2, values.shape[1]), np.nan)
+    nll, converged = np.full(values.shape[1], np.nan), np.zeros(values.shape[1], dtype = bool)
+    if not valid.any():
+        return theta, nll, converged
+
+    # Rescaling the series by their mean, the exponential maximum likelihood estimate of the scale
+    x = values[:, valid]
+    mean = np.nanmean(x, axis = 0)
+    mean = np.where(mean > 0, mean, 1.)
+    theta0 = np.tile(np.array([[0.], [0.1]]), (1, x.shape[1]))
+    fitted, nll[valid], converged[valid] = _fit(_gpdNLL, x/mean, theta0, [(None, None), shapeBounds], maxiter)
+
+    theta[:, valid] = mean*np.exp(fitted[0]), fitted[1]
+    nll[valid] += (~np.isnan(x)).sum(axis = 0)*np.log(mean)
+    return theta, nll, converged
+
+def _gevNLL(theta, x, mask):
+    """
+    Negative log-likelihood of a GEV, per series, and its gradient with respect to (location, log-scale, shape).
+    """
+    location, logscale, shape = theta
+    scale = np.exp(logscale)
+    z = (x - location)/scale
+    gumbel = np.abs(shape) < _GUMBEL
+    safe = np.where(gumbel, 1., shape)
+    t = 1 + safe*z
+    valid = mask & (gumbel | (t > 0))
+    t = np.where(valid & ~gumbel, t, 1.)
+    logt = np.log(t)
+    y = np.exp(np.minimum(np.where(gumbel, -z, -logt/safe), _MAXEXP))
+
+    nll = logscale + np.where(gumbel, z + y, (1 + 1/safe)*logt + y)
+    dz = np.where(gumbel, 1 - y, (1 + safe - y)/t)
+    dshape = np.where(gumbel, z - z**2*(1 - y)/2, -(1 - y)*logt/safe**2 + z/t*(1 + (1 - y)/safe))
+
+    outside = mask & ~valid
+    grad = np.array([-dz/scale, 1 - z*dz, dshape])
+    nll = np.where(valid, nll, np.where(outside, _PENALTY, 0.)).sum(axis = 0)
+    return nll, np.where(valid, grad, 0.).sum(axis = 1)
+
+def _gpdNLL(theta, x, mask):
+    """
+    Negative log-likelihood of a GPD, per series, and its gradient with respect to (log-scale, shape).
+    """
+    logscale, shape = theta
+    w = x/np.exp(logscale)
+    exponential = np.abs(shape) < _GUMBEL
+    safe = np.where(exponential, 1., shape)
+    t = 1 + safe*w
+    valid = mask & (exponential | (t > 0))
+    t = np.where(valid & ~exponential, t, 1.)
+    logt = np.log(t)
+
+    nll = logscale + np.where(exponential, w, (1 + 1/safe)*logt)
+    dlogscale = 1 - np.where(exponential, w, (1 + safe)*w/t)
+    dshape = np.where(exponential, w - w**2/2, -logt/safe**2 + (1 + 1/safe)*w/t)
+
+    outside = mask & ~valid
+    grad = np.array([dlogscale, dshape])
+    nll = np.where(valid, nll, np.where(outside, _PENALTY, 0.)).sum(axis = 0)
+    return nll, np.where(valid, grad, 0.).sum(axis = 1)
+
+def _sample(distribution, theta, n, size, rng):
+    """
+    Draw size replicates of n[i] observations of each series, as a (max(n), size*series) array padded with NaN.
+    """
+    u = rng.uniform(size = (n.max(initial = 0), size, theta.shape[1]))
+    shape = theta[-1]
+    gumbel = np.abs(shape) < _GUMBEL
+    safe = np.where(gumbel, 1., shape)
+    if distribution == "GEV":
+        logy = np.log(-np.log(u))
+        x = theta[0] + theta[1]*np.where(gumbel, -logy, np.expm1(-safe*logy)/safe)
+    else:
+        logu = np.log(u)
+        x = theta[0]*np.where(gumbel, -logu, np.expm1(-safe*logu)/safe)
+    x[np.broadcast_to(np.arange(x.shape[0])[:, None, None] >= n, x.shape)] = np.nan
+    return x.reshape(x.shape[0], -1)
+
+def _bootstrapChunk(task, size, seed):
+    """
+    Fit a chunk of bootstrap replicates and compute their (replicate, period, series) return levels.
+    """
+    distribution, theta, n, periods, arguments, shapeBounds, minCount, maxiter = task
+    rng = np.random.default_rng(seed)
+    x = _sample(distribution, np.nan_to_num(theta), np.where(np.isnan(theta).any(axis = 0), 0, n), size, rng)
+    fitted = (_fitGEV if distribution == "GEV" else _fitGPD)(x, shapeBounds, minCount, maxiter)[0]
+    if arguments is not None:
+        arguments = tuple(np.tile(argument, size) for argument in arguments)
+    levels = _returnLevels(distribution, fitted, periods, arguments)
+    return levels.reshape(len(periods), size, -1).transpose(1, 0, 2)
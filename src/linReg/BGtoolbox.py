@@ -0,0 +1,272 @@
+import numpy as np
+import pandas as pd
+import os
+import sys
+import json
+import queue
+import threading
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import linReg.LRtoolbox as lrtb
+
+# Edges of the bins of distance to the nearest storm used for stratification (NaN distances are in a last bin)
+DISTANCE_BINS = (0., 1., 2., 5., 10., np.inf)
+
+def writeSamples(data, features, target, toDir, **kwargs):
+    """
+    Write (features, target) samples to memory-mapped, sample-major files, in one streaming pass.
+
+    Each (lead_time, time, station) triplet with a valid target is a sample. The samples are split by bin of
+    distance to the nearest storm: stratum k is stored in toDir/stratum_k.f32 (one float32 row per sample,
+    the features followed by the target) and toDir/stratum_k.i64 (time, lead time index and station index
+    of each sample). toDir/schema.json is written last, so that an interrupted write is not used.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or str or iterable of xarray.Dataset
+        The data, as in LRtoolbox.sufficientStatistics().
+    features : list
+        The names of the variables used as features. Variables without lead_time are shared by all lead times.
+    target : str
+        The name of the target variable.
+    toDir : str
+        The directory to write the samples to.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            distance : str
+                The variable of the distance to the nearest storm, by default "distance". If it is missing,
+                all the samples are in the last stratum.
+            distanceBins : tuple
+                The edges of the bins of distance, by default DISTANCE_BINS.
+            dropna : bool
+                Whether to also drop the samples with a missing feature, by default False.
+            chunkSize : int
+                The number of time steps read at once, by default 744.
+            overwrite : bool
+                Whether to write the samples again if toDir already holds some, by default False.
+
+    Returns
+    -------
+    dict
+        The schema of the samples.
+    """
+    schemaFile = os.path.join(toDir, "schema.json")
+    if os.path.exists(schemaFile) and not kwargs.get("overwrite", False):
+        return readSchema(toDir)
+    os.makedirs(toDir, exist_ok = True)
+    if os.path.exists(schemaFile):
+        os.remove(schemaFile)
+
+    distanceName = kwargs.get("distance", "distance")
+    edges = np.asarray(kwargs.get("distanceBins", DISTANCE_BINS), dtype = float)
+    nstrata = len(edges)
+    counts = np.zeros(nstrata, dtype = int)
+    stations, stationIndex, leadTimes = [], {}, None
+    files = [(open(os.path.join(toDir, f"stratum_{k}.f32"), "wb"), open(os.path.join(toDir, f"stratum_{k}.i64"), "wb")) for k in range(nstrata)]
+    try:
+        for chunk in lrtb._chunks(data, kwargs.get("chunkSize", 744)):
+            X, y, chunkLeadTimes, chunkStations = lrtb._design(chunk, features, target)
+            if leadTimes is None:
+                leadTimes = chunkLeadTimes
+            for station in chunkStations:
+                stationIndex.setdefault(station, len(stations))
+                if stationIndex[station] == len(stations):
+                    stations.append(station)
+            leadTimeIndex = pd.Index(leadTimes).get_indexer(chunkLeadTimes)
+            if (leadTimeIndex < 0).any():
+                raise ValueError(f"The lead times {np.asarray(chunkLeadTimes)[leadTimeIndex < 0].tolist()} are not in the first chunk of the data")
+            L, T, S = len(chunkLeadTimes), chunk.sizes["time"], len(chunkStations)
+
+            if distanceName in chunk:
+                distance = lrtb._design(chunk, [distanceName], distanceName)[1].ravel()
+                stratum = np.where(np.isnan(distance), nstrata - 1, np.clip(np.searchsorted(edges, distance, side = "right") - 1, 0, nstrata - 2))
+            else:
+                stratum = np.full(L*T*S, nstrata - 1)
+            meta = np.stack([np.tile(np.repeat(chunk.time.values.astype("datetime64[ns]").astype(np.int64), S), L),
+                             np.repeat(leadTimeIndex, T*S),
+                             np.tile([stationIndex[station] for station in chunkStations], L*T)], axis = 1)
+            rows = np.concatenate([X, y[..., None]], axis = -1).reshape(L*T*S, -1)
+            keep = np.isfinite(rows[:, -1])
+            if kwargs.get("dropna", False):
+                keep &= np.isfinite(rows).all(axis = 1)
+            for k in np.unique(stratum[keep]):
+                selected = keep & (stratum == k)
+                files[k][0].write(rows[selected].astype("<f4").tobytes())
+                files[k][1].write(meta[selected].astype("<i8").tobytes())
+                counts[k] += selected.sum()
+    finally:
+        for valuesFile, metaFile in files:
+            valuesFile.close()
+            metaFile.close()
+
+    schema = {"features": list(features), "target": target, "counts": counts.tolist(), "distanceBins": edges.tolist(),
+              "lead_time": np.asarray(leadTimes).tolist(), "station": [str(station) for station in stations]}
+    tmp = schemaFile + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(schema, f)
+    os.replace(tmp, schemaFile)
+    return schema
+
+def readSchema(fromDir):
+    """
+    Read the schema of samples written by writeSamples().
+
+    Parameters
+    ----------
+    fromDir : str
+        The directory of the samples.
+
+    Returns
+    -------
+    dict
+        The features, target, number of samples per stratum, distance bins, lead times and stations.
+    """
+    with open(os.path.join(fromDir, "schema.json")) as f:
+        return json.load(f)
+
+def batches(fromDir, batchSize = 256, **kwargs):
+    """
+    Stream shuffled mini-batches of samples written by writeSamples().
+
+    Each stratum is read by contiguous blocks, in random order, into a shuffle buffer from which the samples are
+    drawn at random, so that the cost of a batch does not depend on the size of the dataset. Batches are
+    prepared by a background thread.
+
+    Parameters
+    ----------
+    fromDir : str
+        The directory of the samples.
+    batchSize : int
+        The number of samples of a batch.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            weights : str or list
+                The proportion of each stratum (bin of distance to the nearest storm) in the batches: "natural"
+                (their proportion in the data, by default), "balanced" (the same for each non-empty stratum)
+                or a list of weights.
+            nbatches : int
+                The number of batches, by default the number of samples divided by batchSize. Each batch is drawn with replacement
+                across the strata, so the default gives about as many samples as the dataset rather than a pass over every sample.
+            bufferSize : int
+                The number of samples of the shuffle buffer of each stratum, by default 65536.
+            blockSize : int
+                The number of contiguous samples read at once, by default 4096.
+            prefetch : int
+                The number of batches prepared in advance, by default 4.
+            withMeta : bool
+                Whether to also yield the (time, lead time index, station index) of the samples, by default False.
+            seed : int
+                The seed of the random generator.
+
+    Yields
+    ------
+    X : numpy.ndarray
+        The (batch, feature) features.
+    y : numpy.ndarray
+        The target.
+    meta : numpy.ndarray
+        The (batch, 3) time, lead time index and station index, if withMeta.
+    """
+    schema = readSchema(fromDir)
+    counts = np.asarray(schema["counts"])
+    weights = kwargs.get("weights", "natural")
+    if isinstance(weights, str):
+        weights = counts.astype(float) if weights == "natural" else (counts > 0).astype(float)
+    weights = np.where(counts > 0, np.asarray(weights, dtype = float), 0.)
+    if weights.sum() == 0:
+        raise ValueError(f"No samples to draw from in {fromDir}.")
+    weights = weights/weights.sum()
+    nbatches = kwargs.get("nbatches", int(counts.sum())//batchSize)
+    withMeta = kwargs.get("withMeta", False)
+
+    rng = np.random.default_rng(kwargs.get("seed", None))
+    width = len(schema["features"]) + 1
+    streams = {}
+    for k in np.flatnonzero(weights):
+        values = np.memmap(os.path.join(fromDir, f"stratum_{k}.f32"), dtype = "<f4", mode = "r", shape = (counts[k], width))
+        meta = np.memmap(os.path.join(fromDir, f"stratum_{k}.i64"), dtype = "<i8", mode = "r", shape = (counts[k], 3))
+        streams[k] = _ShuffleStream(values, meta, kwargs.get("blockSize", 4096), kwargs.get("bufferSize", 65536), rng)
+
+    def produce(output, stop):
+        try:
+            for _ in range(nbatches):
+                sizes = rng.multinomial(batchSize, weights)
+                parts = [streams[k].take(size) for k, size in enumerate(sizes) if size > 0]
+                values = np.concatenate([part[0] for part in parts])
+                meta = np.concatenate([part[1] for part in parts])
+                order = rng.permutation(batchSize)
+                batch = (values[order, :-1], values[order, -1]) + ((meta[order],) if withMeta else ())
+                while not stop.is_set():
+                    try:
+                        output.put(batch, timeout = 0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            output.put(None)
+        except BaseException as error:
+            output.put(error)
+
+    output, stop = queue.Queue(maxsize = kwargs.get("prefetch", 4)), threading.Event()
+    thread = threading.Thread(target = produce, args = (output, stop), daemon = True)
+    thread.start()
+    try:
+        while True:
+            batch = output.get()
+            if batch is None:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+
+class _ShuffleStream:
+    """
+    Shuffle buffer over the samples of a stratum, refilled by contiguous blocks read in random order (endlessly,
+    with a new order at each pass).
+    """
+    def __init__(self, values, meta, blockSize, bufferSize, rng):
+        self.values, self.meta, self.rng = values, meta, rng
+        self.blocks = np.arange(0, len(values), blockSize)
+        self.blockSize = blockSize
+        self.order, self.position = rng.permutation(len(self.blocks)), 0
+        self.pending = (np.empty((0, values.shape[1]), dtype = values.dtype), np.empty((0, 3), dtype = meta.dtype))
+        self.buffer = self._next(min(bufferSize, len(values)))
+
+    def _next(self, n):
+        """
+        Get the next n samples of the block stream.
+        """
+        values, meta = [self.pending[0]], [self.pending[1]]
+        available = len(self.pending[0])
+        while available < n:
+            if self.position == len(self.order):
+                self.order, self.position = self.rng.permutation(len(self.blocks)), 0
+            start = self.blocks[self.order[self.position]]
+            self.position += 1
+            values.append(np.asarray(self.values[start:start + self.blockSize]))
+            meta.append(np.asarray(self.meta[start:start + self.blockSize]))
+            available += len(values[-1])
+        values, meta = np.concatenate(values), np.concatenate(meta)
+        self.pending = (values[n:], meta[n:])
+        return values[:n], meta[:n]
+
+    def take(self, n):
+        """
+        Draw n samples from the buffer, replacing them with the next samples of the block stream.
+        """
+        values, meta = [], []
+        while n > 0:
+            k = min(n, len(self.buffer[0]))
+            index = self.rng.choice(len(self.buffer[0]), k, replace = False)
+            values.append(self.buffer[0][index])
+            meta.append(self.buffer[1][index])
+            refill = self._next(k)
+            self.buffer[0][index], self.buffer[1][index] = refill
+            n -= k
+        return np.concatenate(values), np.concatenate(meta)
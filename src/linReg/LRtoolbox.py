@@ -0,0 +1,393 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import os
+import json
+
+
+def sufficientStatistics(data, features, target, **kwargs):
+    """
+    Accumulate the sufficient statistics of a linear regression of target on features, in one sequential pass.
+
+    The sums of x, y, xxᵀ, xy and y² are accumulated chunk by chunk, separately for each lead time and station
+    cluster, so that the data never has to fit in memory. The variables are shifted by their mean over the first
+    chunk before being accumulated, to limit cancellations when centering.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or str or iterable of xarray.Dataset
+        The output of linReg.Statistics.loadData(), a directory of partitions built by
+        linReg.Statistics.buildPartitions(), or successive chunks of such data.
+    features : list
+        The names of the variables used as features. Variables without lead_time are shared by all lead times.
+    target : str
+        The name of the target variable.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            clusters : xarray.DataArray
+                The cluster of each station (e.g. the label of SMNtoolbox.KMeansStationClustering()).
+                Stations without a cluster are ignored. By default, all stations are in a single cluster.
+            chunkSize : int
+                The number of time steps read at once, by default 744 (a month of hourly data).
+            folds : int
+                The number of blocked time folds to accumulate separately (for crossValidate()), by default 1.
+            block : str
+                The pandas period frequency of the time blocks, by default "M". Blocks are assigned to the folds
+                in turn, so that each fold covers all the seasons.
+            gap : str or pandas.Timedelta
+                The time steps closer than gap to the boundaries of their block are left out of every fold, so
+                that a storm does not span training and validation folds. By default none are.
+
+    Returns
+    -------
+    stats : dict
+        The sums of each (fold, lead_time, cluster) group, with the features, target, shift and group labels.
+    """
+    clusters = kwargs.get("clusters", None)
+    chunkSize = kwargs.get("chunkSize", 744)
+    folds = kwargs.get("folds", 1)
+
+    stats = None
+    for chunk in _chunks(data, chunkSize):
+        X, y, leadTimes, stations = _design(chunk, features, target)
+        if stats is None:
+            stats = _emptyStatistics(X, y, features, target, leadTimes, clusters, folds)
+        cluster = np.tile(_clusterIndex(stats, stations), chunk.sizes["time"])
+        fold = np.repeat(_foldIndex(chunk.time.values, folds, kwargs.get("block", "M"), kwargs.get("gap", None)), len(stations))
+        _accumulate(stats, X - stats["shift_x"], y - stats["shift_y"], np.where((cluster >= 0) & (fold >= 0), fold*len(stats["cluster"]) + cluster, -1))
+    if stats is None:
+        raise ValueError("No data to accumulate.")
+    return stats
+
+def fitRidge(data, features = None, target = None, **kwargs):
+    """
+    Fit a (ridge) linear regression for each lead time and station cluster, in one sequential pass over the data.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or str or iterable of xarray.Dataset or dict
+        The data, as in sufficientStatistics(), or sufficient statistics already accumulated.
+    features : list
+        The names of the variables used as features.
+    target : str
+        The name of the target variable.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            lam : float or numpy.ndarray
+                The ridge penalty on the standardised coefficients, by default 0 (ordinary least squares).
+                It can be an array of shape (lead_time, cluster).
+            clusters, chunkSize
+                As in sufficientStatistics().
+
+    Returns
+    -------
+    model : xarray.Dataset
+        The coefficient, intercept and number of samples (n) of each (lead_time, cluster) group.
+    """
+    stats = data if isinstance(data, dict) else sufficientStatistics(data, features, target, **kwargs)
+    return solveRidge(stats, kwargs.get("lam", 0.))
+
+def solveRidge(stats, lam = 0.):
+    """
+    Solve the (ridge) regressions of all the groups of sufficient statistics at once, with a batched Cholesky.
+
+    The ridge penalty applies to the coefficients of the standardised features, and not to the intercept, so that
+    it does not depend on the units of the features.
+
+    Parameters
+    ----------
+    stats : dict
+        The sufficient statistics, as returned by sufficientStatistics().
+    lam : float or numpy.ndarray
+        The ridge penalty, a scalar or an array of shape (lead_time, cluster).
+
+    Returns
+    -------
+    model : xarray.Dataset
+        The coefficient, intercept and number of samples (n) of each (lead_time, cluster) group.
+        Groups which cannot be solved (too few samples, collinear features without penalty) are NaN.
+    """
+    n, mx, my, cxx, cxy, _ = _centered(_pooled(stats))
+    scale, gram, rhs = _standardised(cxx, cxy)
+    p = gram.shape[-1]
+    lam = np.broadcast_to(np.asarray(lam, dtype = float), n.shape)
+    gamma = _choleskySolve(gram + lam[..., None, None]*np.eye(p), rhs)
+    return _model(stats, gamma/scale, n, mx, my)
+
+def predict(model, data):
+    """
+    Predict the target with a fitted model.
+
+    Parameters
+    ----------
+    model : xarray.Dataset
+        The fitted model, as returned by fitRidge() or solveRidge().
+    data : xarray.Dataset
+        The data, with the features of the model.
+
+    Returns
+    -------
+    xarray.DataArray
+        The prediction, over the lead times of the model.
+    """
+    if "station_cluster" in model:
+        labels = model["station_cluster"].reindex(station = data.station).values
+        position = pd.Index(model.cluster.values).get_indexer(labels)
+    else:
+        position = np.zeros(data.sizes["station"], dtype = int)
+    known = xr.DataArray(position >= 0, dims = ["station"])
+    position = xr.DataArray(np.maximum(position, 0), dims = ["station"])
+    coefficient = model["coefficient"].isel(cluster = position).where(known)
+    intercept = model["intercept"].isel(cluster = position).where(known)
+    
+    result = intercept.drop_vars("cluster").assign_coords(station = data.station.values)
+    for feature in model.feature.values:
+        result = result + coefficient.sel(feature = feature, drop = True).drop_vars("cluster").assign_coords(station = data.station.values)*data[feature]
+    return result.rename(model.attrs["target"])
+
+def crossValidate(data, features = None, target = None, lambdas = (0.,), **kwargs):
+    """
+    Select the ridge penalty of each lead time and station cluster by blocked time cross-validation.
+    
+    The sufficient statistics of every fold are accumulated in one pass over the data. For each fold, the
+    correlation matrix of the training folds is decomposed once (for all the lead times and clusters at once),
+    and the whole regularisation path is evaluated on the validation fold from this decomposition and the
+    sufficient statistics of the fold, without refitting.
+    
+    Parameters
+    ----------
+    data : xarray.Dataset or str or iterable of xarray.Dataset or dict
+        The data, as in sufficientStatistics(), or sufficient statistics accumulated with folds.
+    features : list
+        The names of the variables used as features.
+    target : str
+        The name of the target variable.
+    lambdas : list
+        The ridge penalties to evaluate.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            folds : int
+                The number of folds, by default 5.
+            block, gap, clusters, chunkSize
+                As in sufficientStatistics().
+    
+    Returns
+    -------
+    cv : xarray.Dataset
+        The validation mean squared error of each penalty (mse, and fold_mse per fold) and the best penalty
+        (best_lambda) of each (lead_time, cluster) group.
+    model : xarray.Dataset
+        The model fitted on all the folds with the best penalty of each group.
+    """
+    if isinstance(data, dict):
+        stats = data
+    else:
+        kwargs.setdefault("folds", 5)
+        stats = sufficientStatistics(data, features, target, **kwargs)
+    folds = stats["n"].shape[0]
+    if folds < 2:
+        raise ValueError("Cross-validation needs sufficient statistics accumulated with at least 2 folds.")
+    lambdas = np.asarray(lambdas, dtype = float)
+    
+    sse = np.zeros((folds, len(lambdas)) + stats["n"].shape[1:])
+    for k in range(folds):
+        n, mx, my, cxx, cxy, _ = _centered(_pooled(stats, exclude = k))
+        scale, gram, rhs = _standardised(cxx, cxy)
+        good = np.isfinite(gram).all(axis = (-2, -1)) & np.isfinite(rhs).all(axis = -1)
+        eigenvalues, eigenvectors = np.linalg.eigh(np.where(good[..., None, None], gram, np.eye(gram.shape[-1])))
+        
+        # Coefficients of the whole path: V diag(1/(e + lambda)) V^T rhs
+        projection = np.einsum("...ji,...j->...i", eigenvectors, rhs)
+        with np.errstate(divide = "ignore", invalid = "ignore"):
+            shrunk = projection/(eigenvalues + lambdas.reshape((-1,) + (1,)*eigenvalues.ndim))
+        beta = np.einsum("...ij,l...j->l...i", eigenvectors, shrunk)/scale
+        intercept = my - (beta*mx).sum(axis = -1)
+        
+        test = {name: stats[name][k] for name in _SUMS}
+        with np.errstate(invalid = "ignore"):
+            sse[k] = (test["yy"] - 2*intercept*test["sy"] - 2*(beta*test["xy"]).sum(axis = -1) + test["n"]*intercept**2
+                      + 2*intercept*(beta*test["sx"]).sum(axis = -1) + np.einsum("l...i,...ij,l...j->l...", beta, test["xx"], beta))
+        sse[k] = np.where(good, sse[k], np.nan)
+    
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        foldMSE = sse/stats["n"][:, None]
+        mse = sse.sum(axis = 0)/stats["n"].sum(axis = 0)
+    solvable = np.isfinite(mse).any(axis = 0)
+    best = np.where(solvable, lambdas[np.argmin(np.where(np.isfinite(mse), mse, np.inf), axis = 0)], np.nan)
+    
+    coords = {"fold": np.arange(folds), "lambda": lambdas, "lead_time": stats["lead_time"], "cluster": stats["cluster"]}
+    cv = xr.Dataset(
+        data_vars = {"mse": (["lambda", "lead_time", "cluster"], mse),
+                     "fold_mse": (["fold", "lambda", "lead_time", "cluster"], foldMSE),
+                     "best_lambda": (["lead_time", "cluster"], best)},
+        coords = coords
+    )
+    return cv, solveRidge(stats, best)
+
+def partitionFiles(dirname):
+    """
+    Get the files of the monthly partitions built by linReg.Statistics.buildPartitions(), in time order.
+    
+    Parameters
+    ----------
+    dirname : str
+        The directory of the partitions.
+    
+    Returns
+    -------
+    list
+        The paths of the partitions.
+    """
+    with open(os.path.join(dirname, "manifest.json")) as f:
+        manifest = json.load(f)
+    return [os.path.join(dirname, manifest[month]["file"]) for month in sorted(manifest)]
+
+def _chunks(data, chunkSize):
+    """
+    Iterate over the data by chunks of at most chunkSize time steps.
+    """
+    if isinstance(data, str):
+        data = (xr.open_dataset(file) for file in partitionFiles(data))
+    elif isinstance(data, xr.Dataset):
+        data = [data]
+    for dataset in data:
+        for start in range(0, dataset.sizes["time"], chunkSize):
+            yield dataset.isel(time = slice(start, start + chunkSize)).load()
+
+def _design(chunk, features, target):
+    """
+    Get the (lead_time, sample, feature) design matrix and (lead_time, sample) target of a chunk, samples being
+    (time, station) pairs. Missing values are NaN.
+    """
+    if "lead_time" not in chunk.dims:
+        chunk = chunk.expand_dims(lead_time = [0])
+    variables = xr.broadcast(*[chunk[name] for name in list(features) + [target]], chunk["lead_time"])[:-1]
+    arrays = [variable.transpose("lead_time", "time", "station").values.reshape(chunk.sizes["lead_time"], -1) for variable in variables]
+    return np.stack(arrays[:-1], axis = -1).astype(float), arrays[-1].astype(float), chunk.lead_time.values, chunk.station.values
+
+def _emptyStatistics(X, y, features, target, leadTimes, clusters, folds = 1):
+    """
+    Initialise the sufficient statistics, shifting the variables by their mean over the first chunk.
+    """
+    with np.errstate(invalid = "ignore"):
+        shift_x = np.nan_to_num(np.nanmean(X, axis = 1, keepdims = True))
+        shift_y = np.nan_to_num(np.nanmean(y, axis = 1, keepdims = True))
+    labels = np.array([0]) if clusters is None else np.unique(clusters.values)
+    F, L, C, p = folds, len(leadTimes), len(labels), len(features)
+    return {"n": np.zeros((F, L, C)), "sx": np.zeros((F, L, C, p)), "sy": np.zeros((F, L, C)),
+            "xx": np.zeros((F, L, C, p, p)), "xy": np.zeros((F, L, C, p)), "yy": np.zeros((F, L, C)),
+            "shift_x": shift_x, "shift_y": shift_y, "features": list(features), "target": target,
+            "lead_time": leadTimes, "cluster": labels, "clusters": clusters}
+
+def _clusterIndex(stats, stations):
+    """
+    Get the index of the cluster of each station in the statistics (-1 if it has none).
+    """
+    if stats["clusters"] is None:
+        return np.zeros(len(stations), dtype = int)
+    labels = stats["clusters"].reindex(station = stations).values
+    index = np.searchsorted(stats["cluster"], labels)
+    known = (index < len(stats["cluster"])) & (stats["cluster"][np.minimum(index, len(stats["cluster"]) - 1)] == labels)
+    return np.where(known, index, -1)
+
+def _foldIndex(times, folds, block, gap):
+    """
+    Get the fold of each time step (-1 if it is within gap of the boundaries of its block).
+    """
+    if folds == 1 and gap is None:
+        return np.zeros(len(times), dtype = int)
+    periods = pd.DatetimeIndex(times).to_period(block)
+    fold = periods.asi8 % folds
+    if gap is not None:
+        times, gap = pd.DatetimeIndex(times), pd.Timedelta(gap)
+        fold = np.where((times - periods.start_time < gap) | (periods.end_time - times < gap), -1, fold)
+    return fold
+
+def _accumulate(stats, X, y, group):
+    """
+    Add the (lead_time, sample, feature) features and (lead_time, sample) target of a chunk to the sums of their
+    (fold, cluster) groups, numbered fold*clusters + cluster. Samples with a missing value, or a negative group,
+    are skipped.
+    """
+    C = len(stats["cluster"])
+    valid = np.isfinite(X).all(axis = -1) & np.isfinite(y) & (group >= 0)
+    X = np.where(valid[..., None], X, 0.)
+    y = np.where(valid, y, 0.)
+    for g in np.unique(group[group >= 0]):
+        members = group == g
+        Xg, yg = X[:, members], y[:, members]
+        stats["n"][g//C, :, g%C] += valid[:, members].sum(axis = 1)
+        stats["sx"][g//C, :, g%C] += Xg.sum(axis = 1)
+        stats["sy"][g//C, :, g%C] += yg.sum(axis = 1)
+        stats["xx"][g//C, :, g%C] += np.matmul(Xg.transpose(0, 2, 1), Xg)
+        stats["xy"][g//C, :, g%C] += np.matmul(Xg.transpose(0, 2, 1), yg[..., None])[..., 0]
+        stats["yy"][g//C, :, g%C] += (yg**2).sum(axis = 1)
+
+# Sums of the sufficient statistics
+_SUMS = ("n", "sx", "sy", "xx", "xy", "yy")
+
+def _pooled(stats, exclude = None):
+    """
+    Sum the sufficient statistics over the folds, except the fold exclude.
+    """
+    keep = np.arange(stats["n"].shape[0]) != exclude
+    return {name: stats[name][keep].sum(axis = 0) for name in _SUMS}
+
+def _centered(sums):
+    """
+    Get the number of samples, the means and the (co)variances of each group from pooled sufficient statistics.
+    """
+    n = sums["n"]
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        mx, my = sums["sx"]/n[..., None], sums["sy"]/n
+        cxx = sums["xx"]/n[..., None, None] - mx[..., :, None]*mx[..., None, :]
+        cxy = sums["xy"]/n[..., None] - mx*my[..., None]
+        cyy = sums["yy"]/n - my**2
+    return n, mx, my, cxx, cxy, cyy
+
+def _standardised(cxx, cxy):
+    """
+    Get the standard deviations of the features, their correlation matrix and their correlation with the target
+    (up to the standard deviation of the target).
+    """
+    scale = np.sqrt(np.clip(np.diagonal(cxx, axis1 = -2, axis2 = -1), 0, None))
+    scale = np.where(scale > 0, scale, 1.)
+    return scale, cxx/(scale[..., :, None]*scale[..., None, :]), cxy/scale
+
+def _choleskySolve(A, b):
+    """
+    Solve the symmetric positive definite systems A x = b of all the groups at once, NaN for the groups where
+    A is not positive definite.
+    """
+    good = np.isfinite(A).all(axis = (-2, -1)) & np.isfinite(b).all(axis = -1)
+    A = np.where(good[..., None, None], A, np.eye(A.shape[-1]))
+    b = np.where(good[..., None], b, 0.)
+    try:
+        L = np.linalg.cholesky(A)
+    except np.linalg.LinAlgError:
+        # Finding the groups which are not positive definite, with their smallest eigenvalue
+        good &= np.linalg.eigvalsh(A)[..., 0] > 1e-12*np.abs(A).max(axis = (-2, -1))
+        A = np.where(good[..., None, None], A, np.eye(A.shape[-1]))
+        L = np.linalg.cholesky(A)
+    z = np.linalg.solve(L, b[..., None])
+    x = np.linalg.solve(np.swapaxes(L, -2, -1), z)[..., 0]
+    return np.where(good[..., None], x, np.nan)
+
+def _model(stats, beta, n, mx, my):
+    """
+    Build the model Dataset from the coefficients of the (shifted) features of each group.
+    """
+    intercept = stats["shift_y"][:, :1] + my - (beta*mx).sum(axis = -1) - (beta*stats["shift_x"][:, :1]).sum(axis = -1)
+    model = xr.Dataset(
+        data_vars = {"coefficient": (["lead_time", "cluster", "feature"], beta),
+                     "intercept": (["lead_time", "cluster"], intercept),
+                     "n": (["lead_time", "cluster"], n)},
+        coords = {"lead_time": stats["lead_time"], "cluster": stats["cluster"], "feature": stats["features"]}
+    )
+    if stats["clusters"] is not None:
+        model["station_cluster"] = stats["clusters"].rename("station_cluster")
+    model.attrs["target"] = stats["target"]
+    return model
@@ -7,12 +7,19 @@ import seaborn as sns
 from scipy.interpolate import RegularGridInterpolator
 import os
 import sys
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 import pwOutputs.PWtoolbox as pwtb
 import swissMetNet.SMNtoolbox as smntb
 import stormTracks.STtoolbox as sttb
+import dataRegistry.DRtoolbox as drtb
+import storageProfiles.SPtoolbox as sptb
+
+drtb.register("pw_smn_cache", "PW_SMN_cache")
 
 
 def loadData(**kwargs):
@@ -27,7 +34,7 @@ def loadData(**kwargs):
         Keyword arguments.
         These can include:
             fromFile: str
-                The file to load data from.
+                The file to load data from, or a directory of monthly partitions built by buildPartitions().
             dataVars : list
                 List of data variables to load.
             dirnameStations : str
@@ -35,17 +42,31 @@ def loadData(**kwargs):
             dirnamePW : str
                 The directory to load PW output data from.
             minyear : int
-                The minimum year to load data from.
+                The minimum year to load data from, by default 2016.
             maxyear : int
-                The maximum year to load data from.
+                The maximum year to load data from, by default 2024.
             minmonth : int
-                The minimum month to load data from.
+                The minimum month to load data from, by default 1.
             maxmonth : int
-                The maximum month to load data from.
+                The maximum month to load data from, by default 12 (3 in 2024), as in PWtoolbox.loadData().
             stormFile : str
                 The file to load storm data from.
             stormDateIDFile : str
-                The file to load storm date IDs from.
+                The directory of the date index of stormFile, as saved by STtoolbox.buildDateIndex().
+                If not provided, the index is built from the storms of the loaded period.
+            weightsFile : str
+                The file of the bilinear weights of the stations on the PW grid, as saved by stationWeights().
+                Computed (and saved, if provided) when missing or built for another grid or set of stations.
+            weightsKeyed : bool
+                Whether to keep one weights file per grid and set of stations, see stationWeights(), by default
+                False. buildPartitions() sets it, as the stations differ between months.
+            cache : bool
+                Whether to reuse (and store) the result in the cache, by default False. The cache key is computed
+                from the arguments and the fingerprints of the input files, so that a stale entry is never reused.
+            cacheDir : str
+                The directory of the cache, by default the "pw_smn_cache" dataset of the registry.
+            cacheSize : float
+                The maximal size of the cache in GB, the least recently used entries being evicted, by default 50.
         - coord : str
             The CRS of the storm data coordinates.
         - coords : tuple
@@ -57,9 +78,21 @@ def loadData(**kwargs):
         The interpolated data.
     """
     fromFile = kwargs.get("fromFile", None)
+    # The same range for the loaders, the storm filter and the cache key
+    kwargs.update(_dateRange(**kwargs))
+    if not fromFile and kwargs.get("cache", False):
+        cacheDir = kwargs.get("cacheDir", None) or drtb.getPath("pw_smn_cache")
+        key = cacheKey(**kwargs)
+        cached = _cacheLookup(cacheDir, key)
+        if cached is not None:
+            print(f"Loading data from cache {cached}", flush = True)
+            return xr.open_dataset(cached)
+        result = loadData(**{**kwargs, "cache": False})
+        _cacheStore(cacheDir, key, result, kwargs, kwargs.get("cacheSize", 50))
+        return result
     if fromFile:
         print(f"Loading data from {fromFile}", flush = True)
-        result = xr.open_dataset(fromFile)
+        result = openPartitions(fromFile) if os.path.isdir(fromFile) else xr.open_dataset(fromFile)
     else:
         dataVars = kwargs.get("dataVars", "all")
         dirnameStations = kwargs.get("dirnameStations")
@@ -75,19 +108,14 @@ def loadData(**kwargs):
         dsSMN = smntb.loadData(dataVarsStations, dirnameStations, **kwargs)
         
         print("Interpolating data", flush=True)
-        interpolation = [None]*len(dsPW.lead_time.values)
-        for i in range(len(dsPW.lead_time.values)):
-            interpolation[i] = dsPW.sel(time = dsSMN.time, lead_time = dsPW.lead_time.values[i]).interp(lon = dsSMN.longitude.where(dsSMN.station == dsSMN.station), lat = dsSMN.latitude.where(dsSMN.station == dsSMN.station))
-
-        print("Concatenating data")
-        interpolation = xr.concat(interpolation, dim = "lead_time")
+        weights = stationWeights(dsPW, dsSMN, weightsFile = kwargs.get("weightsFile", None), keyed = kwargs.get("weightsKeyed", False))
+        interpolation = applyWeights(dsPW.sel(time = dsSMN.time), weights)
         interpolation = xr.merge((interpolation, dsSMN))
         
         result = interpolation
     
     if kwargs.get("stormFile", None):
-        minyear, maxyear = kwargs.get("minyear", 2016), kwargs.get("maxyear", 2021)
-        minmonth, maxmonth = kwargs.get("minmonth", 1), kwargs.get("maxmonth", 12)
+        minyear, maxyear, minmonth, maxmonth = (kwargs[key] for key in ("minyear", "maxyear", "minmonth", "maxmonth"))
         mindate = pd.Timestamp(f"{minyear}-{minmonth}-01 00:00:00")
         maxdate = pd.Timestamp(f"{maxyear}-{maxmonth}-01 00:00:00") + pd.DateOffset(months=1) - pd.DateOffset(hours=1)
         
@@ -95,12 +123,13 @@ def loadData(**kwargs):
         storms = sttb.loadStorms(kwargs.get("stormFile"))
         storms["time"] = storms["time"].dt.tz_localize(None)
         
-        storms = sttb.filter(storms, maxdate = maxdate, mindate = mindate)
-
-        stormsDateID = sttb.loadStorms(kwargs.get("stormDateIDFile"))
-        stormsDateID.index = stormsDateID.index.tz_localize(None)
-        stormsDateID.sort_index(inplace=True)
-        stormsDateID = stormsDateID.loc[mindate:maxdate]
+        stormDateIDFile = kwargs.get("stormDateIDFile", None)
+        if stormDateIDFile and os.path.isdir(stormDateIDFile):
+            # A saved date index addresses the rows of the whole catalogue of stormFile
+            stormsDateID = sttb.loadDateIndex(stormDateIDFile)
+        else:
+            storms = sttb.filter(storms, maxdate = maxdate, mindate = mindate, agg = True)
+            stormsDateID = sttb.buildDateIndex(storms)
 
         times = result.time.values
         stations = result.station.values
@@ -132,6 +161,162 @@ def loadData(**kwargs):
     
     return result
 
+def _dateRange(**kwargs):
+    """
+    Resolve the minyear, maxyear, minmonth and maxmonth of loadData(), with the defaults of PWtoolbox.loadData()
+    and SMNtoolbox.loadData().
+    """
+    maxyear = kwargs.get("maxyear", 2024)
+    return {"minyear": kwargs.get("minyear", 2016), "maxyear": maxyear,
+            "minmonth": kwargs.get("minmonth", 1), "maxmonth": kwargs.get("maxmonth", 12 if maxyear != 2024 else 3)}
+
+def _months(**kwargs):
+    """
+    Get the months of the range of loadData().
+    """
+    dates = _dateRange(**kwargs)
+    return pd.period_range(f"{dates['minyear']}-{dates['minmonth']:02d}", f"{dates['maxyear']}-{dates['maxmonth']:02d}", freq = "M")
+
+def bilinearWeights(gridLon, gridLat, lon, lat):
+    """
+    Compute the bilinear interpolation weights of points on a regular grid.
+    
+    Parameters
+    ----------
+    gridLon : numpy.ndarray
+        The longitudes of the grid, monotonic.
+    gridLat : numpy.ndarray
+        The latitudes of the grid, monotonic (PW outputs are in decreasing order).
+    lon : numpy.ndarray
+        The longitudes of the points.
+    lat : numpy.ndarray
+        The latitudes of the points.
+    
+    Returns
+    -------
+    index : numpy.ndarray
+        The (point, 4) indices of the neighbours of each point in the flattened (lat, lon) grid.
+    weight : numpy.ndarray
+        The (point, 4) weights of the neighbours, NaN for the points outside of the grid.
+    """
+    ilon0, ilon1, wlon = _axisWeights(np.asarray(gridLon, dtype = float), np.asarray(lon, dtype = float))
+    ilat0, ilat1, wlat = _axisWeights(np.asarray(gridLat, dtype = float), np.asarray(lat, dtype = float))
+    nlon = len(gridLon)
+    index = np.stack([ilat0*nlon + ilon0, ilat0*nlon + ilon1, ilat1*nlon + ilon0, ilat1*nlon + ilon1], axis = -1)
+    weight = np.stack([(1 - wlat)*(1 - wlon), (1 - wlat)*wlon, wlat*(1 - wlon), wlat*wlon], axis = -1)
+    return index, weight
+
+def _axisWeights(coords, points):
+    """
+    Get the indices of the neighbours of points along a monotonic axis, and the weight of the second one.
+    """
+    n = len(coords)
+    ascending = coords[-1] >= coords[0]
+    ordered = coords if ascending else coords[::-1]
+    j = np.clip(np.searchsorted(ordered, points, side = "right") - 1, 0, n - 2)
+    w = (points - ordered[j])/(ordered[j + 1] - ordered[j])
+    w[~((points >= ordered[0]) & (points <= ordered[-1]))] = np.nan
+    if ascending:
+        return j, j + 1, w
+    return n - 1 - j, n - 2 - j, w
+
+def stationWeights(dsPW, dsSMN, **kwargs):
+    """
+    Get the bilinear weights of the SwissMetNet stations on the PW grid, computed once per grid and set of stations.
+    
+    Parameters
+    ----------
+    dsPW : xarray.Dataset
+        The PW outputs, with coordinates lon and lat.
+    dsSMN : xarray.Dataset
+        The station data, with coordinates station, longitude and latitude.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            weightsFile : str
+                The file to load the weights from, or to save them to if it does not exist or does not match
+                the grid and stations.
+            keyed : bool
+                Whether to add a key of the grid and stations to the name of weightsFile (<root>_<key>.nc), so that
+                several sets of stations, e.g. in concurrent processes, do not overwrite each other's weights.
+                By default False.
+    
+    Returns
+    -------
+    weights : xarray.Dataset
+        The indices of the 4 neighbours of each station in the flattened (lat, lon) grid and their weights,
+        with the grid and station coordinates they were computed for.
+    """
+    weightsFile = kwargs.get("weightsFile", None)
+    gridLon, gridLat = dsPW.lon.values, dsPW.lat.values
+    stations = dsSMN.station.values
+    lon, lat = dsSMN.longitude, dsSMN.latitude
+    lon = (lon.mean(dim = "time") if "time" in lon.dims else lon).values
+    lat = (lat.mean(dim = "time") if "time" in lat.dims else lat).values
+    if weightsFile and kwargs.get("keyed", False):
+        digest = hashlib.sha256()
+        for values in (gridLon, gridLat, lon, lat):
+            digest.update(np.ascontiguousarray(values, dtype = float).tobytes())
+        digest.update("\n".join(map(str, stations)).encode())
+        root, extension = os.path.splitext(weightsFile)
+        weightsFile = f"{root}_{digest.hexdigest()[:16]}{extension}"
+    
+    weights = None
+    if weightsFile and os.path.exists(weightsFile):
+        try:
+            weights = xr.load_dataset(weightsFile)
+        except (OSError, ValueError):
+            print(f"{weightsFile} cannot be read, recomputing it", flush = True)
+    if weights is not None:
+        if (np.array_equal(weights.grid_lon.values, gridLon) and np.array_equal(weights.grid_lat.values, gridLat)
+            and np.array_equal(weights.station.values, stations)
+            and np.array_equal(weights.longitude.values, lon, equal_nan = True) and np.array_equal(weights.latitude.values, lat, equal_nan = True)):
+            return weights
+        print(f"{weightsFile} was computed for another grid or set of stations, recomputing it", flush = True)
+    
+    index, weight = bilinearWeights(gridLon, gridLat, lon, lat)
+    weights = xr.Dataset(
+        data_vars = {"index": (["station", "corner"], index),
+                     "weight": (["station", "corner"], weight),
+                     "grid_lon": ("grid_lon", gridLon),
+                     "grid_lat": ("grid_lat", gridLat)},
+        coords = {"station": stations,
+                  "longitude": ("station", lon),
+                  "latitude": ("station", lat)}
+    )
+    if weightsFile:
+        tmp = os.path.join(os.path.dirname(weightsFile) or ".", f".{os.path.basename(weightsFile)}.{os.getpid()}.tmp")
+        weights.to_netcdf(tmp)
+        os.replace(tmp, weightsFile)
+    return weights
+
+def applyWeights(data, weights):
+    """
+    Interpolate gridded data over stations with precomputed bilinear weights, in one gather and weighted sum.
+    
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The gridded data, whose variables with dimensions lat and lon are interpolated.
+    weights : xarray.Dataset
+        The weights, as returned by stationWeights().
+    
+    Returns
+    -------
+    result : xarray.Dataset
+        The interpolated variables, with dimension station in place of lat and lon.
+    """
+    index, weight = weights["index"].values, weights["weight"].values
+    result = {}
+    for name, var in data.data_vars.items():
+        if "lat" not in var.dims or "lon" not in var.dims:
+            continue
+        var = var.transpose(..., "lat", "lon")
+        values = var.values.reshape(var.shape[:-2] + (-1,))
+        result[name] = (var.dims[:-2] + ("station",), (values[..., index]*weight).sum(axis = -1))
+    coords = {name: coord for name, coord in data.coords.items() if "lat" not in coord.dims and "lon" not in coord.dims and name not in ("lat", "lon")}
+    return xr.Dataset(result, coords = coords).assign_coords(station = weights.station.values)
+
 def saveData(data, toFile, **kwargs):
     """
     Save data to a file.
@@ -144,15 +329,328 @@ def saveData(data, toFile, **kwargs):
         Additional keyword arguments to be passed to the to_netcdf method.
         dirpath : str
             The directory to save the file to.
+        profile : str
+            The storage profile of SPtoolbox.PROFILES ("archive", "analysis" or "training"), by default none.
     """
     dirpath = kwargs.pop("dirpath", None)
     if dirpath is not None:
         if not os.path.exists(dirpath):
             os.makedirs(dirpath)
         toFile = os.path.join(dirpath, toFile.split("/")[-1])
-    data.to_netcdf(toFile, **kwargs)
+    sptb.save(data, toFile, **kwargs)
     return
 
+# Keyword arguments of loadData which do not change the content of a partition
+_NOT_FINGERPRINTED = ("fromFile", "dirnameStations", "dirnamePW", "stormFile", "stormDateIDFile", "weightsFile", "weightsKeyed",
+                      "minyear", "maxyear", "minmonth", "maxmonth", "cache", "cacheDir", "cacheSize")
+
+def buildPartitions(toDir, **kwargs):
+    """
+    Build the interpolated data of loadData() as one file per month, rebuilding only the stale months.
+    
+    A manifest (toDir/manifest.json) keeps the fingerprint of the inputs of each partition: the PW, SwissMetNet and
+    storm files it is built from, and the parameters of loadData(). A month is rebuilt only if its partition is
+    missing or its fingerprint changed. Stale months are built in parallel.
+    
+    Parameters
+    ----------
+    toDir : str
+        The directory of the partitions.
+    **kwargs : dict
+        The keyword arguments of loadData() (except fromFile), and:
+            workers : int
+                The number of processes, by default the number of CPUs.
+            content : bool
+                Whether to fingerprint the content of the input files instead of their size and modification
+                time, by default False.
+    
+    Returns
+    -------
+    list
+        The months (as "YYYY-MM") which were rebuilt.
+    """
+    workers = kwargs.pop("workers", None)
+    content = kwargs.pop("content", False)
+    kwargs.pop("fromFile", None)
+    # The months are built concurrently, with different sets of stations: one weights file per set
+    kwargs["weightsKeyed"] = True
+    os.makedirs(toDir, exist_ok = True)
+    manifest = _readManifest(toDir)
+    
+    months = _months(**kwargs)
+    
+    pwFiles = _pwFiles(months, **kwargs)
+    stale = {}
+    for month in months:
+        fingerprint = partitionFingerprint(month, content = content, pwFiles = pwFiles, **kwargs)
+        entry = manifest.get(str(month), {})
+        if entry.get("fingerprint") != fingerprint or not os.path.exists(os.path.join(toDir, entry.get("file", ""))):
+            stale[str(month)] = fingerprint
+    print(f"{len(stale)} of {len(months)} months to build", flush = True)
+    
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = {executor.submit(_buildPartition, toDir, month, **kwargs): month for month in stale}
+        for future in as_completed(futures):
+            month = futures[future]
+            manifest[month] = {"file": future.result(), "fingerprint": stale[month]}
+            _writeManifest(toDir, manifest)
+            print(f"Built {month}", flush = True)
+    
+    return sorted(stale)
+
+def partitionFingerprint(month, **kwargs):
+    """
+    Compute the fingerprint of the inputs of a monthly partition.
+    
+    Parameters
+    ----------
+    month : pandas.Period or str
+        The month of the partition.
+    **kwargs : dict
+        The keyword arguments of loadData(), and:
+            content : bool
+                Whether to hash the content of the input files instead of their size and modification time,
+                by default False.
+            pwFiles : list
+                The (file, date) pairs of dirnamePW covering the month, as listed by _pwFiles(), to avoid walking
+                dirnamePW again for each month of a range.
+    
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 fingerprint.
+    """
+    month = pd.Period(month, freq = "M")
+    content = kwargs.pop("content", False)
+    pwFiles = kwargs.pop("pwFiles", None)
+    start, end = month.start_time, month.end_time
+    leadTimes = kwargs.get("lead_times", [0, 72])
+    mindate, maxdate = start - pd.DateOffset(hours = max(leadTimes)), end - pd.DateOffset(hours = min(leadTimes))
+    
+    if pwFiles is None:
+        pwFiles = pwtb.filesForDates(kwargs.get("dirnamePW"), mindate, maxdate)
+    files = [file for file, date in pwFiles if mindate <= date <= maxdate]
+    dirnameStations = kwargs.get("dirnameStations")
+    files += [os.path.join(dirnameStations, file) for file in smntb.filesForDates(dirnameStations, start.floor("D"), start.floor("D"))]
+    files += [kwargs[name] for name in ("stormFile", "stormDateIDFile") if kwargs.get(name, None)]
+    
+    digest = hashlib.sha256()
+    digest.update(json.dumps({"month": str(month), **{key: value for key, value in kwargs.items() if key not in _NOT_FINGERPRINTED}},
+                             sort_keys = True, default = str).encode())
+    for file in files:
+        for path in _walkFiles(file):
+            digest.update(path.encode())
+            if content:
+                with open(path, "rb") as f:
+                    for block in iter(lambda: f.read(1 << 24), b""):
+                        digest.update(block)
+            else:
+                stat = os.stat(path)
+                digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+def _pwFiles(months, **kwargs):
+    """
+    List the PW files of a range of months with a single walk of dirnamePW, for partitionFingerprint().
+    """
+    leadTimes = kwargs.get("lead_times", [0, 72])
+    return pwtb.filesForDates(kwargs.get("dirnamePW"),
+                              months[0].start_time - pd.DateOffset(hours = max(leadTimes)),
+                              months[-1].end_time - pd.DateOffset(hours = min(leadTimes)))
+
+def openPartitions(fromDir, **kwargs):
+    """
+    Open the monthly partitions built by buildPartitions() as one dataset.
+    
+    Parameters
+    ----------
+    fromDir : str
+        The directory of the partitions.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            lazy : bool
+                Whether to open the partitions lazily with xarray.open_mfdataset (requires dask), by default False.
+    
+    Returns
+    -------
+    result : xarray.Dataset
+        The concatenation of the partitions along time.
+    """
+    manifest = _readManifest(fromDir)
+    files = [os.path.join(fromDir, manifest[month]["file"]) for month in sorted(manifest)]
+    if kwargs.get("lazy", False):
+        return xr.open_mfdataset(files, combine = "nested", concat_dim = "time")
+    return xr.concat([xr.open_dataset(file) for file in files], dim = "time")
+
+def _buildPartition(toDir, month, **kwargs):
+    """
+    Build the partition of a month, written atomically. Returns the name of the partition file.
+    """
+    month = pd.Period(month, freq = "M")
+    kwargs.update(minyear = month.year, maxyear = month.year, minmonth = month.month, maxmonth = month.month, cache = False)
+    data = loadData(**kwargs)
+    file = f"PW_SMN_{month.year}{month.month:02d}.nc"
+    tmp = os.path.join(toDir, f".{file}.{os.getpid()}.tmp")
+    data.to_netcdf(tmp)
+    os.replace(tmp, os.path.join(toDir, file))
+    return file
+
+def _readManifest(dirname):
+    path = os.path.join(dirname, "manifest.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _writeManifest(dirname, manifest):
+    tmp = os.path.join(dirname, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent = 1, sort_keys = True)
+    os.replace(tmp, os.path.join(dirname, "manifest.json"))
+
+def _walkFiles(path):
+    """
+    Get the files of a path, sorted: itself if it is a file, or all the files under it if it is a directory.
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return sorted(os.path.join(root, file) for root, _, files in os.walk(path) for file in files)
+
+def cacheKey(**kwargs):
+    """
+    Compute the cache key of loadData() arguments, from the fingerprints of the inputs of every month of the range.
+    
+    Parameters
+    ----------
+    **kwargs : dict
+        The keyword arguments of loadData(), and:
+            content : bool
+                As in partitionFingerprint().
+    
+    Returns
+    -------
+    str
+        The hexadecimal SHA-256 key.
+    """
+    months = _months(**kwargs)
+    pwFiles = _pwFiles(months, **kwargs)
+    digest = hashlib.sha256(b"loadData")
+    for month in months:
+        digest.update(partitionFingerprint(month, pwFiles = pwFiles, **kwargs).encode())
+    return digest.hexdigest()
+
+def cacheEntries(cacheDir = None):
+    """
+    List the entries of the cache of loadData(), from the most to the least recently used.
+    
+    Parameters
+    ----------
+    cacheDir : str
+        The directory of the cache, by default the "pw_smn_cache" dataset of the registry.
+    
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        The key, size (in bytes), last use and loadData() arguments of each entry.
+    """
+    cacheDir = cacheDir or drtb.getPath("pw_smn_cache")
+    entries = []
+    if os.path.isdir(cacheDir):
+        for file in os.listdir(cacheDir):
+            if not file.endswith(".nc"):
+                continue
+            key, stat = file[:-3], os.stat(os.path.join(cacheDir, file))
+            arguments = os.path.join(cacheDir, key + ".json")
+            if os.path.exists(arguments):
+                with open(arguments) as f:
+                    arguments = json.load(f)
+            else:
+                arguments = {}
+            entries.append({"key": key, "size": stat.st_size, "last_used": pd.Timestamp(stat.st_mtime_ns), "arguments": arguments})
+    entries = pd.DataFrame(entries, columns = ["key", "size", "last_used", "arguments"])
+    return entries.sort_values("last_used", ascending = False, ignore_index = True)
+
+def pruneCache(cacheDir = None, **kwargs):
+    """
+    Remove entries of the cache of loadData(), the least recently used first.
+    
+    Parameters
+    ----------
+    cacheDir : str
+        The directory of the cache, by default the "pw_smn_cache" dataset of the registry.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            maxSize : float
+                The size (in GB) to bring the cache under.
+            olderThan : str or pandas.Timedelta
+                Remove the entries not used for longer than olderThan.
+            keys : list
+                Remove these entries.
+            keep : list
+                Never remove these entries.
+    
+    Returns
+    -------
+    list
+        The keys of the removed entries.
+    """
+    cacheDir = cacheDir or drtb.getPath("pw_smn_cache")
+    entries = cacheEntries(cacheDir)
+    entries = entries[~entries["key"].isin(kwargs.get("keep", []))]
+    remove = entries["key"].isin(kwargs.get("keys", []))
+    if kwargs.get("olderThan", None) is not None:
+        remove |= entries["last_used"] < pd.Timestamp.now(tz = "UTC").tz_localize(None) - pd.Timedelta(kwargs["olderThan"])
+    if kwargs.get("maxSize", None) is not None:
+        total = cacheEntries(cacheDir)["size"].sum() - entries.loc[remove, "size"].sum()
+        # Removing the least recently used entries until the cache fits
+        for i in entries.index[::-1]:
+            if total <= kwargs["maxSize"]*1e9:
+                break
+            if not remove[i]:
+                remove[i] = True
+                total -= entries.loc[i, "size"]
+    removed = list(entries.loc[remove, "key"])
+    for key in removed:
+        for extension in (".nc", ".json"):
+            try:
+                os.remove(os.path.join(cacheDir, key + extension))
+            except FileNotFoundError:
+                pass
+    return removed
+
+def _cacheLookup(cacheDir, key):
+    """
+    Get the path of a cache entry, marking it as used, or None if there is none.
+    """
+    path = os.path.join(cacheDir, key + ".nc")
+    try:
+        os.utime(path)
+    except OSError:
+        return None
+    return path
+
+def _cacheStore(cacheDir, key, data, kwargs, cacheSize):
+    """
+    Store a cache entry atomically, then evict the least recently used entries beyond cacheSize GB.
+    """
+    tmp = os.path.join(cacheDir, f".{key}.{os.getpid()}.tmp")
+    try:
+        os.makedirs(cacheDir, exist_ok = True)
+        data.to_netcdf(tmp)
+        with open(os.path.join(cacheDir, key + ".json"), "w") as f:
+            json.dump({name: value for name, value in kwargs.items() if name not in ("cache", "cacheDir", "cacheSize")}, f, default = str)
+        os.replace(tmp, os.path.join(cacheDir, key + ".nc"))
+    except Exception as error:
+        # The cache is an optimisation: failing to store an entry must not fail loadData()
+        print(f"Could not store the data in the cache {cacheDir}: {error!r}", flush = True)
+        return
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    pruneCache(cacheDir, maxSize = cacheSize, keep = [key])
+
 def plotData(data, **kwargs):
     
     storms_only = kwargs.get("storms_only", False)
@@ -170,19 +668,118 @@ def InverseDistanceWeightedGust(distance, wind_gust, alpha, **kwargs):
         The distance to the nearest storm.
     wind_gust : xarray.DataArray
         The wind gust data.
-    alpha : float
-        The alpha parameter of weight.
+    alpha : float or list
+        The alpha parameter of weight, or a list of them (evaluated in a single pass, along a dimension "alpha").
     **kwargs : dict
         Additional keyword arguments.
         These can include:
             dim : str
                 The dimension to sum over.
+            chunks : dict
+                As in KernelWeightedGust().
     
     Returns
     -------
     result : xarray.DataArray
         The inverse distance weighted gust.
     """
+    return KernelWeightedGust(distance, wind_gust, kernel = "idw", params = alpha, **kwargs)
+
+# Logarithm of the weight of each kernel, as a function of the distance and of the kernel parameter
+_KERNELS = {
+    "idw": lambda distance, alpha: np.where(alpha == 0, 0., -alpha*np.log(distance)),
+    "gaussian": lambda distance, bandwidth: -0.5*(distance/bandwidth)**2,
+    "exponential": lambda distance, bandwidth: -distance/bandwidth,
+}
+
+def KernelWeightedGust(distance, wind_gust, **kwargs):
+    """
+    Calculate kernel weighted gusts for several kernel parameters in a single pass.
+    
+    The weights are normalised in log space, so that they neither overflow nor underflow. Pairs where the distance
+    or the gust is NaN are skipped. For the inverse distance kernel (alpha > 0), stations at a zero distance
+    take all the weight (the limit of the weighted mean), shared equally between them.
+    
+    Parameters
+    ----------
+    distance : xarray.DataArray
+        The distance to the nearest storm.
+    wind_gust : xarray.DataArray
+        The wind gust data, with the same dimensions as distance.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            kernel : str
+                The kernel, among "idw" (distance**-alpha), "gaussian" (exp(-(distance/bandwidth)**2/2)) and
+                "exponential" (exp(-distance/bandwidth)), by default "idw".
+            params : float or list
+                The parameter(s) of the kernel, alpha or bandwidth. A list adds a dimension named after the parameter.
+            dim : str
+                The dimension to sum over, by default "station".
+            chunks : dict
+                The size of the chunks ({dimension: size}) in which in-memory data is processed, to bound the
+                memory used by several parameters. Dask-backed data is processed lazily, chunk by chunk.
+    
+    Returns
+    -------
+    result : xarray.DataArray
+        The kernel weighted gust.
+    """
+    kernel = kwargs.get("kernel", "idw")
+    if kernel not in _KERNELS:
+        raise ValueError(f"Invalid kernel, kernel must be in {list(_KERNELS)}.")
+    params = kwargs.get("params", 1.)
     dim = kwargs.get("dim", "station")
-    result = (wind_gust/(distance**alpha)).sum(dim=dim)/(1/(distance**alpha)).sum(dim=dim)
-    return result
\ No newline at end of file
+    chunks = kwargs.get("chunks", None)
+    
+    scalar = np.ndim(params) == 0
+    params = np.atleast_1d(np.asarray(params, dtype = float))
+    paramDim = "alpha" if kernel == "idw" else "bandwidth"
+    distance, wind_gust = xr.broadcast(distance, wind_gust)
+    wind_gust = wind_gust.transpose(*distance.dims)
+    
+    if distance.chunks is not None or wind_gust.chunks is not None:
+        result = xr.apply_ufunc(_kernelAggregate, distance, wind_gust,
+                                kwargs = {"kernel": kernel, "params": params},
+                                input_core_dims = [[dim], [dim]], output_core_dims = [[paramDim]],
+                                dask = "parallelized", output_dtypes = [float], dask_gufunc_kwargs = {"output_sizes": {paramDim: len(params)}})
+    else:
+        dims = [d for d in distance.dims if d != dim]
+        chunkDim, chunkSize = next(iter((chunks or {dims[0] if dims else dim: None}).items()))
+        out = np.empty(tuple(distance.sizes[d] for d in dims) + (len(params),))
+        d, g = distance.transpose(*dims, dim).values, wind_gust.transpose(*dims, dim).values
+        if chunkDim in dims and chunkSize:
+            axis = dims.index(chunkDim)
+            for start in range(0, distance.sizes[chunkDim], chunkSize):
+                index = (slice(None),)*axis + (slice(start, start + chunkSize),)
+                out[index] = _kernelAggregate(d[index], g[index], kernel, params)
+        else:
+            out[...] = _kernelAggregate(d, g, kernel, params)
+        result = xr.DataArray(out, dims = dims + [paramDim], coords = {name: coord for name, coord in distance.coords.items() if dim not in coord.dims})
+    
+    result = result.assign_coords({paramDim: params})
+    return result.isel({paramDim: 0}, drop = True) if scalar else result
+
+def _kernelAggregate(distance, wind_gust, kernel, params):
+    """
+    Kernel weighted mean over the last axis of numpy arrays, for each parameter (added as the last axis).
+    """
+    valid = np.isfinite(distance) & np.isfinite(wind_gust)
+    distance = np.where(valid, distance, 1.)[..., None]
+    gust = np.where(valid, wind_gust, 0.)[..., None]
+    valid = valid[..., None]
+    
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        logWeight = _KERNELS[kernel](distance, params)
+    if kernel == "idw":
+        # Stations at a zero distance take all the weight (for alpha > 0)
+        zero = valid & (distance == 0) & (params > 0)
+        anyZero = zero.any(axis = -2, keepdims = True)
+        logWeight = np.where(anyZero, np.where(zero, 0., -np.inf), logWeight)
+    logWeight = np.where(valid, logWeight, -np.inf)
+    
+    maximum = logWeight.max(axis = -2, keepdims = True)
+    weight = np.exp(logWeight - np.where(np.isfinite(maximum), maximum, 0.))
+    total = weight.sum(axis = -2)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        return np.where(total > 0, (weight*gust).sum(axis = -2)/total, np.nan)
@@ -0,0 +1,137 @@
+import numpy as np
+import pyproj
+import threading
+from functools import lru_cache
+
+# Short names used throughout the repository for the Swiss and global CRS
+CRS_ALIASES = {
+    "WGS84": "EPSG:4326",
+    "LV03": "EPSG:21781",
+    "LV95": "EPSG:2056",
+}
+
+def crsKey(crs):
+    """
+    Normalise a CRS designation, so that aliases share the same cached objects.
+    
+    Parameters
+    ----------
+    crs : str or int or pyproj.CRS
+        The CRS, as an alias (WGS84, LV03, LV95), an authority string, an EPSG code or a pyproj.CRS.
+    
+    Returns
+    -------
+    str
+        The normalised CRS designation.
+    """
+    if isinstance(crs, pyproj.CRS):
+        return crs.srs
+    if isinstance(crs, (int, np.integer)):
+        return f"EPSG:{int(crs)}"
+    return CRS_ALIASES.get(crs, crs)
+
+@lru_cache(maxsize = None)
+def _getCRS(key):
+    return pyproj.CRS(key)
+
+def getCRS(crs):
+    """
+    Get the (cached) pyproj.CRS corresponding to crs.
+    
+    Parameters
+    ----------
+    crs : str or int or pyproj.CRS
+        The CRS to get.
+    
+    Returns
+    -------
+    pyproj.CRS
+        The corresponding CRS.
+    """
+    return _getCRS(crsKey(crs))
+
+def axisNames(crs):
+    """
+    Get the abbreviations of the axes of a CRS, in the order of the CRS definition.
+    
+    Parameters
+    ----------
+    crs : str or int or pyproj.CRS
+        The CRS.
+    
+    Returns
+    -------
+    tuple
+        The abbreviations of the axes.
+    """
+    return tuple(dim.abbrev for dim in getCRS(crs).axis_info)
+
+# Per-thread transformers, dropped with their thread. clearCache() bumps the generation to invalidate those of every thread.
+_TRANSFORMERS = threading.local()
+_GENERATION = 0
+
+def _getTransformer(from_key, to_key):
+    if getattr(_TRANSFORMERS, "generation", None) != _GENERATION:
+        _TRANSFORMERS.generation, _TRANSFORMERS.cache = _GENERATION, {}
+    if (from_key, to_key) not in _TRANSFORMERS.cache:
+        _TRANSFORMERS.cache[(from_key, to_key)] = pyproj.Transformer.from_crs(_getCRS(from_key), _getCRS(to_key), always_xy = True)
+    return _TRANSFORMERS.cache[(from_key, to_key)]
+
+def getTransformer(from_crs, to_crs):
+    """
+    Get the (cached) transformer between two CRS. Transformers are always_xy, i.e. they take and return (easting, northing)
+    or (longitude, latitude). As pyproj transformers are not thread-safe, one transformer is cached per thread.
+    
+    Parameters
+    ----------
+    from_crs : str or int or pyproj.CRS
+        The CRS of the input coordinates.
+    to_crs : str or int or pyproj.CRS
+        The CRS to convert the coordinates to.
+    
+    Returns
+    -------
+    pyproj.Transformer
+        The transformer from from_crs to to_crs.
+    """
+    return _getTransformer(crsKey(from_crs), crsKey(to_crs))
+
+def transform(x, y, from_crs, to_crs):
+    """
+    Transform arrays of coordinates from one CRS to another.
+    
+    Parameters
+    ----------
+    x : array_like
+        The easting (or longitude) of the points.
+    y : array_like
+        The northing (or latitude) of the points.
+    from_crs : str or int or pyproj.CRS
+        The CRS of the input coordinates.
+    to_crs : str or int or pyproj.CRS
+        The CRS to convert the coordinates to.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The transformed easting (or longitude), with the shape of x.
+    numpy.ndarray
+        The transformed northing (or latitude), with the shape of y.
+    """
+    x, y = np.asarray(x, dtype = float), np.asarray(y, dtype = float)
+    if crsKey(from_crs) == crsKey(to_crs):
+        return x.copy(), y.copy()
+    return getTransformer(from_crs, to_crs).transform(x, y)
+
+def clearCache():
+    """
+    Clear the cached CRS and transformers.
+    
+    Returns
+    -------
+    None
+    """
+    global _GENERATION
+    _getCRS.cache_clear()
+    _GENERATION += 1
+    return
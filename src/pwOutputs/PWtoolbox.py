@@ -3,8 +3,13 @@ import pandas as pd
 import geopandas as gpd
 import xarray as xr
 import os
+import sys
 from collections import defaultdict
 
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import storageProfiles.SPtoolbox as sptb
+
 
 # I need to think more about how to qualify the date : is it the date at which the forecast is made, or the forecasted date? What about the boundaries then?
 
@@ -132,10 +137,12 @@ def saveData(data, toFile, **kwargs):
         The file to save the data to.
     **kwargs : dict
         Additional keyword arguments to be passed to the to_netcdf method.
+        profile : str
+            The storage profile of SPtoolbox.PROFILES ("archive", "analysis" or "training"), by default none.
     
     Returns
     -------
     None
     """
-    data.to_netcdf(toFile, **kwargs)
+    sptb.save(data, toFile, **kwargs)
     return
\ No newline at end of file
@@ -6,24 +6,36 @@ import numpy as np
 import geopandas as gpd
 import xarray as xr
 from shapely.geometry import LineString, Point
+import os
+import sys
 
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
+import projections.PROJtoolbox as projtb
+import dataRegistry.DRtoolbox as drtb
+import json
+from functools import lru_cache
+from itertools import chain
+from scipy.spatial import cKDTree
 
+SERIES_CACHE_SIZE = 64 # Number of station series kept in memory by SLFtoolbox.storm_station_gust()
 
-def extract_station(filename = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/SLF_dataset/measurement-data.slf.ch/imis/stations.csv"):
+
+def extract_station(filename = None):
     """
     Extract the station data from the CSV file and return it as a GeoDataFrame object.
     
     Parameters
     ----------
     filename : str
-        The path to the CSV file.
+        The path to the CSV file, by default the "slf_stations_csv" dataset.
     
     Returns
     -------
     geopandas.geodataframe.GeoDataFrame
         The station data.
     """
+    filename = drtb.getPath("slf_stations_csv") if filename is None else filename
     
     df = pd.read_csv(filename)
     gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df["lon"], df["lat"]), crs="EPSG:4326")
@@ -31,46 +43,50 @@ def extract_station(filename = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_da
     
     return gdf
 
-def stations_to_pickle(gdf = extract_station(), path = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/treated_data/SLF_dataset/stations.pkl"):
+def stations_to_pickle(gdf = None, path = None):
     """
     Save an object to a pickle file.
     
     Parameters
     ----------
     obj : object
-        The object to save.
+        The object to save, by default the stations extracted by SLFtoolbox.extract_station().
     path : str
-        The path to the pickle file.
+        The path to the pickle file, by default the "slf_stations" dataset.
     """
+    gdf = extract_station() if gdf is None else gdf
+    path = drtb.getPath("slf_stations") if path is None else path
     
     with open(path, 'wb') as f:
         pickle.dump(gdf, f)
     
     return
 
-def get_stations(path = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/treated_data/SLF_dataset/stations.pkl"):
+def get_stations(path = None):
     """
-    Load the station data from a pickle file.
+    Load the station data from a pickle file. Without path, the stations are loaded once and kept in memory.
     
     Parameters
     ----------
     path : str
-        The path to the pickle file.
+        The path to the pickle file, by default the "slf_stations" dataset.
     
     Returns
     -------
     object
         The object saved in the pickle file.
     """
+    if path is None:
+        return drtb.get("slf_stations")
     
     with open(path, 'rb') as f:
         gdf = pickle.load(f)
     
     return gdf
 
-def station_nearby(pos, dist, stations = get_stations(), pos_coord = "EPSG:4326"):
+def station_nearby(pos, dist, stations = None, pos_coord = "EPSG:4326"):
     """
-    Find the stations within a certain radius of a pos (Point). The Earth is assumed to be a sphere, which results in a slight overestimation of the distance.
+    Find the stations within a certain radius of a pos (Point). Distances are computed in LV95.
     
     Parameters
     ----------
@@ -78,27 +94,383 @@ def station_nearby(pos, dist, stations = get_stations(), pos_coord = "EPSG:4326"
         The position around which to search for stations.
     dist : float
         The maximum distance to pos, in km.
-    stations : geopandas.geodataframe.GeoDataFrame
-        The station data, in WGS84 or LV95.
+    stations : geopandas.geodataframe.GeoDataFrame or dict
+        The station data, in WGS84 or LV95, or a station index as returned by SLFtoolbox.build_station_index().
+        By default, the index of the "slf_stations" dataset.
         
     Returns
     --------
     list
         The station_code of stations within the radius.
     """
-    if stations.crs == "EPSG:4326": #Projecting on LV95 to get accurate distances.
-        stations = stations.to_crs("EPSG:2056")
-    elif stations.crs != "EPSG:2056":
-        raise ValueError("The crs of the stations is not recognized.")
-    
-    if pos_coord == "EPSG:4326" or pos_coord == "EPSG:21781":
-        gdf = gpd.GeoDataFrame({"geometry": [pos]}, crs=pos_coord)
-        gdf = gdf.to_crs("EPSG:2056")
-        pos = gdf["geometry"].values[0]
-    else:
+    if pos_coord != "EPSG:4326" and pos_coord != "EPSG:21781":
         raise ValueError("The crs of the position is not recognized.")
-    res = stations[stations.distance(Point(pos)) < dist*1000]["station_code"].values
+    index = _station_index(stations)
+    offsets, matches = stations_within(index, pos.x, pos.y, dist, pos_coord)
+    res = index["station_code"][matches]
     return res
 
+def build_station_index(stations):
+    """
+    Build a spatial index of the stations: their LV95 coordinates in a KD-tree.
+    
+    Parameters
+    ----------
+    stations : geopandas.geodataframe.GeoDataFrame
+        The station data, in WGS84 or LV95.
+    
+    Returns
+    -------
+    dict
+        Dictionary with the KD-tree ("tree"), the station codes ("station_code") and the LV95 coordinates ("x", "y").
+    """
+    x, y = station_coordinates(stations)
+    return {"tree": cKDTree(np.column_stack((x, y))),
+            "station_code": np.asarray(stations["station_code"].values),
+            "x": x,
+            "y": y}
+
+def stations_within(index, x, y, dist, pos_coord = "EPSG:4326"):
+    """
+    Find the stations within a radius of many positions at once.
+    
+    Parameters
+    ----------
+    index : dict
+        Station index as returned by SLFtoolbox.build_station_index().
+    x : array_like
+        The easting (or longitude) of the positions.
+    y : array_like
+        The northing (or latitude) of the positions.
+    dist : float or array_like
+        The radius around each position, in km.
+    pos_coord : str
+        The CRS of the positions.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The CSR offsets: the stations within the radius of position i are matches[offsets[i]:offsets[i+1]].
+    numpy.ndarray
+        The (sorted, per position) indices of the matched stations in the index.
+    """
+    x, y = projtb.transform(np.atleast_1d(x), np.atleast_1d(y), pos_coord, "EPSG:2056")
+    radius = np.broadcast_to(np.asarray(dist, dtype = float)*1000, x.shape)
+    
+    neighbours = index["tree"].query_ball_point(np.column_stack((x, y)), r = radius, return_sorted = True)
+    lengths = np.fromiter(map(len, neighbours), dtype = np.int64, count = len(neighbours))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    matches = np.fromiter(chain.from_iterable(neighbours), dtype = np.int64, count = offsets[-1])
+    
+    return offsets, matches
+
+def build_station_store(csv_dir = None, store_dir = None, columns = None, time_col = "measure_date", overwrite = False):
+    """
+    Convert the station CSV files (one per station) into a time-indexed columnar store, read once.
+    
+    Each station is stored as a directory of .npy files, one per numeric column, sorted by time, with the times
+    (UTC, datetime64[ns]) in "<time_col>.npy". The file "schema.json" at the root of the store records, for every station,
+    its columns, number of rows and time range, so that the availability of a column is known without opening any file.
+    
+    Parameters
+    ----------
+    csv_dir : str
+        The directory containing the <station_code>.csv files, by default the "slf_by_station" dataset.
+    store_dir : str
+        The directory of the store, by default the "slf_store" dataset.
+    columns : list
+        The columns to store, by default all the numeric columns.
+    time_col : str
+        The column containing the time data.
+    overwrite : bool
+        If False, stations already in the store are not converted again.
+    
+    Returns
+    -------
+    dict
+        The schema of the store.
+    """
+    csv_dir = drtb.getPath("slf_by_station") if csv_dir is None else csv_dir
+    store_dir = drtb.getPath("slf_store") if store_dir is None else store_dir
+    os.makedirs(store_dir, exist_ok = True)
+    schema = read_store_schema(store_dir) if os.path.exists(os.path.join(store_dir, "schema.json")) else {"time_col": time_col, "stations": {}}
+    
+    for file in sorted(os.listdir(csv_dir)):
+        station_code = file[:-4]
+        if not file.endswith(".csv") or (station_code in schema["stations"] and not overwrite):
+            continue
+        
+        df = pd.read_csv(os.path.join(csv_dir, file), usecols = None if columns is None else lambda column: column in set(columns) | {time_col})
+        if time_col not in df.columns:
+            continue
+        times = pd.to_datetime(df[time_col], utc = True).dt.tz_convert(None)
+        order = np.argsort(times.values, kind = "stable")
+        
+        station_dir = os.path.join(store_dir, station_code)
+        os.makedirs(station_dir, exist_ok = True)
+        np.save(os.path.join(station_dir, time_col + ".npy"), times.values.astype("datetime64[ns]")[order])
+        
+        stored = []
+        for column in df.columns:
+            if column != time_col and pd.api.types.is_numeric_dtype(df[column]):
+                np.save(os.path.join(station_dir, column + ".npy"), df[column].values.astype(float)[order])
+                stored.append(column)
+        
+        schema["stations"][station_code] = {"columns": stored,
+                                            "rows": len(df),
+                                            "start": str(times.min()) if len(df) else None,
+                                            "end": str(times.max()) if len(df) else None}
+    
+    with open(os.path.join(store_dir, "schema.json"), "w") as f:
+        json.dump(schema, f, indent = 1)
+    
+    return schema
+
+def read_store_schema(store_dir = None):
+    """
+    Read the schema of a station store built by SLFtoolbox.build_station_store().
+    
+    Parameters
+    ----------
+    store_dir : str
+        The directory of the store, by default the "slf_store" dataset.
+    
+    Returns
+    -------
+    dict
+        The schema, with the time column ("time_col") and, for every station ("stations"), its columns, number of rows and time range.
+    """
+    store_dir = drtb.getPath("slf_store") if store_dir is None else store_dir
+    with open(os.path.join(store_dir, "schema.json"), "r") as f:
+        schema = json.load(f)
+    return schema
+
+def store_has_column(schema, station_code, column):
+    """
+    Check from the schema of a station store whether a station has a column.
+    
+    Parameters
+    ----------
+    schema : dict
+        The schema of the store, as returned by SLFtoolbox.read_store_schema().
+    station_code : str
+        The code of the station.
+    column : str
+        The column to check.
+    
+    Returns
+    -------
+    bool
+        Whether the column is available for the station.
+    """
+    return column in schema["stations"].get(station_code, {}).get("columns", [])
+
+def load_station_series(station_code, column, store_dir = None, start = None, end = None, time_col = "measure_date"):
+    """
+    Load a time slice of a column of a station from the store. Only the slice is read from disk.
+    
+    Parameters
+    ----------
+    station_code : str
+        The code of the station.
+    column : str
+        The column to load.
+    store_dir : str
+        The directory of the store, by default the "slf_store" dataset.
+    start : str or pandas.Timestamp
+        The (excluded) start of the slice, by default the beginning of the series.
+    end : str or pandas.Timestamp
+        The (included) end of the slice, by default the end of the series.
+    time_col : str
+        The column containing the time data.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The times (UTC, datetime64[ns]) of the slice.
+    numpy.ndarray
+        The values of the column over the slice.
+    """
+    store_dir = drtb.getPath("slf_store") if store_dir is None else store_dir
+    times = np.load(os.path.join(store_dir, station_code, time_col + ".npy"), mmap_mode = "r")
+    values = np.load(os.path.join(store_dir, station_code, column + ".npy"), mmap_mode = "r")
+    
+    first = 0 if start is None else np.searchsorted(times, _utc(start), side = "right")
+    last = len(times) if end is None else np.searchsorted(times, _utc(end), side = "right")
+    
+    return np.array(times[first:last]), np.array(values[first:last])
+
+def sample_station_series(station_code, column, samplesize, store_dir = None, rng = None, chunksize = 100000, dropna = True):
+    """
+    Draw a uniform random sample (without replacement) of the values of a column of a station, by reservoir sampling
+    over chunks of the memory-mapped column, so that the series is never loaded as a whole.
+    
+    Parameters
+    ----------
+    station_code : str
+        The code of the station.
+    column : str
+        The column to sample.
+    samplesize : int
+        The size of the sample. The sample is smaller if the series has fewer (non-NaN) values.
+    store_dir : str
+        The directory of the store, by default the "slf_store" dataset.
+    rng : numpy.random.Generator
+        The random generator, by default a new unseeded one.
+    chunksize : int
+        The number of values read at once.
+    dropna : bool
+        If True, NaN values are not sampled.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The sampled values.
+    """
+    store_dir = drtb.getPath("slf_store") if store_dir is None else store_dir
+    rng = np.random.default_rng() if rng is None else rng
+    values = np.load(os.path.join(store_dir, station_code, column + ".npy"), mmap_mode = "r")
+    
+    reservoir = np.empty(samplesize, dtype = float)
+    seen = 0
+    for first in range(0, len(values), chunksize):
+        chunk = np.array(values[first:first + chunksize])
+        if dropna:
+            chunk = chunk[~np.isnan(chunk)]
+        
+        # Filling the reservoir
+        nfill = max(min(samplesize - seen, len(chunk)), 0)
+        reservoir[seen:seen + nfill] = chunk[:nfill]
+        
+        # Replacing elements of the reservoir, item i (0-based) being kept with probability samplesize/(i+1)
+        rest = chunk[nfill:]
+        draws = rng.integers(0, seen + nfill + np.arange(len(rest)) + 1)
+        for position, value in zip(draws[draws < samplesize], rest[draws < samplesize]):
+            reservoir[position] = value
+        seen += len(chunk)
+    
+    return reservoir[:min(seen, samplesize)]
+
+def storm_station_gust(storm, stations = None, store_dir = None, window = pd.Timedelta(minutes = 30), column = "VW_30MIN_MAX", pos_coord = "EPSG:4326"):
+    """
+    Join the cells of (a) storm(s) with the wind gusts measured by the stations within their radius (the square root of
+    their area). All the cells are matched to the stations with one spatial query in LV95, the matches are grouped by
+    station, each station series is loaded once (through a bounded LRU cache) and the gust windows of all its cells
+    are extracted with searchsorted.
+    
+    Parameters
+    ----------
+    storm : pandas.core.frame.DataFrame
+        DataFrame containing the storm cells, with the columns "longitude", "latitude", "A" (km^2) and "time".
+    stations : geopandas.geodataframe.GeoDataFrame or dict
+        The station data, in WGS84 or LV95, or a station index as returned by SLFtoolbox.build_station_index().
+        By default, the index of the "slf_stations" dataset.
+    store_dir : str
+        The directory of the station store built by SLFtoolbox.build_station_store(), by default the "slf_store" dataset.
+    window : pandas.Timedelta
+        The measurements within (time, time + window] of a cell are extracted.
+    column : str
+        The column of the gust measurements.
+    pos_coord : str
+        The CRS of the cell coordinates.
+    
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        DataFrame with one row per extracted measurement, with the columns "cell" (index of the cell in storm),
+        "station_code", "measure_date" and "gust".
+    """
+    store_dir = drtb.getPath("slf_store") if store_dir is None else store_dir
+    schema = read_store_schema(store_dir)
+    index = _station_index(stations)
+    
+    # Matching every cell to the stations within its radius
+    offsets, matched = stations_within(index, storm["longitude"].values, storm["latitude"].values, np.sqrt(storm["A"].values), pos_coord)
+    cells = np.repeat(np.arange(len(storm)), np.diff(offsets))
+    
+    times = pd.to_datetime(storm["time"])
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert(None)
+    times = times.values.astype("datetime64[ns]")
+    
+    result = []
+    codes = index["station_code"]
+    order = np.argsort(matched, kind = "stable")
+    cells, matched = cells[order], matched[order]
+    bounds = np.flatnonzero(np.diff(matched, prepend = -1, append = len(codes)))
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        station_code = codes[matched[first]]
+        if not store_has_column(schema, station_code, column):
+            continue
+        series_times, series = _cached_series(store_dir, station_code, column, schema["time_col"])
+        
+        # Extracting the windows of all the cells of the station at once
+        station_cells = cells[first:last]
+        lo = np.searchsorted(series_times, times[station_cells], side = "right")
+        hi = np.searchsorted(series_times, times[station_cells] + window.to_timedelta64(), side = "right")
+        lengths = hi - lo
+        rows = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(lo, lengths)
+        
+        result.append(pd.DataFrame({"cell": storm.index.values[np.repeat(station_cells, lengths)],
+                                    "station_code": station_code,
+                                    "measure_date": series_times[rows],
+                                    "gust": series[rows]}))
+    
+    if len(result) == 0:
+        return pd.DataFrame({"cell": storm.index.values[:0], "station_code": np.array([], dtype = object),
+                             "measure_date": np.array([], dtype = "datetime64[ns]"), "gust": np.array([], dtype = float)})
+    return pd.concat(result, ignore_index = True)
+
+def station_coordinates(stations):
+    """
+    Get the LV95 coordinates of the stations.
+    
+    Parameters
+    ----------
+    stations : geopandas.geodataframe.GeoDataFrame
+        The station data, in WGS84 or LV95.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The LV95 easting of the stations, in m.
+    numpy.ndarray
+        The LV95 northing of the stations, in m.
+    """
+    if stations.crs != "EPSG:4326" and stations.crs != "EPSG:2056":
+        raise ValueError("The crs of the stations is not recognized.")
+    return projtb.transform(stations.geometry.x.values, stations.geometry.y.values, stations.crs.to_string(), "EPSG:2056")
+
+def _station_index(stations):
+    """
+    Get the station index of stations, by default the (memoized) index of the "slf_stations" dataset.
+    """
+    if stations is None:
+        return drtb.get("slf_station_index")
+    return stations if isinstance(stations, dict) else build_station_index(stations)
+
+@lru_cache(maxsize = SERIES_CACHE_SIZE)
+def _cached_series(store_dir, station_code, column, time_col):
+    """
+    Load a whole column of a station from the store, keeping the SERIES_CACHE_SIZE most recently used series in memory.
+    """
+    return load_station_series(station_code, column, store_dir, time_col = time_col)
+
+def _utc(date):
+    """
+    Convert a date to a naive UTC numpy.datetime64[ns].
+    """
+    date = pd.Timestamp(date)
+    if date.tzinfo is not None:
+        date = date.tz_convert(None)
+    return date.to_datetime64().astype("datetime64[ns]")
+
+
+drtb.register("slf_stations_csv", "SLF_dataset/measurement-data.slf.ch/imis/stations.csv", root = "raw")
+drtb.register("slf_by_station", "SLF_dataset/measurement-data.slf.ch/imis/data/by_station", root = "raw")
+drtb.register("slf_stations", "SLF_dataset/stations.pkl", loader = get_stations)
+drtb.register("slf_store", "SLF_dataset/by_station_store")
+drtb.register("slf_station_index", "SLF_dataset/stations.pkl", loader = lambda path: build_station_index(get_stations(path)))
+
 
 # %%
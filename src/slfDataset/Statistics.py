@@ -9,33 +9,41 @@ import seaborn as sns
 from shapely.geometry import LineString, Point
 import matplotlib.pyplot as plt
 
+import os
+import io
 import sys
-sys.path.append("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/repos/src/Storm_tracks")
-sys.path.append("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/repos/src/SLF_dataset")
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "stormTracks"))
+sys.path.append(os.path.dirname(__file__))
 
 import SLFtoolbox as slftb
 import STtoolbox as sttb
+import dataRegistry.DRtoolbox as drtb
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 sns.set_theme()
 
+drtb.register("slf_plots", "SLF_dataset", root = "plots")
+
 def test():
     print("Hello world!")
 
-def get_wind_gust(stations = slftb.get_stations(),
+def get_wind_gust(stations = None,
                    sampling = True,
                    samplesize = 100,
                    plotter = False,
                    save = False,
-                   filename = "wind_gust_distribution.png"):
+                   filename = "wind_gust_distribution.png",
+                   store_dir = None,
+                   seed = None):
     """
     Plot the distribution of wind gust.
     
     Parameters
     ----------
     gdf : geopandas.geodataframe.GeoDataFrame
-        The station data.
+        The station data, by default the "slf_stations" dataset.
     sampling : bool
-        If True, take a random sample of 100 (by default) data points for each station.
+        If True, take a random sample (without replacement) of 100 (by default) non-NaN data points for each station.
     samplesize : int
         The number of data points to sample for each station.
     plotter : bool
@@ -44,24 +52,28 @@ def get_wind_gust(stations = slftb.get_stations(),
         If True, save the plot.
     filename : str
         The name of the file to save the plot.
+    store_dir : str
+        The directory of the station store built by SLFtoolbox.build_station_store().
+    seed : int
+        The seed of the sampling.
     Returns
     -------
     numpy.ndarray
         Array containing the wind gust data.
     """
-    data = np.array([], dtype = float)
+    stations = slftb.get_stations() if stations is None else stations
+    schema = slftb.read_store_schema(store_dir)
+    rng = np.random.default_rng(seed)
+    data = [np.array([], dtype = float)]
     
     for id in stations["station_code"]:
-        heads = pd.read_csv("/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/SLF_dataset/measurement-data.slf.ch/imis/data/by_station/"+ id + ".csv", nrows=0)
-        if "VW_30MIN_MAX" in heads.columns: # Check if the column exists
-            df = pd.read_csv("/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/SLF_dataset/measurement-data.slf.ch/imis/data/by_station/"+ id + ".csv",
-                             usecols=["VW_30MIN_MAX"])
+        if slftb.store_has_column(schema, id, "VW_30MIN_MAX"): # Check if the column exists
             if sampling:
-                indexes = np.random.randint(0,df.size,samplesize)
-                sample = df.loc[indexes,"VW_30MIN_MAX"].values
+                sample = slftb.sample_station_series(id, "VW_30MIN_MAX", samplesize, store_dir, rng = rng)
             else:
-                sample = df["VW_30MIN_MAX"].values
-            data = np.concatenate((data, sample[~np.isnan(sample)]))
+                sample = slftb.load_station_series(id, "VW_30MIN_MAX", store_dir)[1]
+            data.append(sample[~np.isnan(sample)])
+    data = np.concatenate(data)
     
     if plotter:
         sns.histplot(data, binwidth= 1., kde=True)
@@ -72,12 +84,12 @@ def get_wind_gust(stations = slftb.get_stations(),
         
         
         if save:
-            plt.savefig("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots/SLF_dataset/"+filename)
+            plt.savefig(os.path.join(drtb.getPath("slf_plots"), filename))
         plt.show()
         plt.close()    
     return data
 
-def get_storm_gust(storm, stations = slftb.get_stations()):
+def get_storm_gust(storm, stations = None, store_dir = None):
     """
     Plot the distribution of wind gust during a specific storm.
     
@@ -86,41 +98,34 @@ def get_storm_gust(storm, stations = slftb.get_stations()):
     storm : pandas.core.frame.DataFrame
         DataFrame containing the storm data.
     gdf : geopandas.geodataframe.GeoDataFrame
-        The station data.
+        The station data, by default the "slf_stations" dataset.
+    store_dir : str
+        The directory of the station store built by SLFtoolbox.build_station_store().
     
     Returns
     -------
     numpy.ndarray
         Array containing the wind gust data.
     """
-    data = np.array([], dtype = float)
-    for i in storm.index:
-        station_codes = slftb.station_nearby(Point(storm["longitude"][i], storm["latitude"][i]), np.sqrt(storm["A"][i]), stations)
-        for station_code in station_codes:
-            heads = pd.read_csv("/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/SLF_dataset/measurement-data.slf.ch/imis/data/by_station/"+ station_code + ".csv", nrows=0)
-            if "VW_30MIN_MAX" in heads.columns and "measure_date" in heads.columns:
-                df = pd.read_csv("/work/FAC/FGSE/IDYST/tbeucler/downscaling/raw_data/SLF_dataset/measurement-data.slf.ch/imis/data/by_station/"+ station_code + ".csv",
-                                 usecols=["measure_date", "VW_30MIN_MAX"], parse_dates=["measure_date"])
-                gust = df.loc[(df["measure_date"] > storm["time"][i]) & (df["measure_date"] <= storm["time"][i] + pd.Timedelta(minutes=30)), "VW_30MIN_MAX"].values
-                data = np.concatenate((data, gust))
-    return data
+    return slftb.storm_station_gust(storm, stations, store_dir)["gust"].values
 
-def get_storms_gust(storms = sttb.get_storms(),
-                     stations = slftb.get_stations(),
+def get_storms_gust(storms = None,
+                     stations = None,
                      plotter = False,
                      save = False,
                      filename = "storms_gust_distribution.png",
                      breakafter = 50,
-                     stormtype = ""):
+                     stormtype = "",
+                     store_dir = None):
     """
     Plot the distribution of wind gust during severe storms.
     
     Parameters
     ----------
     storms : pandas.core.groupby.DataFrameGroupBy
-        DataFrameGroupBy object containing storm data.
+        DataFrameGroupBy object containing storm data, by default the "storms" dataset.
     stations : geopandas.geodataframe.GeoDataFrame
-        The station data.
+        The station data, by default the "slf_stations" dataset.
     save : bool
         If True, save the plot.
     filename : str
@@ -129,12 +134,17 @@ def get_storms_gust(storms = sttb.get_storms(),
         The number of wind gust values to collect before stopping.
     stormtype : str
         The type of storm to plot. If empty, all storms will be plotted.
+    store_dir : str
+        The directory of the station store built by SLFtoolbox.build_station_store().
     
     Returns
     -------
     data : numpy.ndarray
         Array containing the wind gust data.
     """
+    storms = sttb.getStorms() if storms is None else storms
+    stations = slftb.get_stations() if stations is None else stations
+    
     st_type = (stormtype == "RS")*"w_rainstorm" + (stormtype == "SRS")*"s_rainstorm" + (stormtype == "HS")*"w_hailstorm" + (stormtype == "SHS")*"s_hailstorm" + (stormtype == "SC")*"supercell"
 
     
@@ -151,7 +161,7 @@ def get_storms_gust(storms = sttb.get_storms(),
         elif stormtype != "" and stormtype != "OR" and storm[st_type].values[0] != 1: # Check if the storm is of the right type
             continue
         print("\rProcessing storm " + name + ". " + str(i) + " storms processed out of " + str(tot) + ". Data contains " + str(len(data)) + " values.", end="")
-        data = np.concatenate((data, get_storm_gust(storm, stations)))
+        data = np.concatenate((data, get_storm_gust(storm, stations, store_dir)))
         names.pop(indice)
         i += 1
     
@@ -166,23 +176,179 @@ def get_storms_gust(storms = sttb.get_storms(),
         plt.title("Distribution of wind gust during " + stormtype + " storms")
 
         if save:
-            plt.savefig("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots/SLF_dataset/"+filename)
+            plt.savefig(os.path.join(drtb.getPath("slf_plots"), filename))
         plt.show()
         plt.close()
     return data
 
 
+def storms_gust_pipeline(resultDir,
+                         storms = None,
+                         stations = None,
+                         store_dir = None,
+                         stormtypes = ("OR", "RS", "SRS", "HS", "SHS", "SC"),
+                         workers = None,
+                         seed = 0,
+                         maxstorms = None):
+    """
+    Extract the wind gusts of all the storms of the catalogue, by storm type, in parallel and with checkpoints.
+    
+    The storms are partitioned by type (from their first cell, as in get_storms_gust), shuffled with a seeded generator
+    and processed by a pool of processes. The gusts of each storm are appended, as soon as they are available, to an
+    append-only result per type: "<type>.bin" (float32 values) and "<type>.csv" (ID, offset and count of the values of
+    each storm). Storms already in the result are skipped, so that an interrupted run resumes where it stopped.
+    
+    Parameters
+    ----------
+    resultDir : str
+        The directory of the result.
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame
+        The storm data, by default the "storms" dataset.
+    stations : geopandas.geodataframe.GeoDataFrame or dict
+        The station data or a station index, by default the index of the "slf_stations" dataset.
+    store_dir : str
+        The directory of the station store built by SLFtoolbox.build_station_store().
+    stormtypes : tuple
+        The storm types to process.
+    workers : int
+        The number of processes, by default the number of CPUs.
+    seed : int
+        The seed of the order in which the storms are processed.
+    maxstorms : int
+        The maximum number of storms to process per type, by default all.
+    
+    Returns
+    -------
+    dict
+        The number of storms processed in this run, by type.
+    """
+    os.makedirs(resultDir, exist_ok = True)
+    storms = sttb.getStorms() if storms is None else storms
+    if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
+        storms = storms.obj
+    stations = slftb._station_index(stations)
+    
+    # Partitioning the catalogue by storm type, from the first cell of each storm
+    flags = storms.groupby("ID")[list(sttb.STORM_TYPES.values())].first() == 1
+    members = {stormtype: flags.index[~flags.any(axis = 1)] if stormtype == "OR" else flags.index[flags[sttb.STORM_TYPES[stormtype]]]
+               for stormtype in stormtypes}
+    
+    rng = np.random.default_rng(seed)
+    todo = {}
+    for stormtype in stormtypes:
+        done = _checkpoint(resultDir, stormtype)
+        IDs = rng.permutation(np.sort(members[stormtype].values))[:maxstorms]
+        for ID in IDs[~np.isin(IDs.astype(str), done)]:
+            todo.setdefault(ID, []).append(stormtype)
+    
+    processed = dict.fromkeys(stormtypes, 0)
+    cells = storms.groupby("ID")
+    with ProcessPoolExecutor(max_workers = workers, initializer = _gust_worker_init, initargs = (stations, store_dir)) as executor:
+        futures = {executor.submit(_gust_worker, cells.get_group(ID)): ID for ID in todo}
+        for future in as_completed(futures):
+            ID = futures[future]
+            gust = future.result()
+            for stormtype in todo[ID]:
+                _append(resultDir, stormtype, ID, gust)
+                processed[stormtype] += 1
+            print(f"{sum(processed.values())} storm gusts written.", flush = True)
+    
+    return processed
+
+def load_storms_gust(resultDir, stormtype):
+    """
+    Load the wind gusts of a storm type written by storms_gust_pipeline.
+    
+    Parameters
+    ----------
+    resultDir : str
+        The directory of the result.
+    stormtype : str
+        The storm type.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The wind gusts of all the processed storms of the type.
+    pandas.core.frame.DataFrame
+        The ID, offset and count of the values of each storm.
+    """
+    _checkpoint(resultDir, stormtype)
+    index = pd.read_csv(os.path.join(resultDir, stormtype + ".csv"), dtype = {"ID": str})
+    values = np.fromfile(os.path.join(resultDir, stormtype + ".bin"), dtype = "<f4")
+    return values, index
+
+def _checkpoint(resultDir, stormtype):
+    """
+    Get the IDs of the storms already in the result of a storm type, discarding values written after the last
+    complete storm (if the run was interrupted between writing the values of a storm and its index) and index lines
+    cut mid-write.
+    """
+    index_file, values_file = os.path.join(resultDir, stormtype + ".csv"), os.path.join(resultDir, stormtype + ".bin")
+    if not os.path.exists(index_file):
+        with open(index_file, "w") as f:
+            f.write("ID,offset,count\n")
+        open(values_file, "wb").close()
+    
+    with open(index_file) as f:
+        text = f.read()
+    complete = text if text.endswith("\n") else text[:text.rfind("\n") + 1]
+    index = pd.read_csv(io.StringIO(complete), dtype = {"ID": str})
+    # Keeping the storms up to the first incomplete or inconsistent line
+    ends = index["offset"] + index["count"]
+    valid = index[["offset", "count"]].notna().all(axis = 1) & (index["offset"] == ends.shift(fill_value = 0))
+    if not valid.all() or complete != text:
+        index = index.iloc[:int(valid.cummin().sum())]
+        tmp = index_file + ".tmp"
+        index.astype({"offset": int, "count": int}).to_csv(tmp, index = False)
+        os.replace(tmp, index_file)
+    with open(values_file, "ab") as f:
+        f.truncate(4*int(index["count"].sum()))
+    return index["ID"].astype(str).values
+
+def _append(resultDir, stormtype, ID, gust):
+    """
+    Append the wind gusts of a storm to the result of a storm type: values first, then the index line.
+    """
+    values_file = os.path.join(resultDir, stormtype + ".bin")
+    offset = os.path.getsize(values_file)//4
+    with open(values_file, "ab") as f:
+        f.write(np.asarray(gust, dtype = "<f4").tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    with open(os.path.join(resultDir, stormtype + ".csv"), "a") as f:
+        f.write(f"{ID},{offset},{len(gust)}\n")
+    return
+
+_WORKER = {}
+
+def _gust_worker_init(stations, store_dir):
+    """
+    Keep the station index and store of a worker process of storms_gust_pipeline.
+    """
+    _WORKER["stations"], _WORKER["store_dir"] = stations, store_dir
+
+def _gust_worker(storm):
+    """
+    Extract the wind gusts of a storm in a worker process of storms_gust_pipeline.
+    """
+    return get_storm_gust(storm, _WORKER["stations"], _WORKER["store_dir"])
+
+
 def plotter(save = False,
             filename = "all_storms_gust_distribution.png",
             breakafter = 100,
             savedata = False,
-            dataname = "data_gust.pkl"):
+            dataname = "data_gust.pkl",
+            resultDir = None):
     """
     Plot the distributions of wind gust during severe storms.
     
     Parameters
     ----------
-    None
+    resultDir : str
+        If provided, the gusts of every storm are extracted with storms_gust_pipeline (resuming from resultDir)
+        instead of sampling breakafter values per storm type.
     
     Returns
     -------
@@ -192,11 +358,16 @@ def plotter(save = False,
     types = ["WS","OR", "RS", "SRS", "HS", "SHS", "SC"]
     print("Processing general wind gusts...")
     data = {"WS": get_wind_gust(samplesize = breakafter)}
+    if resultDir is not None:
+        storms_gust_pipeline(resultDir, stormtypes = types[1:])
     for stormtype in types:
         if stormtype == "WS":
             continue
         print("Processing " + stormtype + " storms...")
-        data[stormtype] = get_storms_gust(stormtype = stormtype, breakafter = breakafter)
+        if resultDir is not None:
+            data[stormtype] = load_storms_gust(resultDir, stormtype)[0]
+        else:
+            data[stormtype] = get_storms_gust(stormtype = stormtype, breakafter = breakafter)
     fig, axes = plt.subplots(nrows = 7, ncols = 1, figsize = (21, 29.7), sharex='all')
     plt.tight_layout()
     
@@ -211,8 +382,8 @@ def plotter(save = False,
             axes[i].set_title("Distribution of wind gust during " + types[i] + " storms")
     
     if save:   
-        plt.savefig("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots/SLF_dataset/" + filename)
-        with open("/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots/SLF_dataset/data_gust.pkl","wb") as handle:
+        plt.savefig(os.path.join(drtb.getPath("slf_plots"), filename))
+        with open(os.path.join(drtb.getPath("slf_plots"), dataname),"wb") as handle:
             pickle.dump(data, handle)
     plt.show()
     plt.close()
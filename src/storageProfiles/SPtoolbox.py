@@ -0,0 +1,96 @@
+import numpy as np
+import xarray as xr
+
+# Storage profiles of the netCDF outputs:
+# - dtype : the dtype of the floating point variables (None to keep it)
+# - chunks : the chunk size along each dimension (None, or a missing dimension, for the whole dimension)
+# - zlib, complevel, shuffle : the compression of the variables
+PROFILES = {
+    # Long-term storage, read sequentially: large time chunks, strongest compression
+    "archive": {"dtype": "float32", "chunks": {"time": 744},
+                "zlib": True, "complevel": 9, "shuffle": True},
+    # Statistics per station and lead time: one chunk holds a long time series
+    "analysis": {"dtype": "float32", "chunks": {"time": 8784, "lead_time": 1, "station": 1},
+                 "zlib": True, "complevel": 4, "shuffle": True},
+    # Mini-batches over time: one chunk holds a few days of every station and lead time, without compression
+    "training": {"dtype": "float32", "chunks": {"time": 168},
+                 "zlib": False, "complevel": 0, "shuffle": False},
+}
+
+def encode(data, profile):
+    """
+    Prepare a dataset to be written with a storage profile.
+
+    Floating point variables are downcast, chunked and compressed as set by the profile. Object variables (e.g. the
+    storm IDs of linReg.Statistics.loadData()) are converted to fixed-width strings, stored as character arrays,
+    which are much faster to encode than variable-length strings.
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The data.
+    profile : str or dict
+        The name of a profile of PROFILES, or a profile.
+
+    Returns
+    -------
+    data : xarray.Dataset
+        The data, with the object variables converted.
+    encoding : dict
+        The encoding of each variable, to be passed to to_netcdf.
+    """
+    profile = PROFILES[profile] if isinstance(profile, str) else profile
+    data = data.copy()
+    encoding = {}
+    for name, variable in data.variables.items():
+        if variable.dtype == object:
+            values = np.asarray(variable.values)
+            data[name] = variable.copy(data = np.where(values == None, "", values).astype(str))
+            encoding[name] = {"dtype": "S1"}
+        elif name in data.data_vars:
+            encoding[name] = {}
+            if np.issubdtype(variable.dtype, np.floating) and profile["dtype"] is not None:
+                encoding[name]["dtype"] = profile["dtype"]
+            if variable.ndim > 0:
+                encoding[name]["chunksizes"] = tuple(_chunkSize(profile["chunks"], dim, size) for dim, size in variable.sizes.items())
+        else:
+            continue
+        if variable.ndim > 0 and profile["zlib"]:
+            encoding[name].update(zlib = True, complevel = profile["complevel"], shuffle = profile["shuffle"])
+    return data, encoding
+
+def save(data, toFile, profile = None, **kwargs):
+    """
+    Write a dataset to netCDF with a storage profile.
+
+    Parameters
+    ----------
+    data : xarray.Dataset
+        The data to save.
+    toFile : str
+        The file to save the data to.
+    profile : str or dict
+        The storage profile. If None, the data is written with the defaults of to_netcdf.
+    **kwargs : dict
+        Additional keyword arguments to be passed to the to_netcdf method. An encoding argument overrides the
+        encoding of the profile, per variable.
+
+    Returns
+    -------
+    None
+    """
+    if profile is not None:
+        data, encoding = encode(data, profile)
+        for name, override in kwargs.pop("encoding", {}).items():
+            encoding.setdefault(name, {}).update(override)
+        kwargs["encoding"] = encoding
+    data.to_netcdf(toFile, **kwargs)
+    return
+
+def _chunkSize(chunks, dim, size):
+    """
+    Get the chunk size of a dimension in a profile, within the size of the dimension.
+    """
+    if chunks.get(dim, None) is None:
+        return size
+    return max(1, min(chunks[dim], size))
@@ -6,10 +6,23 @@ import pickle
 import pyproj
 from shapely.geometry import Point, LineString
 from collections import defaultdict
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import projections.PROJtoolbox as projtb
+import dataRegistry.DRtoolbox as drtb
+
+_HOUR = 3600*10**9 # One hour in nanoseconds
+_DATE_INDEX_ARRAYS = ("keys", "offsets", "rows")
+
+# Storm types, with their flag column (OR storms have none of the flags)
+STORM_TYPES = {"RS": "w_rainstorm", "SRS": "s_rainstorm", "HS": "w_hailstorm", "SHS": "s_hailstorm", "SC": "supercell"}
 
 def changeCoord(df, from_crs = "EPSG:21781", to_crs = "EPSG:4326", **kwargs):
     """
-    Change the coordinates of a DataFrame from one CRS to another via a GeoDataFrame.
+    Change the coordinates of a DataFrame from one CRS to another, transforming the coordinate columns directly.
     
     Parameters
     ----------
@@ -22,21 +35,17 @@ def changeCoord(df, from_crs = "EPSG:21781", to_crs = "EPSG:4326", **kwargs):
     **kwargs : dict
         Keyword arguments specifying the columns containing the x and y coordinates.
         The valid keyword arguments are:
+        - from_coords : tuple
+            The names of the (x, y) input columns, by default the axis abbreviations of from_crs.
+        - to_coords : tuple
+            The names of the (x, y) output columns, by default the axis abbreviations of to_crs.
     """    
     # Getting projections information
-    from_crs = pyproj.CRS(from_crs)
-    from_x, from_y = kwargs.get("from_coords", (dim.abbrev for dim in from_crs.axis_info))
-    
-    to_crs = pyproj.CRS(to_crs)
-    to_x, to_y = kwargs.get("to_coords", (dim.abbrev for dim in to_crs.axis_info))
+    from_x, from_y = kwargs.get("from_coords", projtb.axisNames(from_crs))
+    to_x, to_y = kwargs.get("to_coords", projtb.axisNames(to_crs))
     
     # Projecting the coordinates
-    gdf = gpd.GeoDataFrame(df, geometry=gpd.points_from_xy(df[from_x], df[from_y]), crs=from_crs)
-    gdf = gdf.to_crs(to_crs)
-    
-    # Converting back to DataFrame
-    x_res = gdf.geometry.x
-    y_res = gdf.geometry.y
+    x_res, y_res = projtb.transform(df[from_x].values, df[from_y].values, from_crs, to_crs)
     
     res = df.drop([from_x, from_y], axis=1)
     res[to_x] = x_res
@@ -101,6 +110,30 @@ def loadStorms(fromFile, **kwargs):
     
     return storms
              
+def getStorms(fromFile = None, **kwargs):
+    """
+    Load the storm catalogue grouped by storm. Without fromFile, the catalogue is loaded once and kept in memory.
+    
+    Parameters
+    ----------
+    fromFile : str
+        The path to the file containing the severe storm data, by default the "storms" dataset.
+    **kwargs : dict
+        Keyword arguments to pass to the loadStorms function.
+    
+    Returns
+    -------
+    pandas.core.groupby.DataFrameGroupBy
+        DataFrameGroupBy object containing the storm data.
+    """
+    if fromFile is None:
+        return drtb.get("storms")
+    
+    storms = loadStorms(fromFile, **kwargs)
+    if isinstance(storms, pd.DataFrame):
+        storms = storms.groupby("ID")
+    return storms
+
 def saveStorms(storms, toFile, **kwargs):
     """
     Save severe storm data to a CSV or pickle file. If a GroupBy object, storms will be aggregated to be save as CSV - but not necessarily for pickle.
@@ -400,8 +433,10 @@ def nearestStorm(storms, stormsDateId, longitude, latitude, datetime, **kwargs):
     ----------
     storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
         DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
-    stormsDateId : pandas.core.frame.DataFrame or str
-        DataFrame containing the dateID of the storms, or a path to a CSV or pickle file.
+        When stormsDateId is a date index, it must be (or group) the DataFrame the index was built from.
+    stormsDateId : dict or pandas.core.series.Series or str
+        Date index of the storms as returned by STtoolbox.buildDateIndex() or STtoolbox.loadDateIndex(),
+        or a path to a saved date index. Series returned by STtoolbox.DateID() (or pickles of them) are still accepted.
     longitude : np.ndarray
         The longitude of the point(s) to find the nearest storm to.
     latitude : np.ndarray
@@ -426,27 +461,31 @@ def nearestStorm(storms, stormsDateId, longitude, latitude, datetime, **kwargs):
     
     if isinstance(storms, str):
         storms = loadStorms(storms, **kwargs)
-        
-    if isinstance(storms, pd.DataFrame):
-        # if storms is a DataFrame, convert it to a DataFrameGroupBy object
-        storms = storms.groupby("ID")
-        
+    
     if isinstance(stormsDateId, str):
-        stormsDateId = loadStorms(stormsDateId, format = "pkl")
+        if os.path.isdir(stormsDateId):
+            stormsDateId = loadDateIndex(stormsDateId)
+        else:
+            stormsDateId = loadStorms(stormsDateId, format = "pkl")
     
     from_crs = kwargs.get("coord", "WGS84")
+    transformer = projtb.getTransformer(from_crs, "EPSG:21781")
     
-    if from_crs != "LV03" and from_crs != "EPSG:21781":
-        transformer = pyproj.Transformer.from_crs(from_crs, "EPSG:21781", always_xy=True)
-    else:
-        transformer = lambda x:x
+    if isinstance(stormsDateId, dict):
+        if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
+            storms = storms.obj
+        return _nearestStormIndexed(storms, stormsDateId, longitude, latitude, datetime, transformer, **kwargs)
+        
+    if isinstance(storms, pd.DataFrame):
+        # if storms is a DataFrame, convert it to a DataFrameGroupBy object
+        storms = storms.groupby("ID")
     
     try:
         IDs = stormsDateId.loc[datetime]
     except:
         IDs = []
     dist, idm = np.ones(len(longitude))*np.inf, np.empty(len(longitude), dtype = object)
-    xref, yref = transformer.transform(longitude, latitude)
+    xref, yref = transformer.transform(np.asarray(longitude), np.asarray(latitude))
     
     if isinstance(IDs, str):
         IDs = [IDs]
@@ -456,8 +495,7 @@ def nearestStorm(storms, stormsDateId, longitude, latitude, datetime, **kwargs):
         storm = storm[(storm["time"] > datetime-pd.DateOffset(hours = 1)) & (storm["time"] <= datetime)] # Stations data are aggregated every hour, with the time being the end of the hour
         x_coord,y_coord = kwargs.get("coords", ("longitude", "latitude"))
         
-        for x,y,a in zip(storm[x_coord], storm[y_coord], storm["A"]):
-            x,y = transformer.transform(x,y)
+        for x,y,a in zip(*transformer.transform(storm[x_coord].values, storm[y_coord].values), storm["A"]):
             dist_temp = ((x-xref)**2 + (y-yref)**2)/a
             
             idm = np.where(np.greater(dist, dist_temp), ID, idm)
@@ -466,8 +504,37 @@ def nearestStorm(storms, stormsDateId, longitude, latitude, datetime, **kwargs):
     dist[dist == np.inf] = np.nan
     
     return idm, np.sqrt(dist)/1000 #the area is in km**2
+
+def _nearestStormIndexed(storms, dateIndex, longitude, latitude, datetime, transformer, **kwargs):
+    """
+    Find the nearest storm to (a) given point(s) at a given time, using a date index. Called by STtoolbox.nearestStorm().
+    
+    The cells of the hour ending at datetime are read directly from the index, and all (cell, point) distances
+    are computed at once.
+    """
+    rows = lookupDateIndex(dateIndex, datetime)
+    x_coord, y_coord = kwargs.get("coords", ("longitude", "latitude"))
+    
+    xref, yref = transformer.transform(np.asarray(longitude), np.asarray(latitude))
+    dist, idm = np.ones(len(longitude))*np.inf, np.empty(len(longitude), dtype = object)
+    
+    if len(rows) > 0:
+        x, y = transformer.transform(storms[x_coord].values[rows], storms[y_coord].values[rows])
+        a = storms["A"].values[rows]
+        dist_all = ((x[:, None] - xref[None, :])**2 + (y[:, None] - yref[None, :])**2)/a[:, None]
+        nearest = np.argmin(dist_all, axis = 0)
+        dist = dist_all[nearest, np.arange(len(xref))]
+        idm[:] = storms["ID"].values[rows][nearest]
+    
+    dist[dist == np.inf] = np.nan
+    
+    return idm, np.sqrt(dist)/1000 #the area is in km**2
     
 def DateID(storms, toFile, **kwargs):
+    """
+    Legacy date ID of the storms, as a Series of storm IDs indexed by the (floored) hour.
+    Superseded by STtoolbox.buildDateIndex(), which lists every storm cell of every hour.
+    """
     
     if isinstance(storms, str):
         storms = loadStorms(storms, **kwargs)
@@ -477,5 +544,307 @@ def DateID(storms, toFile, **kwargs):
         
     result = pd.Series(data = storms["ID"].values, index = (storms["time"]+pd.DateOffset(minutes = 55)).dt.floor('h').values, dtype = 'object').sort_index().drop_duplicates()
     return result
+
+def buildDateIndex(storms, **kwargs):
+    """
+    Build the hour -> storm cells inverted index of a storm catalogue.
+    
+    Each storm cell is assigned to the hour ending after it, i.e. a cell at time t belongs to the hour h with h-1h < t <= h,
+    which is the aggregation convention of the station data. The index is stored in CSR form: for the hour keys[k],
+    the rows (positions in storms) of its cells are rows[offsets[k]:offsets[k+1]]. The keys form a contiguous hourly range,
+    so that a lookup is a constant-time slice.
+    
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+    **kwargs : dict
+        Keyword arguments specifying the format of the file.
+        The valid keyword arguments are:
+        - time_col : str
+            The column containing the time data.
+        - toFile : str
+            The path of the directory to save the index to.
+    
+    Returns
+    -------
+    dict
+        Dictionary with the arrays "keys" (datetime64[ns], UTC), "offsets" and "rows" (int64).
+    """
+    if isinstance(storms, str):
+        storms = loadStorms(storms, **kwargs)
+        
+    if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
+        storms = storms.obj
+    
+    time_col = kwargs.get("time_col", "time")
+    times = pd.to_datetime(storms[time_col])
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert(None)
+    
+    hours = (times + pd.Timedelta(minutes = 55)).dt.floor('h').values.astype("datetime64[ns]").view("int64")
+    if len(hours) == 0:
+        start, nhours = 0, 0
+    else:
+        start = hours.min()
+        nhours = (hours.max() - start)//_HOUR + 1
+    position = (hours - start)//_HOUR
+    
+    index = {
+        "keys": (start + np.arange(nhours, dtype = "int64")*_HOUR).view("datetime64[ns]"),
+        "offsets": np.concatenate(([0], np.cumsum(np.bincount(position, minlength = nhours)))).astype("int64"),
+        "rows": np.argsort(position, kind = "stable").astype("int64"),
+    }
+    
+    toFile = kwargs.get("toFile", None)
+    if toFile:
+        saveDateIndex(index, toFile)
     
-    
\ No newline at end of file
+    return index
+
+def saveDateIndex(index, toFile):
+    """
+    Save a date index to a directory of .npy files, which can be memory-mapped by STtoolbox.loadDateIndex().
+    
+    Parameters
+    ----------
+    index : dict
+        Date index as returned by STtoolbox.buildDateIndex().
+    toFile : str
+        The path of the directory to save the index to.
+    
+    Returns
+    -------
+    None
+    """
+    os.makedirs(toFile, exist_ok = True)
+    for name in _DATE_INDEX_ARRAYS:
+        np.save(os.path.join(toFile, name + ".npy"), index[name])
+    return
+
+def loadDateIndex(fromFile, mmap = True):
+    """
+    Load a date index saved by STtoolbox.saveDateIndex().
+    
+    Parameters
+    ----------
+    fromFile : str
+        The path of the directory containing the index.
+    mmap : bool
+        Whether to memory-map the arrays rather than reading them.
+    
+    Returns
+    -------
+    dict
+        Dictionary with the arrays "keys", "offsets" and "rows".
+    """
+    return {name: np.load(os.path.join(fromFile, name + ".npy"), mmap_mode = "r" if mmap else None) for name in _DATE_INDEX_ARRAYS}
+
+def lookupDateIndex(index, datetime):
+    """
+    Get the rows of the storm cells of the hour ending at datetime.
+    
+    Parameters
+    ----------
+    index : dict
+        Date index as returned by STtoolbox.buildDateIndex() or STtoolbox.loadDateIndex().
+    datetime : pandas._libs.tslibs.timestamps.Timestamp or numpy.datetime64 or str
+        The end of the hour to look up. Timezone-aware datetimes are converted to UTC.
+    
+    Returns
+    -------
+    numpy.ndarray
+        The rows (int64) of the storm cells, empty if there is none.
+    """
+    datetime = pd.Timestamp(datetime)
+    if datetime.tzinfo is not None:
+        datetime = datetime.tz_convert(None)
+    
+    keys, offsets = index["keys"], index["offsets"]
+    if len(keys) == 0:
+        return np.empty(0, dtype = "int64")
+    
+    delta = datetime.value - int(keys[0].astype("datetime64[ns]").view("int64"))
+    position = delta//_HOUR
+    if delta % _HOUR != 0 or position < 0 or position >= len(keys):
+        return np.empty(0, dtype = "int64")
+    
+    return np.asarray(index["rows"][offsets[position]:offsets[position + 1]])
+
+def interpolateTracks(storms, times, **kwargs):
+    """
+    Resample the tracks of all storms onto a time grid, in a single vectorized pass over the catalogue sorted by (ID, time).
+    The variables are linearly interpolated between the two cells surrounding each time of the grid, within the lifetime
+    of each storm only (no extrapolation).
+    
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+    times : array_like
+        The time grid to resample the tracks onto, e.g. a pandas.DatetimeIndex. Timezone-aware times are converted to UTC.
+    **kwargs : dict
+        Keyword arguments specifying the format of the file.
+        The valid keyword arguments are:
+        - time_col : str
+            The column containing the time data.
+        - coords : tuple
+            The names of the columns containing the x and y coordinates.
+        - variables : list
+            The columns to interpolate, by default the coordinates and the area "A".
+        - dense : bool
+            Whether to return a dense (ID, time) Dataset, with NaN outside the lifetime of the storms (default),
+            or a DataFrame with one row per (ID, time) within the lifetime of the storms.
+    
+    Returns
+    -------
+    xarray.core.dataset.Dataset or pandas.core.frame.DataFrame
+        The interpolated tracks, indexed by storm ID and time.
+    """
+    if isinstance(storms, str):
+        storms = loadStorms(storms, **kwargs)
+        
+    if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
+        storms = storms.obj
+    
+    time_col = kwargs.get("time_col", "time")
+    variables = list(kwargs.get("variables", list(kwargs.get("coords", ("longitude", "latitude"))) + ["A"]))
+    
+    cell_times = pd.to_datetime(storms[time_col])
+    if cell_times.dt.tz is not None:
+        cell_times = cell_times.dt.tz_convert(None)
+    cell_times = cell_times.values.astype("datetime64[ns]").view("int64")
+    
+    grid = pd.DatetimeIndex(times)
+    if grid.tz is not None:
+        grid = grid.tz_convert(None)
+    grid = np.unique(grid.values.astype("datetime64[ns]").view("int64"))
+    
+    # Sorting the catalogue by (ID, time)
+    codes, IDs = pd.factorize(storms["ID"], sort = True)
+    order = np.lexsort((cell_times, codes))
+    codes, cell_times = codes[order], cell_times[order]
+    values = storms[variables].values.astype(float)[order]
+    
+    starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+    ends = np.concatenate((starts[1:], [len(codes)]))
+    
+    # Grid times within the lifetime of each storm, as (storm, time) pairs
+    first = np.searchsorted(grid, cell_times[starts], side = "left")
+    last = np.searchsorted(grid, cell_times[ends - 1], side = "right")
+    counts = np.maximum(last - first, 0)
+    pair_storm = np.repeat(np.arange(len(starts)), counts)
+    pair_time = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    
+    # Locating the cell preceding each pair with one search over (storm, time rank) keys
+    ranks = np.unique(np.concatenate((cell_times, grid)), return_inverse = True)[1]
+    nranks = ranks.max() + 1 if len(ranks) else 1
+    cell_keys = codes[starts][np.repeat(np.arange(len(starts)), ends - starts)]*nranks + ranks[:len(cell_times)]
+    pair_keys = codes[starts][pair_storm]*nranks + ranks[len(cell_times):][pair_time]
+    
+    before = np.searchsorted(cell_keys, pair_keys, side = "right") - 1
+    after = np.minimum(before + 1, ends[pair_storm] - 1)
+    span = cell_times[after] - cell_times[before]
+    weight = np.divide(grid[pair_time] - cell_times[before], span, out = np.zeros(len(span)), where = span > 0)[:, None]
+    interpolated = values[before]*(1 - weight) + values[after]*weight
+    
+    if not kwargs.get("dense", True):
+        index = pd.MultiIndex.from_arrays([IDs[codes[starts][pair_storm]], grid[pair_time].view("datetime64[ns]")], names = ["ID", "time"])
+        return pd.DataFrame(interpolated, index = index, columns = variables)
+    
+    result = xr.Dataset(coords = {"ID": ("ID", np.asarray(IDs[codes[starts]], dtype = object)),
+                                  "time": ("time", grid.view("datetime64[ns]"))})
+    for k, variable in enumerate(variables):
+        dense = np.full((len(starts), len(grid)), np.nan)
+        dense[pair_storm, pair_time] = interpolated[:, k]
+        result[variable] = (("ID", "time"), dense)
+    
+    return result
+
+def stormCube(storms, **kwargs):
+    """
+    Count the storm cells by (minute of day bin, day of year, storm type), with a single bincount over encoded keys.
+    
+    The day of year is taken on a leap-year calendar (1 to 366, the 29th of February being day 60 every year), so that
+    each day of year belongs to the same month whatever the year. The storm types are "all" (every cell), "OR" (cells with
+    none of the type flags) and the types of STtoolbox.STORM_TYPES; a cell is counted in every type it is flagged with.
+    
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+    **kwargs : dict
+        Keyword arguments specifying the format of the file.
+        The valid keyword arguments are:
+        - time_col : str
+            The column containing the time data.
+        - binMinutes : int
+            The width of the minute of day bins, by default 5 minutes.
+        - toFile : str
+            The path of the netCDF file to save the cube to.
+    
+    Returns
+    -------
+    xarray.core.dataarray.DataArray
+        The counts, with dimensions ("minute_of_day", "day_of_year", "storm_type").
+    """
+    if isinstance(storms, str):
+        storms = loadStorms(storms, **kwargs)
+        
+    if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
+        storms = storms.obj
+    
+    binMinutes = kwargs.get("binMinutes", 5)
+    times = storms[kwargs.get("time_col", "time")]
+    
+    mod = (times.dt.hour.values*60 + times.dt.minute.values)//binMinutes
+    doy = times.dt.dayofyear.values - 1
+    doy = doy + ((~times.dt.is_leap_year.values) & (times.dt.month.values > 2)) # Leap-year calendar
+    
+    types = ["all"]
+    membership = [np.ones(len(storms), dtype = bool)]
+    if set(STORM_TYPES.values()).issubset(storms.columns):
+        flags = (storms[list(STORM_TYPES.values())] == 1).values
+        types += ["OR"] + list(STORM_TYPES.keys())
+        membership += [~flags.any(axis = 1)] + list(flags.T)
+    cells, type_index = np.nonzero(np.array(membership).T)
+    
+    shape = (1440//binMinutes, 366, len(types))
+    keys = (mod[cells]*shape[1] + doy[cells])*shape[2] + type_index
+    counts = np.bincount(keys, minlength = np.prod(shape)).reshape(shape)
+    
+    cube = xr.DataArray(counts,
+                        coords = {"minute_of_day": np.arange(shape[0])*binMinutes,
+                                  "day_of_year": np.arange(1, shape[1] + 1),
+                                  "storm_type": types},
+                        dims = ["minute_of_day", "day_of_year", "storm_type"],
+                        name = "cells",
+                        attrs = {"long_name": "Number of storm cells",
+                                 "bin_minutes": binMinutes,
+                                 "calendar": "day of year on a leap-year calendar"})
+    
+    toFile = kwargs.get("toFile", None)
+    if toFile:
+        cube.to_netcdf(toFile)
+    
+    return cube
+
+def loadCube(fromFile):
+    """
+    Load a storm cell cube saved by STtoolbox.stormCube().
+    
+    Parameters
+    ----------
+    fromFile : str
+        The path to the netCDF file.
+    
+    Returns
+    -------
+    xarray.core.dataarray.DataArray
+        The counts, with dimensions ("minute_of_day", "day_of_year", "storm_type").
+    """
+    return xr.load_dataarray(fromFile)
+
+
+drtb.register("storms", "Storm_tracks/CH_severe_storms_2016_2021_WGS84.pkl", loader = getStorms)
+drtb.register("storm_plots", "Storm_tracks", root = "plots")
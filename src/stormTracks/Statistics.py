@@ -3,8 +3,39 @@ import geopandas as gpd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import numpy as np
+import xarray as xr
 import STtoolbox as sttb
 import pickle
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import projections.PROJtoolbox as projtb
+import dataRegistry.DRtoolbox as drtb
+
+_STORM_TYPES = sttb.STORM_TYPES
+
+# Days of a leap year, on which the day of year of the storm cell cube is defined
+_LEAP_MONTHS = pd.date_range(start = "2016-01-01", periods = 366, freq = "D")
+
+_QUARTERS = [[],
+             ["January", "February", "March"],
+             ["April", "May", "June"],
+             ["July", "August", "September"],
+             ["October", "November", "December"]]
+
+# Settings of the per-storm distribution figures, by aggregate
+_FIGURES = {
+    "duration": dict(xlabel = "Duration (hours)", title = "Distribution of storm durations",
+                     suptitle = "Duration of storms", xlim = (0, 11)),
+    "max_area": dict(xlabel = "Area (km^2)", title = "Distribution of storm areas",
+                     suptitle = "Maximum area of storms", xlim = (0, 3800), xticks = [0,1000,1500,2000,2500,3000,3500]),
+    "track_length": dict(xlabel = "Track length (km)", title = "Distribution of storm track lengths",
+                         suptitle = "Track length of storms", xlim = (0, 900), xticks = [0,400,600,800], yticks = False),
+}
+
 
 def durationPlot(storms, **kwargs):
     """
@@ -17,54 +48,16 @@ def durationPlot(storms, **kwargs):
     **kwargs : dict
         - toFile: str
             Path to save the plot.    
+        - show: bool
+            Whether to show the plot, by default True.
         And additional keyword arguments to pass to the loadStorms function.
         
     Returns
     -------
     matplotlib.pyplot.Figure containing the date
     """
-    if isinstance(storms, str):
-        storms = sttb.loadStorms(storms, **kwargs)
-        
-    if isinstance(storms, pd.DataFrame):
-        # if storms is a DataFrame, convert it to a DataFrameGroupBy object
-        storms = storms.groupby("ID")
-        
-    durations = []
-    for name, group in storms:
-        durations.append((group["time"].max() - group["time"].min()).seconds / 3600)
-    quantile = np.quantile(durations, 0.95)
-    
-    fig, axes = plt.subplots(nrows = 2, ncols = 1)
-    
-    sns.histplot(durations, bins = 32, kde = True, ax=axes[0])
-    axes[0].set_xlabel("Duration (hours)")
-    axes[0].set_ylabel("Number of storms")
-    axes[0].set_xlim(0, 11)
-    axes[0].set_title("Distribution of storm durations")
-    
-    sns.histplot(durations, stat = 'count', cumulative=True, ax=axes[1])
-    axes[1].hlines(0.95*len(durations), 0, quantile, colors='r', linestyles='dashed', label='95% quantile')
-    axes[1].vlines(quantile, 0, 0.95*len(durations), colors='r', linestyles='dashed')
-    axes[1].set_xticks(list(axes[1].get_xticks()) + [quantile])
-    axes[1].set_yticks(list(axes[1].get_yticks()) + [0.95*len(durations)])
-    axes[1].set_xlabel("Duration (hours)")
-    axes[1].set_ylabel("Number of storms")
-    axes[1].set_xlim(0, 11)
-    axes[1].set_title("Cumulative count distribution")
-    axes[1].legend(loc = 'lower right')
-    
-    fig.suptitle("Duration of storms")
-    fig.tight_layout()
-    
-    toFile = kwargs.get("toFile", None)
-    if toFile:
-        plt.savefig(toFile, bbox_inches = "tight")
-        
-    plt.show()
-    plt.close()
-    
-    return fig
+    durations = stormAggregates(storms, **kwargs)["duration"].values
+    return _distributionFigure(durations, show = kwargs.get("show", True), toFile = kwargs.get("toFile", None), **_FIGURES["duration"])
 
 def maxAreaPlot(storms, **kwargs):
     """
@@ -77,55 +70,16 @@ def maxAreaPlot(storms, **kwargs):
     **kwargs : dict
         - toFile: str
             Path to save the plot.    
+        - show: bool
+            Whether to show the plot, by default True.
         And additional keyword arguments to pass to the loadStorms function.
         
     Returns
     -------
     matplotlib.pyplot.Figure containing the date
     """
-    if isinstance(storms, str):
-        storms = sttb.loadStorms(storms, **kwargs)
-        
-    if isinstance(storms, pd.DataFrame):
-        # if storms is a DataFrame, convert it to a DataFrameGroupBy object
-        storms = storms.groupby("ID")
-    
-    areas = []
-    for name, group in storms:
-        areas.append(group["A"].max())
-    quantile = np.quantile(areas, 0.95)
-    
-    
-    fig, axes = plt.subplots(nrows = 2, ncols = 1)
-    
-    sns.histplot(areas, bins = 32, kde = True, ax=axes[0])
-    axes[0].set_xlabel("Area (km^2)")
-    axes[0].set_ylabel("Number of storms")
-    axes[0].set_title("Distribution of storm areas")
-    axes[0].set_xlim(0, 3800)
-    
-    sns.histplot(areas, stat = 'count', cumulative=True, ax=axes[1])
-    axes[1].hlines(0.95*len(areas), 0, quantile, colors='r', linestyles='dashed', label='95% quantile')
-    axes[1].vlines(quantile, 0, 0.95*len(areas), colors='r', linestyles='dashed')
-    axes[1].set_xticks([0,1000,1500,2000,2500,3000,3500] + [quantile])
-    axes[1].set_yticks(list(axes[1].get_yticks()) + [0.95*len(areas)])
-    axes[1].legend(loc = 'lower right')
-    axes[1].set_xlabel("Area (km^2)")
-    axes[1].set_ylabel("Number of storms")
-    axes[1].set_title("Cumulative count distribution")
-    axes[1].set_xlim(0, 3800)
-    
-    fig.suptitle("Maximum area of storms")
-    fig.tight_layout()
-    
-    toFile = kwargs.get("toFile", None)
-    if toFile:
-        plt.savefig(toFile, bbox_inches = "tight")
-        
-    plt.show()
-    plt.close()
-    
-    return fig
+    areas = stormAggregates(storms, **kwargs)["max_area"].values
+    return _distributionFigure(areas, show = kwargs.get("show", True), toFile = kwargs.get("toFile", None), **_FIGURES["max_area"])
 
 def trackLengthPlot(storms, file_type, **kwargs):
     """
@@ -133,11 +87,16 @@ def trackLengthPlot(storms, file_type, **kwargs):
     
     Parameters
     ----------
-    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str or geopandas.geodataframe.GeoDataFrame
         DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+        If file_type is "gpd", GeoDataFrame of tracks as returned by STtoolbox.tracks(), or a path to it.
+    file_type : str
+        Either "pd" (storm cells) or "gpd" (storm tracks).
     **kwargs : dict
         - toFile: str
             Path to save the plot.    
+        - show: bool
+            Whether to show the plot, by default True.
         And additional keyword arguments to pass to the loadStorms function.
         
     Returns
@@ -145,71 +104,275 @@ def trackLengthPlot(storms, file_type, **kwargs):
     matplotlib.pyplot.Figure containing the date
     """
     if file_type.lower() == "pd" or file_type.lower() == "pandas":
-        storms = sttb.tracks(storms, **kwargs)
-    elif file_type.lower == "gpd" or file_type.lower() == "geopandas":
+        lengths = stormAggregates(storms, **kwargs)["track_length"].values
+    elif file_type.lower() == "gpd" or file_type.lower() == "geopandas":
         if isinstance(storms, str):
             storms = sttb.loadTracks(storms, **kwargs)
+        lengths = storms.to_crs("EPSG:2056")["geometry"].length.values / 1000
     
-    lengths = storms.to_crs("EPSG:2056")["geometry"].length / 1000
-    quantile = np.quantile(lengths, 0.95)
-    
-    fig, axes = plt.subplots(nrows = 2, ncols = 1)
-    
-    sns.histplot(lengths, bins = 32, kde = True, ax=axes[0])
-    axes[0].set_xlabel("Track length (km)")
-    axes[0].set_ylabel("Number of storms")
-    axes[0].set_title("Distribution of storm track lengths")
-    axes[0].set_xlim(0, 900)
-    
-    sns.histplot(lengths, stat = 'count', cumulative=True, ax=axes[1])
-    axes[1].set_xlabel("Track length (km)")
-    axes[1].set_ylabel("Number of storms")
-    axes[1].set_title("Cumulative count distribution")
-    axes[1].hlines(0.95*len(lengths), 0, quantile, colors='r', linestyles='dashed', label='95% quantile')
-    axes[1].vlines(quantile, 0, 0.95*len(lengths), colors='r', linestyles='dashed')
-    axes[1].set_xticks([0,400,600,800] + [quantile])
-    axes[1].set_xlim(0, 900)
-    axes[1].legend(loc = 'lower right')
-    
-    fig.suptitle("Track length of storms")
-    fig.tight_layout()
-    
-    toFile = kwargs.get("toFile", None)
-    if toFile:
-        plt.savefig(toFile, bbox_inches = "tight")
-        
-    plt.show()
-    plt.close()
-    
-    return fig
+    return _distributionFigure(lengths, show = kwargs.get("show", True), toFile = kwargs.get("toFile", None), **_FIGURES["track_length"])
 
 def storm_statistics_day(storms, mult, plottype = "hist", **kwargs):
     """
-    Plot the distribution of storms on a day.
+    Plot the distribution of storms on a day, from the storm cell cube.
     
     Parameters
     ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str or xarray.core.dataarray.DataArray
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file,
+        or a cube as returned by STtoolbox.stormCube() or a path to its netCDF file.
     mult : str
         Method for multiple plots.
     plottype : str
         Type of plot to use.
+    **kwargs : dict
+        - storm_type : str
+            The storm type to plot, by default "all".
+        - toFile: str
+            Path to save the plot.    
+        - show: bool
+            Whether to show the plot, by default True.
+        And additional keyword arguments to pass to the STtoolbox.stormCube function.
     
     Returns
     -------
     matplotlib.pyplot.Figure containing the date
     """
-    sns.set_theme()
+    return _dayFigure(_cube(storms, **kwargs), mult, plottype, storm_type = kwargs.get("storm_type", "all"),
+                      show = kwargs.get("show", True), toFile = kwargs.get("toFile", None))
+
+def storm_statistics_year(storms, **kwargs):
+    """
+    Plot the distribution of storms on a year, from the storm cell cube.
     
-    fig, axes = plt.subplots(nrows = 5, ncols = 1, figsize = (15, 20), sharex = True)
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str or xarray.core.dataarray.DataArray
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file,
+        or a cube as returned by STtoolbox.stormCube() or a path to its netCDF file.
+    **kwargs : dict
+        - storm_type : str
+            The storm type to plot, by default "all".
+        - toFile: str
+            Path to save the plot.    
+        - show: bool
+            Whether to show the plot, by default True.
+        And additional keyword arguments to pass to the STtoolbox.stormCube function.
+    
+    Returns
+    -------
+    matplotlib.pyplot.Figure containing the date
+    """
+    return _yearFigure(_cube(storms, **kwargs), storm_type = kwargs.get("storm_type", "all"),
+                       show = kwargs.get("show", True), toFile = kwargs.get("toFile", None))
+
+def stormAggregates(storms, **kwargs):
+    """
+    Compute the per-storm aggregates used by the statistics plots in one vectorized pass over the catalogue.
+    
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+    **kwargs : dict
+        - coords : tuple
+            The names of the columns containing the WGS84 coordinates.
+        And additional keyword arguments to pass to the loadStorms function.
+    
+    Returns
+    -------
+    pandas.core.frame.DataFrame
+        DataFrame indexed by storm ID with the start and end times, the duration (hours), the number of cells,
+        the maximum area (km^2), the track length (km) and, if the storm type columns are available, whether
+        the storm is of each type (as in STtoolbox.filter).
+    """
+    storms = _cells(storms, **kwargs)
+    x_coord, y_coord = kwargs.get("coords", ("longitude", "latitude"))
+    
+    storms = storms.sort_values(["ID", "time"], kind = "stable")
+    grouped = storms.groupby("ID", sort = True)
+    result = pd.DataFrame({"start": grouped["time"].min(),
+                           "end": grouped["time"].max(),
+                           "cells": grouped.size(),
+                           "max_area": grouped["A"].max()})
+    result["duration"] = (result["end"] - result["start"]).dt.total_seconds() / 3600
+    
+    # Track lengths, as in LV95 lengths of the tracks, from the segments between consecutive cells of a storm
+    codes = pd.factorize(storms["ID"], sort = True)[0]
+    x, y = projtb.transform(storms[x_coord].values, storms[y_coord].values, "EPSG:4326", "EPSG:2056")
+    segments = np.hypot(np.diff(x), np.diff(y))
+    segments[codes[1:] != codes[:-1]] = 0.
+    result["track_length"] = np.bincount(codes[1:], weights = segments, minlength = len(result)) / 1000
+    
+    if set(_STORM_TYPES.values()).issubset(storms.columns):
+        flags = storms[list(_STORM_TYPES.values())] == 1
+        all_flags = flags.groupby(storms["ID"]).all()
+        for storm_type, column in _STORM_TYPES.items():
+            result[storm_type] = all_flags[column]
+        result["OR"] = (~flags).groupby(storms["ID"]).all().all(axis = 1)
+    
+    return result
+
+def statisticsReport(storms, reportDir, **kwargs):
+    """
+    Compute all the storm statistics of a catalogue and write them, with their figures, to a report directory.
+    The catalogue is loaded and aggregated once (per-storm aggregates and storm cell cube), and the figures are
+    rendered in parallel on the Agg backend.
+    
+    Parameters
+    ----------
+    storms : pandas.core.groupby.DataFrameGroupBy or pandas.core.frame.DataFrame or str
+        DataFrameGroupBy object containing storm data, or a DataFrame or a path to a CSV or pickle file.
+    reportDir : str
+        The directory to write the report to.
+    **kwargs : dict
+        - workers : int
+            The number of processes rendering the figures, by default one per figure.
+        - mult : str
+            Method for multiple plots in the day statistics, by default "stack".
+        - plottype : str
+            Type of plot in the day statistics, by default "hist".
+        - format : str
+            The format of the figures, by default "png".
+        - binMinutes : int
+            The width of the minute of day bins of the cube, by default 5 minutes.
+        And additional keyword arguments to pass to the loadStorms function.
+    
+    Returns
+    -------
+    dict
+        The paths of the files written, by name.
+    """
+    os.makedirs(reportDir, exist_ok = True)
+    fmt = kwargs.get("format", "png")
+    storms = _cells(storms, **kwargs)
+    
+    files = {"aggregates": os.path.join(reportDir, "storm_aggregates.csv"),
+             "summary": os.path.join(reportDir, "summary.csv"),
+             "cube": os.path.join(reportDir, "storm_cube.nc"),
+             "day": os.path.join(reportDir, "cells_minute_of_day.csv"),
+             "year": os.path.join(reportDir, "cells_day_of_year.csv")}
+    
+    aggregates = stormAggregates(storms, **kwargs)
+    cube = sttb.stormCube(storms, binMinutes = kwargs.get("binMinutes", 5), toFile = files["cube"])
+    
+    aggregates.to_csv(files["aggregates"])
+    aggregates[list(_FIGURES.keys())].describe(percentiles = [0.5, 0.95]).to_csv(files["summary"])
+    _monthlyDay(cube.sel(storm_type = "all")).to_csv(files["day"], index = False)
+    cube.sum("minute_of_day").to_pandas().to_csv(files["year"])
+    
+    tasks = [(_distributionFigure, (aggregates[name].values,), dict(_FIGURES[name]), name) for name in _FIGURES]
+    tasks.append((_dayFigure, (cube, kwargs.get("mult", "stack"), kwargs.get("plottype", "hist")), {}, "storms_day"))
+    tasks.append((_yearFigure, (cube,), {}, "storms_year"))
+    
+    with ProcessPoolExecutor(max_workers = kwargs.get("workers", len(tasks)), initializer = _headless) as executor:
+        futures = []
+        for function, args, options, name in tasks:
+            files[name] = os.path.join(reportDir, f"{name}.{fmt}")
+            options.update(show = False, toFile = files[name])
+            futures.append(executor.submit(_render, function, args, options))
+        for future in futures:
+            future.result()
+    
+    return files
+
+def _cells(storms, **kwargs):
+    """
+    Load storms if needed and return them as a DataFrame of cells.
+    """
     if isinstance(storms, str):
         storms = sttb.loadStorms(storms, **kwargs)
         
     if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
-        storms = storms.filter(lambda x : True)
+        storms = storms.obj
+    
+    return storms
+
+def _cube(storms, **kwargs):
+    """
+    Get the storm cell cube of storms, loading or building it if needed.
+    """
+    if isinstance(storms, xr.DataArray):
+        return storms
+    if isinstance(storms, str) and storms.endswith(".nc"):
+        return sttb.loadCube(storms)
+    return sttb.stormCube(_cells(storms, **kwargs), **{key: value for key, value in kwargs.items() if key != "toFile"})
+
+def _monthlyDay(counts):
+    """
+    Sum (minute_of_day, day_of_year) counts over the days of each month, as a DataFrame with columns "MoD", "Month", "cells".
+    """
+    starts = np.flatnonzero(np.diff(_LEAP_MONTHS.month, prepend = 0))
+    monthly = np.add.reduceat(counts.transpose("minute_of_day", "day_of_year").values, starts, axis = 1)
+    return pd.DataFrame({"MoD": np.repeat(counts["minute_of_day"].values, 12),
+                         "Month": np.tile(_LEAP_MONTHS.month_name()[starts], len(counts["minute_of_day"])),
+                         "cells": monthly.ravel()})
+
+def _headless():
+    """
+    Switch a worker process to the non-interactive Agg backend.
+    """
+    plt.switch_backend("Agg")
+
+def _render(function, args, options):
+    """
+    Render a figure in a worker process, without returning it.
+    """
+    function(*args, **options)
+    return options["toFile"]
+
+def _distributionFigure(values, xlabel, title, suptitle, xlim, xticks = None, yticks = True, show = True, toFile = None):
+    """
+    Plot the distribution and the cumulative count distribution of per-storm values, with their 95% quantile.
+    """
+    quantile = np.quantile(values, 0.95)
+    
+    fig, axes = plt.subplots(nrows = 2, ncols = 1)
+    
+    sns.histplot(values, bins = 32, kde = True, ax=axes[0])
+    axes[0].set_xlabel(xlabel)
+    axes[0].set_ylabel("Number of storms")
+    axes[0].set_xlim(*xlim)
+    axes[0].set_title(title)
+    
+    sns.histplot(values, stat = 'count', cumulative=True, ax=axes[1])
+    axes[1].hlines(0.95*len(values), 0, quantile, colors='r', linestyles='dashed', label='95% quantile')
+    axes[1].vlines(quantile, 0, 0.95*len(values), colors='r', linestyles='dashed')
+    axes[1].set_xticks((list(axes[1].get_xticks()) if xticks is None else list(xticks)) + [quantile])
+    if yticks:
+        axes[1].set_yticks(list(axes[1].get_yticks()) + [0.95*len(values)])
+    axes[1].set_xlabel(xlabel)
+    axes[1].set_ylabel("Number of storms")
+    axes[1].set_xlim(*xlim)
+    axes[1].set_title("Cumulative count distribution")
+    axes[1].legend(loc = 'lower right')
+    
+    fig.suptitle(suptitle)
+    fig.tight_layout()
+    
+    if toFile:
+        fig.savefig(toFile, bbox_inches = "tight")
+    
+    if show:
+        plt.show()
+    plt.close(fig)
+    
+    return fig
+
+def _dayFigure(cube, mult, plottype = "hist", storm_type = "all", show = True, toFile = None):
+    """
+    Plot the distribution of storm cells on a day, overall and per quarter, from the storm cell cube.
+    """
+    sns.set_theme()
+    
+    fig, axes = plt.subplots(nrows = 5, ncols = 1, figsize = (15, 20), sharex = True)
+    
+    counts = cube.sel(storm_type = storm_type)
+    step = int(counts["minute_of_day"].values[1] - counts["minute_of_day"].values[0])
     
     # Plotting distribution on a day
-    storms["MoD"] = storms["time"].dt.hour*60 + storms["time"].dt.minute
-    sns.histplot(storms["MoD"], bins = 12*24, ax=axes[0])
+    overall = counts.sum("day_of_year")
+    sns.histplot(data = overall.to_dataframe(), x = "minute_of_day", weights = "cells", binwidth = step, binrange = (0, 24*60), ax=axes[0])
     # Getting all hour - 5min in a day
     xlab = pd.date_range(start='2016-01-01', periods = 24, freq='2h')
     axes[0].set_xticks(xlab.hour*60 + xlab.minute, xlab.strftime("%H:%M"))
@@ -218,30 +381,24 @@ def storm_statistics_day(storms, mult, plottype = "hist", **kwargs):
     axes[0].set_ylabel("Number of storms")
     
     # Plotting distribution on a day per month
-    three_months = [[],
-                    ["January", "February", "March"],
-                    ["April", "May", "June"],
-                    ["July", "August", "September"],
-                    ["October", "November", "December"]]
+    monthly = _monthlyDay(counts)
     for i in range(1, 5):
-        storms["MoD"] = storms["time"].dt.hour*60 + storms["time"].dt.minute
-        storms["Month"] = storms["time"].dt.month_name()
-        if not (storms[storms["Month"].isin(three_months[i])].empty):
+        months = [month for month in _QUARTERS[i] if monthly.loc[monthly["Month"] == month, "cells"].sum() > 0]
+        quarter = monthly[monthly["Month"].isin(months)]
+        if len(months) > 0:
             if plottype == "hist":
-                sns.histplot(data = storms[storms["Month"].isin(three_months[i])],
-                             x="MoD", bins = 12*24,
+                sns.histplot(data = quarter,
+                             x="MoD", weights = "cells", binwidth = step, binrange = (0, 24*60),
                              ax=axes[i],
-                             hue = "Month",
+                             hue = "Month", hue_order = months,
                              multiple=mult)
                 axes[i].set_ylim(0,700)
             elif plottype == "kde":
-                sns.kdeplot(data = storms[storms["Month"].isin(three_months[i])],
-                            x="MoD",
+                sns.kdeplot(data = quarter,
+                            x="MoD", weights = "cells",
                             ax=axes[i],
-                            hue = "Month",
+                            hue = "Month", hue_order = months,
                             multiple=mult)
-        # Getting all hour - 5min in a day
-        xlab = pd.date_range(start='2016-01-01', periods = 24, freq='2h')
         axes[i].set_xticks(xlab.hour*60 + xlab.minute, xlab.strftime("%H:%M"))
         axes[i].set_xlim(0, 24*60)
         axes[i].set_ylabel("Number of storms")
@@ -250,56 +407,46 @@ def storm_statistics_day(storms, mult, plottype = "hist", **kwargs):
     fig.suptitle("Distribution of storms on a day")
     fig.tight_layout()
     
-    toFile = kwargs.get("toFile", None)
     if toFile:
-        plt.savefig(toFile, bbox_inches = "tight")
-        
-    plt.show()
-    plt.close()    
+        fig.savefig(toFile, bbox_inches = "tight")
+    
+    if show:
+        plt.show()
+    plt.close(fig)
     
     return fig
 
-def storm_statistics_year(storms, **kwargs):
+def _yearFigure(cube, storm_type = "all", show = True, toFile = None):
     """
-    Plot the distribution of storms on a year.
-    
-    Returns
-    -------
-    matplotlib.pyplot.Figure containing the date
+    Plot the distribution of storm cells on a year, from the storm cell cube.
     """
     sns.set_theme()
     
     fig, axes = plt.subplots(nrows = 1, ncols = 1, figsize = (15, 5), sharex=True)
-    if isinstance(storms, str):
-        storms = sttb.loadStorms(storms, **kwargs)
-        
-    if isinstance(storms, pd.core.groupby.DataFrameGroupBy):
-        storms = storms.filter(lambda x : True)
     
     # Plotting distribution on a year
-    storms["MonthDay"] = storms["time"].dt.dayofyear
-    
-    sns.histplot(storms["MonthDay"], bins = np.arange(366), ax=axes)
+    yearly = cube.sel(storm_type = storm_type).sum("minute_of_day")
+    sns.histplot(data = yearly.to_dataframe(), x = "day_of_year", weights = "cells", binwidth = 1, binrange = (1, 367), ax=axes)
     
     xlab = pd.date_range(start='2016-01-01', periods = 12, freq='MS')
     axes.set_xticks(xlab.dayofyear, xlab.strftime("%m-%d"))
     axes.set_xlabel("Date")
-    axes.set_xlim(0, 365)
+    axes.set_xlim(0, 367)
     axes.set_ylabel("Number of storms")
     axes.set_title("Distribution of storms on a year")
     fig.tight_layout()
     
-    toFile = kwargs.get("toFile", None)
     if toFile:
-        plt.savefig(toFile, bbox_inches = "tight")
-        
-    plt.show()
-    plt.close()    
+        fig.savefig(toFile, bbox_inches = "tight")
+    
+    if show:
+        plt.show()
+    plt.close(fig)
     
     return fig
 
-def getStormNumber(storms = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/treated_data/Storm_tracks/CH_severe_storms_2016_2021_WGS84.pkl",
-                         path = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/plots/Storm_tracks",
+def getStormNumber(storms = None,
+                         path = None,
                          **kwargs):
     """
     Plot the number of storms that were kept after filtering.
@@ -307,12 +454,14 @@ def getStormNumber(storms = "/work/FAC/FGSE/IDYST/tbeucler/downscaling/alecler1/
     Parameters
     ----------
     storms : pandas.core.groupby.DataFrameGroupBy or str
-        DataFrameGroupBy object containing the filtered storms.
+        DataFrameGroupBy object containing the filtered storms, by default the "storms" dataset.
     path : str
-        Path to save the plot.
+        Path to save the plot, by default the "storm_plots" dataset.
     **kwargs : dict
         Keyword arguments specifying the criteria used to filter the storms.
     """
+    storms = sttb.getStorms() if storms is None else storms
+    path = drtb.getPath("storm_plots") if path is None else path
     if isinstance(storms, str):
         storms = sttb.loadStorms(storms, **kwargs)
         
@@ -0,0 +1,433 @@
+import numpy as np
+import pandas as pd
+import xarray as xr
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from scipy import special, stats
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+import linReg.LRtoolbox as lrtb
+
+# Edges of the bins of distance to the nearest storm (as returned by STtoolbox.nearestStorm)
+DISTANCE_BINS = (0., 1., 2., 5., 10., np.inf)
+# Sums accumulated per group, and per (threshold, group) or (threshold, probability bin, group)
+_SUMS = ("count", "error", "absolute_error", "squared_error", "crps")
+_THRESHOLD_SUMS = ("brier_count", "brier")
+_RELIABILITY_SUMS = ("reliability_count", "reliability_probability", "reliability_observed")
+
+def crpsGaussian(mu, sigma, y):
+    """
+    Closed-form CRPS of a Gaussian forecast.
+
+    Parameters
+    ----------
+    mu : numpy.ndarray
+        The mean of the forecast.
+    sigma : numpy.ndarray
+        The standard deviation of the forecast.
+    y : numpy.ndarray
+        The observation.
+
+    Returns
+    -------
+    numpy.ndarray
+        The CRPS.
+    """
+    z = (y - mu)/sigma
+    return sigma*(z*(2*stats.norm.cdf(z) - 1) + 2*stats.norm.pdf(z) - 1/np.sqrt(np.pi))
+
+def crpsGEV(location, scale, shape, y):
+    """
+    Closed-form CRPS of a GEV forecast (Friederichs and Thorarinsdottir, 2012), for shape < 1.
+
+    Parameters
+    ----------
+    location : numpy.ndarray
+        The location of the forecast.
+    scale : numpy.ndarray
+        The scale of the forecast.
+    shape : numpy.ndarray
+        The shape of the forecast (positive for a heavy tail), the Gumbel limit being used for |shape| < 1e-4.
+    y : numpy.ndarray
+        The observation.
+
+    Returns
+    -------
+    numpy.ndarray
+        The CRPS.
+    """
+    location, scale, shape, y = np.broadcast_arrays(*(np.asarray(a, dtype = float) for a in (location, scale, shape, y)))
+    z = (y - location)/scale
+    gumbel = np.abs(shape) < 1e-4
+    safe = np.where(gumbel, 1., shape)
+    with np.errstate(divide = "ignore", invalid = "ignore", over = "ignore"):
+        t = 1 + safe*z
+        # -log F(y), infinite below the support and 0 above it
+        minusLogF = np.where(t > 0, np.exp(-np.log(np.where(t > 0, t, 1.))/safe), np.where(safe > 0, np.inf, 0.))
+        F = np.exp(-minusLogF)
+        a = 1 - safe
+        general = ((location - y - scale/safe)*(1 - 2*F)
+                   - scale/safe*(2**safe*special.gamma(a) - 2*special.gamma(a)*np.where(np.isinf(minusLogF), 1., special.gammainc(a, np.where(np.isinf(minusLogF), 0., minusLogF)))))
+        ez = np.exp(-z)
+        limit = location - y + scale*(np.euler_gamma - np.log(2)) + 2*scale*special.exp1(ez)
+    return np.where(gumbel, limit, general)
+
+def crpsEnsemble(members, y, axis = -1):
+    """
+    CRPS of an ensemble forecast, E|X - y| - E|X - X'|/2 over the members, computed from the sorted members.
+
+    Parameters
+    ----------
+    members : numpy.ndarray
+        The members of the forecast. NaN members are ignored.
+    y : numpy.ndarray
+        The observation, broadcastable to members without axis.
+    axis : int
+        The axis of the members.
+
+    Returns
+    -------
+    numpy.ndarray
+        The CRPS.
+    """
+    members = np.sort(np.moveaxis(np.asarray(members, dtype = float), axis, -1), axis = -1)
+    valid = ~np.isnan(members)
+    m = valid.sum(axis = -1)
+    x = np.where(valid, members, 0.)
+    with np.errstate(invalid = "ignore", divide = "ignore"):
+        absolute = np.where(valid, np.abs(members - np.asarray(y)[..., None]), 0.).sum(axis = -1)/m
+        # NaN are sorted last, so that the rank of the valid members is their position
+        rank = np.arange(1, members.shape[-1] + 1)
+        spread = (np.where(valid, (2*rank - m[..., None] - 1)*x, 0.)).sum(axis = -1)/m**2
+    return np.where(m > 0, absolute - spread, np.nan)
+
+def exceedanceProbability(threshold, **forecast):
+    """
+    Probability of exceeding a threshold, for a deterministic, Gaussian, GEV or ensemble forecast.
+
+    Parameters
+    ----------
+    threshold : float
+        The threshold.
+    **forecast : dict
+        The forecast, as one of:
+        - point : numpy.ndarray
+            A deterministic forecast (probability 0 or 1).
+        - mu, sigma : numpy.ndarray
+            A Gaussian forecast.
+        - location, scale, shape : numpy.ndarray
+            A GEV forecast.
+        - members : numpy.ndarray
+            An ensemble forecast, with the members along the last axis.
+
+    Returns
+    -------
+    numpy.ndarray
+        The probability of exceeding threshold.
+    """
+    if "members" in forecast:
+        members = forecast["members"]
+        with np.errstate(invalid = "ignore"):
+            return (members > threshold).sum(axis = -1)/(~np.isnan(members)).sum(axis = -1)
+    if "sigma" in forecast:
+        return stats.norm.sf(threshold, loc = forecast["mu"], scale = forecast["sigma"])
+    if "shape" in forecast:
+        # scipy's shape parameter has the opposite sign
+        return stats.genextreme.sf(threshold, -forecast["shape"], loc = forecast["location"], scale = forecast["scale"])
+    point = forecast["point"]
+    return np.where(np.isnan(point), np.nan, (point > threshold).astype(float))
+
+def newAccumulator(leadTimes, stations, **kwargs):
+    """
+    Create an empty verification accumulator, grouping by (lead_time, station, hour of day, storm proximity).
+
+    Parameters
+    ----------
+    leadTimes : numpy.ndarray
+        The lead times.
+    stations : numpy.ndarray
+        The stations.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            thresholds : list
+                The thresholds of the Brier scores and reliability curves, by default none.
+            distanceBins : tuple
+                The edges of the bins of distance to the nearest storm, by default DISTANCE_BINS. Time steps
+                without a storm (NaN distance) are in an additional bin "none".
+            probabilityBins : int
+                The number of bins of the reliability curves, by default 10.
+
+    Returns
+    -------
+    dict
+        The accumulator: sums over each group, to be filled by accumulate() and merged with mergeAccumulators().
+    """
+    thresholds = np.asarray(kwargs.get("thresholds", ()), dtype = float)
+    distanceBins = np.asarray(kwargs.get("distanceBins", DISTANCE_BINS), dtype = float)
+    probabilityBins = kwargs.get("probabilityBins", 10)
+    shape = (len(leadTimes), len(stations), 24, len(distanceBins))
+    G, T = int(np.prod(shape)), len(thresholds)
+    accumulator = {name: np.zeros(G) for name in _SUMS}
+    accumulator.update({name: np.zeros((T, G)) for name in _THRESHOLD_SUMS})
+    accumulator.update({name: np.zeros((T, probabilityBins, G)) for name in _RELIABILITY_SUMS})
+    accumulator.update(shape = shape, lead_time = np.asarray(leadTimes), station = np.asarray(stations),
+                       thresholds = thresholds, distanceBins = distanceBins, probabilityBins = probabilityBins)
+    return accumulator
+
+def accumulate(accumulator, chunk, observation, **kwargs):
+    """
+    Add the verification of a chunk of data to an accumulator.
+
+    Parameters
+    ----------
+    accumulator : dict
+        The accumulator, from newAccumulator().
+    chunk : xarray.Dataset
+        The data, with dimensions (lead_time, time, station), the observation and the forecast variables, and
+        optionally the distance to the nearest storm (as added by linReg.Statistics.loadData()).
+    observation : str
+        The name of the observed variable, e.g. "wind_speed_of_gust" or "precipitation_amount".
+    **kwargs : dict
+        The forecast, as variable names. The valid keyword arguments are:
+        - point : str
+            The deterministic forecast (or the forecast mean / median), used for the MAE, bias and RMSE.
+        - mu, sigma : str
+            A Gaussian forecast.
+        - location, scale, shape : str
+            A GEV forecast.
+        - members : str
+            An ensemble forecast, whose members are along dimension memberDim (by default "member").
+        - distance : str
+            The distance to the nearest storm, by default "distance".
+
+    Returns
+    -------
+    dict
+        The accumulator.
+    """
+    memberDim = kwargs.get("memberDim", "member")
+    if "lead_time" not in chunk.dims:
+        chunk = chunk.expand_dims(lead_time = accumulator["lead_time"][:1])
+    # Growing the accumulator with the lead times and stations it has not seen yet (e.g. partitions of other months)
+    leadTimes, stations = pd.Index(accumulator["lead_time"]), pd.Index(accumulator["station"])
+    if not (chunk.lead_time.to_index().isin(leadTimes).all() and chunk.station.to_index().isin(stations).all()):
+        accumulator.update(_regroup(accumulator, leadTimes.union(chunk.lead_time.to_index()), stations.union(chunk.station.to_index())))
+    chunk = chunk.reindex(lead_time = accumulator["lead_time"], station = accumulator["station"])
+    reference = next(kwargs[key] for key in ("point", "mu", "location", "members") if key in kwargs)
+    reference = chunk[reference].isel({memberDim: 0}, drop = True, missing_dims = "ignore")
+    template = chunk[observation].broadcast_like(reference).transpose("lead_time", "time", "station")
+    L, Tm, S = template.shape
+
+    def flat(name):
+        return chunk[name].broadcast_like(template).transpose("lead_time", "time", "station").values.ravel().astype(float)
+
+    y = template.values.ravel().astype(float)
+    forecast = {key: flat(name) for key, name in kwargs.items() if key in ("point", "mu", "sigma", "location", "scale", "shape")}
+    if "members" in kwargs:
+        members = chunk[kwargs["members"]].broadcast_like(template).transpose("lead_time", "time", "station", memberDim)
+        forecast["members"] = members.values.reshape(-1, members.sizes[memberDim]).astype(float)
+
+    # Group of each sample
+    hour = pd.DatetimeIndex(template.time.values).hour.values
+    distanceName = kwargs.get("distance", "distance")
+    if distanceName in chunk:
+        distance = flat(distanceName)
+        proximity = np.where(np.isnan(distance), len(accumulator["distanceBins"]) - 1,
+                             np.clip(np.searchsorted(accumulator["distanceBins"], distance, side = "right") - 1, 0, len(accumulator["distanceBins"]) - 2))
+    else:
+        proximity = np.full(L*Tm*S, len(accumulator["distanceBins"]) - 1)
+    lead, time, station = np.unravel_index(np.arange(L*Tm*S), (L, Tm, S))
+    group = np.ravel_multi_index((lead, station, hour[time], proximity), accumulator["shape"])
+
+    # Scores of each sample
+    valid = ~np.isnan(y)
+    if "members" in forecast:
+        crps = crpsEnsemble(forecast["members"], y)
+    elif "sigma" in forecast:
+        crps = crpsGaussian(forecast["mu"], forecast["sigma"], y)
+    elif "shape" in forecast:
+        crps = crpsGEV(forecast["location"], forecast["scale"], forecast["shape"], y)
+    else:
+        crps = np.abs(forecast["point"] - y) if "point" in forecast else np.full_like(y, np.nan)
+    point = forecast.get("point", forecast.get("mu", None))
+    if point is not None:
+        valid &= ~np.isnan(point)
+    valid &= ~np.isnan(crps)
+    error = (point - y) if point is not None else np.zeros_like(y)
+
+    G = len(accumulator["count"])
+    g = group[valid]
+    for name, values in (("count", np.ones_like(y)), ("error", error), ("absolute_error", np.abs(error)), ("squared_error", error**2), ("crps", crps)):
+        accumulator[name] += np.bincount(g, weights = values[valid], minlength = G)
+
+    nbins = accumulator["probabilityBins"]
+    for i, threshold in enumerate(accumulator["thresholds"]):
+        probability = np.asarray(exceedanceProbability(threshold, **forecast))
+        ok = valid & ~np.isnan(probability)
+        p, observed, g = probability[ok], (y[ok] > threshold).astype(float), group[ok]
+        accumulator["brier_count"][i] += np.bincount(g, minlength = G)
+        accumulator["brier"][i] += np.bincount(g, weights = (p - observed)**2, minlength = G)
+        cell = np.minimum((p*nbins).astype(int), nbins - 1)*G + g
+        accumulator["reliability_count"][i] += np.bincount(cell, minlength = nbins*G).reshape(nbins, G)
+        accumulator["reliability_probability"][i] += np.bincount(cell, weights = p, minlength = nbins*G).reshape(nbins, G)
+        accumulator["reliability_observed"][i] += np.bincount(cell, weights = observed, minlength = nbins*G).reshape(nbins, G)
+    return accumulator
+
+def mergeAccumulators(*accumulators):
+    """
+    Merge accumulators filled on different chunks of data (e.g. by different workers).
+
+    The sums are matched by lead time and station labels, over the union of the labels of the accumulators.
+
+    Parameters
+    ----------
+    *accumulators : dict
+        The accumulators, created with the same thresholds, distance bins and probability bins.
+
+    Returns
+    -------
+    dict
+        The merged accumulator.
+    """
+    first = accumulators[0]
+    leadTimes, stations = pd.Index(first["lead_time"]), pd.Index(first["station"])
+    for accumulator in accumulators:
+        if (accumulator["shape"][2:] != first["shape"][2:] or not np.array_equal(accumulator["thresholds"], first["thresholds"])
+            or not np.array_equal(accumulator["distanceBins"], first["distanceBins"])
+            or accumulator["probabilityBins"] != first["probabilityBins"]):
+            raise ValueError("Accumulators with different groups or thresholds cannot be merged.")
+        leadTimes, stations = leadTimes.union(pd.Index(accumulator["lead_time"])), stations.union(pd.Index(accumulator["station"]))
+    result = {key: (value.copy() if isinstance(value, np.ndarray) else value) for key, value in first.items()}
+    result.update(_regroup(first, leadTimes, stations))
+    for accumulator in accumulators[1:]:
+        regrouped = _regroup(accumulator, leadTimes, stations)
+        for name in _SUMS + _THRESHOLD_SUMS + _RELIABILITY_SUMS:
+            result[name] += regrouped[name]
+    return result
+
+def _regroup(accumulator, leadTimes, stations):
+    """
+    Get the sums of an accumulator over other lead time and station labels (a superset of its own), matched by label.
+    """
+    leadTimes, stations = pd.Index(leadTimes), pd.Index(stations)
+    if not (leadTimes.is_unique and stations.is_unique and pd.Index(accumulator["lead_time"]).is_unique
+            and pd.Index(accumulator["station"]).is_unique):
+        raise ValueError("The lead times and stations of an accumulator must be unique to be matched.")
+    leadIndex, stationIndex = leadTimes.get_indexer(accumulator["lead_time"]), stations.get_indexer(accumulator["station"])
+    if (leadIndex < 0).any() or (stationIndex < 0).any():
+        raise ValueError("The lead times and stations of the accumulator cannot be matched.")
+    L, S, H, D = accumulator["shape"]
+    shape = (len(leadTimes), len(stations), H, D)
+    target = np.ravel_multi_index(np.ix_(leadIndex, stationIndex, np.arange(H), np.arange(D)), shape).ravel()
+    result = {"shape": shape, "lead_time": leadTimes.values, "station": stations.values}
+    for name in _SUMS + _THRESHOLD_SUMS + _RELIABILITY_SUMS:
+        values = accumulator[name]
+        result[name] = np.zeros(values.shape[:-1] + (int(np.prod(shape)),))
+        result[name][..., target] = values
+    return result
+
+def scores(accumulator, dims = ("lead_time",)):
+    """
+    Compute the verification scores of an accumulator, aggregated over the groups.
+
+    Parameters
+    ----------
+    accumulator : dict
+        The accumulator.
+    dims : tuple
+        The grouping dimensions to keep, among "lead_time", "station", "hour" and "proximity".
+        The other ones are summed over.
+
+    Returns
+    -------
+    xarray.Dataset
+        The number of samples, bias, MAE, RMSE, CRPS and, per threshold, the Brier score and reliability curve
+        (mean forecast probability, observed frequency and count per probability bin).
+    """
+    edges = accumulator["distanceBins"]
+    coords = {"lead_time": accumulator["lead_time"], "station": accumulator["station"], "hour": np.arange(24),
+              "proximity": [f"[{edges[i]:g}, {edges[i + 1]:g})" for i in range(len(edges) - 1)] + ["none"]}
+    groupDims = ["lead_time", "station", "hour", "proximity"]
+
+    def reduce(values, extra = ()):
+        array = xr.DataArray(values.reshape(values.shape[:len(extra)] + accumulator["shape"]), dims = list(extra) + groupDims,
+                             coords = {dim: coords[dim] for dim in groupDims})
+        return array.sum(dim = [dim for dim in groupDims if dim not in dims])
+
+    sums = {name: reduce(accumulator[name]) for name in _SUMS}
+    brier = {name: reduce(accumulator[name], ("threshold",)) for name in _THRESHOLD_SUMS}
+    reliability = {name: reduce(accumulator[name], ("threshold", "probability_bin")) for name in _RELIABILITY_SUMS}
+    count = sums["count"].where(sums["count"] > 0)
+    result = xr.Dataset({
+        "count": sums["count"],
+        "bias": sums["error"]/count,
+        "mae": sums["absolute_error"]/count,
+        "rmse": np.sqrt(sums["squared_error"]/count),
+        "crps": sums["crps"]/count,
+        "brier": brier["brier"]/brier["brier_count"].where(brier["brier_count"] > 0),
+        "forecast_probability": reliability["reliability_probability"]/reliability["reliability_count"].where(reliability["reliability_count"] > 0),
+        "observed_frequency": reliability["reliability_observed"]/reliability["reliability_count"].where(reliability["reliability_count"] > 0),
+        "reliability_count": reliability["reliability_count"],
+    })
+    return result.assign_coords(threshold = accumulator["thresholds"],
+                                probability_bin = (np.arange(accumulator["probabilityBins"]) + 0.5)/accumulator["probabilityBins"])
+
+def verify(data, observation, **kwargs):
+    """
+    Verify forecasts against observations in one streaming pass, optionally in parallel over partitions.
+
+    Parameters
+    ----------
+    data : xarray.Dataset or str or iterable of xarray.Dataset
+        The data, as in linReg.LRtoolbox.sufficientStatistics(): loadData() output, a directory of monthly
+        partitions or successive chunks.
+    observation : str
+        The name of the observed variable.
+    **kwargs : dict
+        Additional keyword arguments.
+        These can include:
+            point, mu, sigma, location, scale, shape, members, memberDim, distance : str
+                The forecast, as in accumulate().
+            thresholds, distanceBins, probabilityBins
+                As in newAccumulator().
+            prepare : callable
+                A function applied to each chunk before it is verified, e.g. to add the forecast of a model
+                with linReg.LRtoolbox.predict(). It must be picklable to be used with workers.
+            chunkSize : int
+                The number of time steps read at once, by default 744.
+            workers : int
+                If data is a directory of partitions, the number of processes sharing them, by default 1.
+
+    Returns
+    -------
+    dict
+        The accumulator, to be passed to scores() or merged with other accumulators.
+    """
+    workers = kwargs.pop("workers", 1)
+    if isinstance(data, str) and workers > 1:
+        files = lrtb.partitionFiles(data)
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            parts = list(executor.map(_verifyFiles, [files[i::workers] for i in range(workers)], [observation]*workers, [kwargs]*workers))
+        return mergeAccumulators(*[part for part in parts if part is not None])
+    return _verifyChunks(lrtb._chunks(data, kwargs.get("chunkSize", 744)), observation, kwargs)
+
+def _verifyFiles(files, observation, kwargs):
+    if len(files) == 0:
+        return None
+    return _verifyChunks(lrtb._chunks((xr.open_dataset(file) for file in files), kwargs.get("chunkSize", 744)), observation, kwargs)
+
+def _verifyChunks(chunks, observation, kwargs):
+    prepare = kwargs.get("prepare", None)
+    forecast = {key: value for key, value in kwargs.items() if key in ("point", "mu", "sigma", "location", "scale", "shape", "members", "memberDim", "distance")}
+    accumulator = None
+    for chunk in chunks:
+        if prepare is not None:
+            chunk = prepare(chunk)
+        if accumulator is None:
+            accumulator = newAccumulator(chunk.lead_time.values if "lead_time" in chunk.dims else [0], chunk.station.values,
+                                         **{key: kwargs[key] for key in ("thresholds", "distanceBins", "probabilityBins") if key in kwargs})
+        accumulate(accumulator, chunk, observation, **forecast)
+    return accumulator
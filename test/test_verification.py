@@ -0,0 +1,52 @@
+import os, sys, json
+dev_path = os.path.join(os.path.dirname(__file__))
+src_path = os.path.join(dev_path, "..", 'src')
+sys.path.append(src_path)
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+import verification.VERtoolbox as vertb
+
+def partition(stations, bias, month):
+    """
+    A partition of the stations, whose point forecast is the observation plus bias.
+    """
+    time = pd.date_range(month, periods = 3, freq = "h")
+    observation = np.arange(3*len(stations), dtype = float).reshape(3, len(stations))
+    return xr.Dataset({"obs": (("time", "station"), observation),
+                       "forecast": (("lead_time", "time", "station"), observation[None] + bias)},
+                      coords = {"lead_time": [0], "time": time, "station": stations})
+
+def test_merge_partitions_with_different_stations():
+    first, second = vertb.newAccumulator([0], ["A", "B"]), vertb.newAccumulator([0], ["C", "D"])
+    vertb.accumulate(first, partition(["A", "B"], -1., "2020-06"), "obs", point = "forecast")
+    vertb.accumulate(second, partition(["C", "D"], -5., "2020-07"), "obs", point = "forecast")
+
+    result = vertb.scores(vertb.mergeAccumulators(first, second), dims = ("station",))
+    assert list(result.station.values) == ["A", "B", "C", "D"]
+    assert list(result["count"].values) == [3, 3, 3, 3]
+    assert np.allclose(result["bias"].values, [-1., -1., -5., -5.])
+
+def test_accumulate_grows_with_new_stations():
+    accumulator = vertb.newAccumulator([0], ["A", "B"])
+    vertb.accumulate(accumulator, partition(["A", "B"], -1., "2020-06"), "obs", point = "forecast")
+    vertb.accumulate(accumulator, partition(["B", "C"], -5., "2020-07"), "obs", point = "forecast")
+
+    result = vertb.scores(accumulator, dims = ("station",))
+    assert list(result.station.values) == ["A", "B", "C"]
+    assert list(result["count"].values) == [3, 6, 3]
+    assert np.allclose(result["bias"].values, [-1., -3., -5.])
+
+def test_verify_partitions_in_parallel(tmp_path):
+    manifest = {}
+    for month, stations, bias in (("2020-06", ["A", "B"], -1.), ("2020-07", ["C", "D"], -5.)):
+        manifest[month] = {"file": f"PW_SMN_{month.replace('-', '')}.nc", "fingerprint": ""}
+        partition(stations, bias, month).to_netcdf(tmp_path / manifest[month]["file"])
+    with open(tmp_path / "manifest.json", "w") as f:
+        json.dump(manifest, f)
+
+    result = vertb.scores(vertb.verify(str(tmp_path), "obs", point = "forecast", workers = 2), dims = ("station",))
+    assert list(result.station.values) == ["A", "B", "C", "D"]
+    assert np.allclose(result["bias"].values, [-1., -1., -5., -5.])